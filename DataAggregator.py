@@ -1,5 +1,6 @@
 import logging
-import json
+from aggregation import Aggregator, summarize, summarize_table
+from jsonl_io import JsonlWriter
 
 #setting up logger
 logger = logging.getLogger()
@@ -7,35 +8,41 @@ console_handler = logging.StreamHandler()
 console_handler.setLevel(logging.INFO)
 logger.addHandler(console_handler)
 
-def safe_get_confidence(entry):
-    try:
-        confidence = float(entry.get('confidence'))
-        return confidence
-    except (ValueError, TypeError):
-        logger.warning(f'Confidence value {entry.get("confidence")} cant be converted to float')
-        return 0
-
-def data_aggregator(validated_data):
-    aggregated_data = {}
-    for entry in validated_data:
-        imgID = entry.get('imgID')
-        if imgID not in aggregated_data:
-            aggregated_data[imgID] = {}
-            aggregated_data[imgID]['detections'] = [entry.get('label')]
-            aggregated_data[imgID]['max_conf'] = safe_get_confidence(entry)
-            aggregated_data[imgID]['count'] = 1
-
-        else:
-            if entry.get('label') not in aggregated_data[imgID]['detections']:
-                aggregated_data[imgID]['detections'].append(entry.get('label'))
-            if aggregated_data[imgID]['max_conf'] < safe_get_confidence(entry):
-                aggregated_data[imgID]['max_conf'] = safe_get_confidence(entry)
-            aggregated_data[imgID]['count'] += 1
-
-    with open('aggregated_data.json', 'w') as f:
-        json.dump(aggregated_data, f, indent=4)
-
-
-
-
-
+# Records keep the field name the per-image summaries have always used for their image
+KEY_FIELDS = {'image_path': 'imgID'}
+
+def data_aggregator(validated_data, keys='image_path', output_path='aggregated_data.jsonl', detailed=False):
+    """
+    Aggregates detections per group in one pass and saves one record per group.
+
+    By default each record is {'imgID': image path, 'detections': unique labels,
+    'max_conf', 'count'}, as before; other keys get their own field instead of imgID.
+    detailed=True uses aggregation.Aggregator instead, whose records have a
+    different schema: the key fields, count, max_conf, mean_conf, p50_conf,
+    p90_conf, 'labels' (in place of 'detections') and flag_reasons.
+
+    Args:
+        validated_data (iterable): Detection dicts (as produced by VisionWorker and the pipeline stages),
+            or a detection_table.DetectionTable, which is aggregated without going through dicts.
+        keys (str or tuple): Group key(s), see aggregation.Aggregator (e.g. 'label', ('split', 'flag_kind')).
+        output_path (str): JSONL file for the per-group records, None to skip saving.
+        detailed (bool): Also compute mean and percentile confidence and a flag-reason histogram.
+
+    Returns:
+        dict: {group key: summary}, the records without their key fields.
+    """
+    keys = (keys,) if isinstance(keys, str) else tuple(keys)
+    is_table = hasattr(validated_data, 'frame')
+    if detailed:
+        aggregator = Aggregator(keys)
+        result = (aggregator.update_table(validated_data) if is_table else aggregator.update(validated_data)).result()
+    else:
+        result = summarize_table(validated_data, keys) if is_table else summarize(validated_data, keys)
+
+    if output_path:
+        with JsonlWriter(output_path) as writer:
+            for group, summary in result.items():
+                values = group if len(keys) > 1 else (group,)
+                writer.write({**{KEY_FIELDS.get(key, key): value for key, value in zip(keys, values)}, **summary})
+
+    return result
@@ -0,0 +1,269 @@
+import logging
+import re
+import polars as pl
+
+logger = logging.getLogger(__name__)
+
+# Confidences are histogrammed in 0.01 bins: exact for the 2-decimal values
+# VisionWorker produces, and histograms of different shards simply add up
+CONFIDENCE_BIN = 0.01
+
+# Group keys computed from detection fields instead of read directly
+DERIVED_KEYS = {
+    # data/<split>/images/x.jpg -> <split>
+    'split': pl.col('image_path').str.extract(r'([^/\\]+)[/\\]images[/\\][^/\\]+$', 1),
+    # 'Low IoU with GT (0.32)' -> 'Low IoU with GT'
+    'flag_kind': pl.col('flag_reason').str.split(' (').list.first(),
+}
+SOURCE_FIELDS = {'split': 'image_path', 'flag_kind': 'flag_reason'}
+
+_SPLIT_PATTERN = re.compile(r'([^/\\]+)[/\\]images[/\\][^/\\]+$')
+
+# DERIVED_KEYS for a single detection dict, used by summarize()
+DERIVED_VALUES = {
+    'split': lambda entry: (match.group(1) if (match := _SPLIT_PATTERN.search(entry.get('image_path') or ''))
+                            else None),
+    'flag_kind': lambda entry: entry['flag_reason'].split(' (')[0] if entry.get('flag_reason') else None,
+}
+
+# Partial aggregate tables: one row per group, per (group, bin), per (group, label), per (group, flag kind)
+PARTS = ('groups', 'hist', 'labels', 'flags')
+
+
+class Aggregator:
+    """
+    Vectorized, mergeable aggregation of detections grouped by any key.
+
+    Keys are detection fields ('image_path', 'label', 'flag_reason',
+    'vlm_verification', ...) or names in DERIVED_KEYS ('split', 'flag_kind');
+    several keys group by their combination. Per group it reports count, max,
+    mean and percentile confidence, first-seen ordered unique labels and a
+    histogram of flag kinds.
+
+    Entries are added in chunks (update, update_table) and each chunk is
+    reduced to small partial tables with Polars group-bys. Aggregators built
+    on shards combine with merge() into exactly the single-run result, as if
+    the other shard's rows came after this one's.
+
+    Args:
+        keys (str or tuple): Group key(s).
+        percentiles (tuple): Confidence percentiles reported per group (nearest rank on 0.01 bins).
+        chunk_size (int): Dict entries converted to a frame at a time by update().
+    """
+
+    def __init__(self, keys='image_path', percentiles=(50, 90), chunk_size=500_000):
+        self.keys = (keys,) if isinstance(keys, str) else tuple(keys)
+        self.percentiles = tuple(percentiles)
+        self.chunk_size = chunk_size
+        self.rows = 0
+        self.parts = None
+
+    def _fields(self):
+        fields = ['label', 'confidence', 'flag_reason']
+        for key in self.keys:
+            field = SOURCE_FIELDS.get(key, key)
+            if field not in fields:
+                fields.append(field)
+        return fields
+
+    def update(self, entries):
+        """Adds detection dicts (any iterable, consumed chunk by chunk)."""
+        chunk = []
+        for entry in entries:
+            chunk.append(entry)
+            if len(chunk) == self.chunk_size:
+                self._add_dicts(chunk)
+                chunk = []
+        if chunk:
+            self._add_dicts(chunk)
+        return self
+
+    def update_table(self, table):
+        """Adds a detection_table.DetectionTable (or a frame with the same columns) without going through dicts."""
+        frame = getattr(table, 'frame', table)
+        self._add_frame(frame.select([pl.col(field) for field in self._fields()]))
+        return self
+
+    def _add_dicts(self, entries):
+        fields = self._fields()
+        schema = {field: pl.Float64 if field == 'confidence' else pl.String for field in fields}
+        try:
+            frame = pl.from_dicts(entries, schema=schema)
+        except (pl.exceptions.PolarsError, TypeError):
+            # Mixed-type fields (e.g. confidence strings): build the columns one by one
+            frame = pl.DataFrame({field: pl.Series(field, [entry.get(field) for entry in entries],
+                                                   dtype=pl.Float64 if field == 'confidence' else None, strict=False)
+                                  for field in fields})
+        self._add_frame(frame)
+
+    def _add_frame(self, frame):
+        frame = frame.with_columns([pl.col(name).cast(pl.String) for name in frame.columns if name != 'confidence'])
+        bad = frame['confidence'].null_count() + frame['confidence'].is_nan().sum()
+        if bad:
+            logger.warning(f'{bad} confidence values cant be converted to float, counted as 0')
+        frame = frame.with_columns(
+            pl.col('confidence').cast(pl.Float64).fill_nan(None).fill_null(0.0),
+            pl.int_range(self.rows, self.rows + frame.height, dtype=pl.Int64).alias('row'),
+            *[DERIVED_KEYS[key].alias(key) for key in self.keys if key in DERIVED_KEYS],
+        )
+        self.rows += frame.height
+        self._merge_parts(self._reduce(frame))
+
+    def _reduce(self, frame):
+        keys = list(self.keys)
+        bin_index = (pl.col('confidence') / CONFIDENCE_BIN).round().cast(pl.Int64).alias('bin')
+        return {
+            'groups': frame.group_by(keys).agg(
+                pl.len().alias('count'),
+                pl.col('confidence').sum().alias('conf_sum'),
+                pl.col('confidence').max().alias('conf_max'),
+                pl.col('row').min().alias('first'),
+            ),
+            'hist': frame.group_by(keys + [bin_index]).agg(pl.len().alias('n')),
+            'labels': frame.group_by(keys + [pl.col('label').alias('label_value')])
+                           .agg(pl.col('row').min().alias('first')),
+            'flags': frame.filter(pl.col('flag_reason').is_not_null() & (pl.col('flag_reason') != ''))
+                          .group_by(keys + [pl.col('flag_reason').str.split(' (').list.first().alias('kind')])
+                          .agg(pl.len().alias('n')),
+        }
+
+    def _merge_parts(self, parts):
+        if self.parts is None:
+            self.parts = parts
+            return
+        keys = list(self.keys)
+        combined = {name: pl.concat([self.parts[name], parts[name]], how='vertical_relaxed') for name in PARTS}
+        self.parts = {
+            'groups': combined['groups'].group_by(keys).agg(
+                pl.col('count').sum(), pl.col('conf_sum').sum(), pl.col('conf_max').max(), pl.col('first').min()),
+            'hist': combined['hist'].group_by(keys + ['bin']).agg(pl.col('n').sum()),
+            'labels': combined['labels'].group_by(keys + ['label_value']).agg(pl.col('first').min()),
+            'flags': combined['flags'].group_by(keys + ['kind']).agg(pl.col('n').sum()),
+        }
+
+    def merge(self, other):
+        """Adds another aggregator's groups (same keys) into this one, e.g. from another shard."""
+        if other.keys != self.keys:
+            raise ValueError(f"Cannot merge aggregates grouped by {other.keys} into {self.keys}")
+        if other.parts is not None:
+            shifted = {name: other.parts[name] for name in PARTS}
+            for name in ('groups', 'labels'):
+                shifted[name] = shifted[name].with_columns(pl.col('first') + self.rows)
+            self._merge_parts(shifted)
+        self.rows += other.rows
+        return self
+
+    def to_frame(self):
+        """One row per group, in first-seen order: the key columns followed by the statistics."""
+        keys = list(self.keys)
+        if self.parts is None:
+            return pl.DataFrame()
+
+        # Nearest-rank percentiles: the first bin whose running count reaches the rank.
+        # Groups are identified by their first row, which is cheaper to sort and join on than the keys
+        groups = self.parts['groups']
+        hist = (self.parts['hist'].join(groups.select(keys + ['count', 'first']), on=keys, nulls_equal=True)
+                .sort(['first', 'bin'])
+                .with_columns(pl.col('n').cum_sum().over('first').alias('seen')))
+        percentiles = hist.group_by('first').agg([
+            (pl.col('bin').filter(pl.col('seen') >= (pl.col('count') * q / 100).ceil().clip(lower_bound=1)).first()
+             * CONFIDENCE_BIN).round(2).alias(f'p{q:g}_conf')
+            for q in self.percentiles
+        ])
+
+        labels = (self.parts['labels'].sort('first').group_by(keys, maintain_order=True)
+                  .agg(pl.col('label_value').alias('labels')))
+        flags = (self.parts['flags'].sort('kind').group_by(keys, maintain_order=True)
+                 .agg(pl.struct('kind', 'n').alias('flag_reasons')))
+
+        return (groups.join(percentiles, on='first', how='left')
+                .join(labels, on=keys, how='left', nulls_equal=True)
+                .join(flags, on=keys, how='left', nulls_equal=True)
+                .sort('first')
+                .select(keys + [pl.col('count'), pl.col('conf_max').alias('max_conf'),
+                                (pl.col('conf_sum') / pl.col('count')).alias('mean_conf')]
+                        + [f'p{q:g}_conf' for q in self.percentiles]
+                        + ['labels', 'flag_reasons']))
+
+    def to_records(self):
+        """One flat dict per group, the key fields first (e.g. for jsonl_io.JsonlWriter)."""
+        records = self.to_frame().to_dicts()
+        for record in records:
+            record['flag_reasons'] = {item['kind']: item['n'] for item in record['flag_reasons'] or []}
+        return records
+
+    def result(self):
+        """Returns {group key: summary dict} in first-seen group order (tuple keys for several keys)."""
+        result = {}
+        for record in self.to_records():
+            values = tuple(record.pop(key) for key in self.keys)
+            result[values if len(self.keys) > 1 else values[0]] = record
+        return result
+
+
+def summarize(entries, keys='image_path'):
+    """
+    Count, max confidence and first-seen unique labels per group in one pass over dicts.
+
+    The summary data_aggregator has always produced. With only these three
+    statistics a plain loop beats building frames (see bench/bench_aggregation.py);
+    use Aggregator for percentiles, flag histograms, shards or DetectionTables.
+
+    Returns:
+        dict: {group key: {'detections': labels, 'max_conf': float, 'count': int}} in
+              first-seen group order (tuple keys for several keys).
+    """
+    keys = (keys,) if isinstance(keys, str) else tuple(keys)
+    getters = [DERIVED_VALUES.get(key) or (lambda entry, key=key: entry.get(key)) for key in keys]
+    getter = getters[0] if len(keys) == 1 else lambda entry: tuple(get(entry) for get in getters)
+    field = keys[0] if len(keys) == 1 and keys[0] not in DERIVED_VALUES else None
+    groups = {}
+    bad = 0
+    for entry in entries:
+        get = entry.get
+        confidence = get('confidence')
+        if confidence.__class__ is not float:
+            try:
+                confidence = float(confidence)
+            except (ValueError, TypeError):
+                confidence = 0.0
+                bad += 1
+        group = get(field) if field else getter(entry)
+        label = get('label')
+        summary = groups.get(group)
+        if summary is None:
+            groups[group] = {'detections': [label], 'max_conf': confidence, 'count': 1}
+        else:
+            # A group has few distinct labels, a list beats a set here
+            if label not in summary['detections']:
+                summary['detections'].append(label)
+            if confidence > summary['max_conf']:
+                summary['max_conf'] = confidence
+            summary['count'] += 1
+    if bad:
+        logger.warning(f'{bad} confidence values cant be converted to float, counted as 0')
+    return groups
+
+
+def summarize_table(table, keys='image_path'):
+    """summarize() over a detection_table.DetectionTable (or a frame with its columns) with one group-by."""
+    frame = getattr(table, 'frame', table)
+    keys = (keys,) if isinstance(keys, str) else tuple(keys)
+    derived = [key for key in keys if key in DERIVED_KEYS]
+    if derived:
+        frame = (frame.with_columns([pl.col(SOURCE_FIELDS[key]).cast(pl.String) for key in derived])
+                 .with_columns([DERIVED_KEYS[key].alias(key) for key in derived]))
+    summaries = frame.group_by(list(keys), maintain_order=True).agg(
+        pl.col('label').unique(maintain_order=True).alias('detections'),
+        pl.col('confidence').cast(pl.Float64, strict=False).fill_nan(None).fill_null(0.0).max().alias('max_conf'),
+        pl.len().alias('count'),
+    )
+    groups = summaries.select(keys[0] if len(keys) == 1 else pl.struct(list(keys))).to_series().to_list()
+    if len(keys) > 1:
+        groups = [tuple(group.values()) for group in groups]
+    return dict(zip(groups, summaries.select('detections', 'max_conf', 'count').to_dicts()))
+
+
+def aggregate(entries, keys='image_path', percentiles=(50, 90)):
+    """Aggregates detection dicts (see Aggregator). Returns {group key: summary}."""
+    return Aggregator(keys, percentiles).update(entries).result()
@@ -0,0 +1,386 @@
+import asyncio
+import random
+import time
+import metrics
+from pathlib import Path
+from vlm_backends import VLMError
+
+# Rate-limit responses within this many seconds of a rate decrease do not decrease it again
+RATE_LIMIT_COOLDOWN_S = 5.0
+
+
+class TokenBucket:
+    """
+    Async token-bucket rate limiter sized in requests per minute.
+
+    The rate adapts: it is halved on a rate-limit response (down to min_rpm) and
+    recovers additively on successes, back up to the configured rpm. Requests in
+    flight when the limit hit fail together, so the rate is halved at most once per
+    `cooldown` seconds. A server-requested Retry-After pauses every acquire until it
+    has passed.
+    """
+
+    def __init__(self, rpm, burst=None, min_rpm=1.0, cooldown=RATE_LIMIT_COOLDOWN_S):
+        self.max_rpm = float(rpm)
+        self.rpm = float(rpm)
+        self.min_rpm = min(float(min_rpm), self.max_rpm)
+        self.capacity = float(burst) if burst else max(1.0, self.rpm / 60.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.cooldown = cooldown
+        self.paused_until = 0.0
+        self._last_decrease = None
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rpm / 60.0)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                pause = self.paused_until - time.monotonic()
+                if pause > 0:
+                    await asyncio.sleep(pause)
+                    continue
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * 60.0 / self.rpm)
+
+    def on_rate_limited(self, retry_after=None):
+        now = time.monotonic()
+        if retry_after:
+            self.paused_until = max(self.paused_until, now + retry_after)
+        if self._last_decrease is not None and now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._refill()
+        self.rpm = max(self.min_rpm, self.rpm / 2)
+
+    def on_success(self):
+        if self.rpm < self.max_rpm:
+            self._refill()
+            self.rpm = min(self.max_rpm, self.rpm + self.max_rpm / 100)
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0, rng=random):
+    """Full-jitter exponential backoff: uniform(0, min(cap, base * 2**attempt))."""
+    return rng.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+async def _call_with_retries(backend, prompt, image, limiter, max_retries, stats):
+    """Calls the backend, retrying 429/5xx with backoff. Raises the last error when giving up."""
+    from vlm_auditor import timed_acall
+
+    for attempt in range(max_retries + 1):
+        if limiter:
+            await limiter.acquire()
+        try:
+            text = await timed_acall(backend.agenerate, prompt, image)
+        except VLMError as e:
+            if e.retryable and attempt < max_retries:
+                stats['retries'] += 1
+                metrics.count('vlm_retries')
+                if limiter and e.status_code == 429:
+                    limiter.on_rate_limited(e.retry_after)
+                # The server's Retry-After is a floor for the jittered backoff
+                await asyncio.sleep(max(backoff_delay(attempt), e.retry_after or 0.0))
+                continue
+            raise
+        if limiter:
+            limiter.on_success()
+        stats['calls'] += 1
+        return text
+
+
+async def _audit_one(item, backend, limiter, max_retries, stats, cache=None, payload_builder=None):
+    # Imported here to avoid a circular import with vlm_auditor
+    from vlm_auditor import build_prompt, parse_vlm_answer, apply_verdict, request_tag, load_vlm_image
+
+    image_path = item.get('image_path')
+    detected_label = item.get('label', 'object')
+    bbox = item.get('bbox')
+
+    if not image_path or not Path(image_path).exists():
+        print(f"Skipping missing image: {image_path}")
+        item['vlm_verification'] = "IMAGE_NOT_FOUND"
+        return item
+
+    cache_key = None
+    if cache is not None:
+        try:
+            # Hashing and SQLite I/O stay off the event loop
+            cache_key = await asyncio.to_thread(cache.make_key, image_path, detected_label,
+                                                request_tag(bbox, payload_builder), backend.model_name)
+            cached = await asyncio.to_thread(cache.get, cache_key)
+        except Exception as e:
+            # Treated as a miss; the verdict is not stored either
+            print(f"Error reading cached verdict for {image_path}: {e}")
+            cache_key = cached = None
+        if cached is not None:
+            return apply_verdict(item, cached)
+
+    try:
+        image = await asyncio.to_thread(load_vlm_image, image_path, bbox, payload_builder)
+        prompt = build_prompt(detected_label, cropped=payload_builder is not None and bool(bbox))
+        text = await _call_with_retries(backend, prompt, image, limiter, max_retries, stats)
+    except Exception as e:
+        print(f"Error processing {image_path}: {e}")
+        return apply_verdict(item, "ERROR")
+
+    vlm_result = parse_vlm_answer(text)
+    if cache_key is not None:
+        try:
+            await asyncio.to_thread(cache.put, cache_key, vlm_result)
+        except Exception as e:
+            print(f"Error caching verdict for {image_path}: {e}")
+    return apply_verdict(item, vlm_result)
+
+
+async def _audit_group(items, backend, limiter, max_retries, stats, cache=None, payload_builder=None):
+    """
+    Audits all items of one image: cached verdicts first, then one batched request for the
+    remaining boxes, then single-item calls for anything the batch did not settle.
+    """
+    from vlm_auditor import prepare_batch_request, cached_verdicts, apply_verdict
+    from vlm_batching import parse_batch_answer, is_batchable
+
+    image_path = items[0].get('image_path')
+    settled = set()
+    if image_path and Path(image_path).exists():
+        try:
+            hits, keys = await asyncio.to_thread(cached_verdicts, items, backend, cache, payload_builder)
+        except Exception as e:
+            # Treated as all misses; nothing is stored without keys
+            print(f"Error reading cached verdicts for {image_path}: {e}")
+            hits, keys = {}, {}
+        for i, verdict in hits.items():
+            apply_verdict(items[i], verdict)
+        settled = set(hits)
+
+        pending = [i for i in range(len(items)) if i not in settled and is_batchable(items[i])]
+        if len(pending) > 1:
+            verdicts = None
+            try:
+                prompt, image = await asyncio.to_thread(prepare_batch_request, image_path,
+                                                        [items[i] for i in pending], payload_builder)
+                text = await _call_with_retries(backend, prompt, image, limiter, max_retries, stats)
+                verdicts = parse_batch_answer(text, len(pending))
+            except Exception as e:
+                print(f"Error processing batch for {image_path}: {e}")
+            if verdicts is not None:
+                stats['batched_items'] += len(pending)
+                for i, verdict in zip(pending, verdicts):
+                    apply_verdict(items[i], verdict)
+                if keys:
+                    try:
+                        await asyncio.to_thread(cache.put_many, [(keys[i], verdict) for i, verdict in
+                                                                 zip(pending, verdicts) if i in keys])
+                    except Exception as e:
+                        print(f"Error caching verdicts for {image_path}: {e}")
+                settled.update(pending)
+
+    return [items[i] if i in settled else
+            await _audit_one(items[i], backend, limiter, max_retries, stats, cache, payload_builder)
+            for i in range(len(items))]
+
+
+async def audit_items_async(audit_data, backend, concurrency=8, rpm=None, max_retries=5, cache=None,
+                            payload_builder=None, batch=False, on_result=None):
+    """
+    Audits items with up to `concurrency` requests in flight.
+
+    Args:
+        audit_data (list): Audit item dicts (as in to_audit.json).
+        backend (VLMBackend): Model to query.
+        concurrency (int): Maximum number of requests in flight.
+        rpm (float): Requests-per-minute budget for the token bucket, None for unlimited.
+        max_retries (int): Retries per item on 429/5xx, with jittered exponential backoff.
+        cache (VerdictCache): Checked before every call and updated with new verdicts.
+        payload_builder (PayloadBuilder): Sends cropped, downscaled payloads instead of full frames.
+        batch (bool): One request per image covering all of its flagged boxes.
+        on_result (callable): Called with each audited item as soon as it is done.
+
+    Returns:
+        tuple: (results in input order, stats dict with 'calls', 'retries', 'batched_items' and 'elapsed')
+    """
+    from vlm_batching import group_by_image
+
+    limiter = TokenBucket(rpm) if rpm else None
+    stats = {'calls': 0, 'retries': 0, 'batched_items': 0}
+    results = [None] * len(audit_data)
+    queue = asyncio.Queue()
+    units = group_by_image(audit_data).values() if batch else ([i] for i in range(len(audit_data)))
+    for positions in units:
+        queue.put_nowait(positions)
+
+    async def worker():
+        while True:
+            try:
+                positions = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if len(positions) > 1:
+                items = await _audit_group([audit_data[p] for p in positions], backend, limiter, max_retries,
+                                           stats, cache, payload_builder)
+            else:
+                items = [await _audit_one(audit_data[positions[0]], backend, limiter, max_retries, stats, cache,
+                                          payload_builder)]
+            for position, item in zip(positions, items):
+                results[position] = item
+                if on_result:
+                    on_result(item)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, queue.qsize())))))
+    stats['elapsed'] = time.perf_counter() - start
+    return results, stats
+
+
+def audit_items(audit_data, backend, concurrency=8, rpm=None, max_retries=5, cache=None, payload_builder=None,
+                batch=False, on_result=None):
+    """Synchronous wrapper around audit_items_async."""
+    return asyncio.run(audit_items_async(audit_data, backend, concurrency, rpm, max_retries, cache,
+                                         payload_builder, batch, on_result))
+
+
+class AuditStream:
+    """
+    Audits items as they are produced, on a background event loop thread.
+
+    Producers call submit() with the flagged items of one image while upstream
+    stages keep running; close() waits for the remaining audits and returns
+    every item in submission order.
+
+    Args:
+        backend (VLMBackend): Model to query, None marks every item as not configured.
+        concurrency, rpm, max_retries, cache, payload_builder, batch: As in audit_items_async.
+        on_result (callable): Called on the audit thread with (position, item) as each item is done.
+        keep_results (int): Done items kept for get() and close(), oldest dropped first; None keeps all.
+    """
+
+    def __init__(self, backend, concurrency=8, rpm=None, max_retries=5, cache=None, payload_builder=None,
+                 batch=False, on_result=None, keep_results=None):
+        from collections import deque
+        import threading
+
+        self.backend = backend
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.cache = cache
+        self.payload_builder = payload_builder
+        self.batch = batch
+        self.on_result = on_result
+        self.stats = {'calls': 0, 'retries': 0, 'batched_items': 0}
+        self.keep_results = keep_results
+        # Position -> item, None while pending; done positions in completion order for eviction
+        self.results = {}
+        self._submitted = 0
+        self._done = deque()
+        self._rpm = rpm
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        self._workers = asyncio.run_coroutine_threadsafe(self._start_workers(), self._loop).result()
+        self._start = time.perf_counter()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _start_workers(self):
+        self._queue = asyncio.Queue()
+        self._changed = asyncio.Condition()
+        self._limiter = TokenBucket(self._rpm) if self._rpm else None
+        return [asyncio.ensure_future(self._worker()) for _ in range(self.concurrency)]
+
+    async def _worker(self):
+        from vlm_auditor import apply_verdict
+
+        while True:
+            unit = await self._queue.get()
+            if unit is None:
+                return
+            positions, items = unit
+            try:
+                if self.backend is None:
+                    items = [apply_verdict(item, "ERROR: API KEY NOT CONFIGURED") for item in items]
+                elif len(items) > 1:
+                    items = await _audit_group(items, self.backend, self._limiter, self.max_retries, self.stats,
+                                               self.cache, self.payload_builder)
+                else:
+                    items = [await _audit_one(items[0], self.backend, self._limiter, self.max_retries,
+                                              self.stats, self.cache, self.payload_builder)]
+            except Exception as e:
+                # The worker keeps going; the items still resolve so waiters and on_result see them
+                print(f"Error auditing {items[0].get('image_path')}: {e}")
+                items = [apply_verdict(item, "ERROR") for item in items]
+            for position, item in zip(positions, items):
+                self.results[position] = item
+                if self.keep_results is not None:
+                    self._done.append(position)
+                    while len(self._done) > self.keep_results:
+                        self.results.pop(self._done.popleft(), None)
+                if self.on_result:
+                    try:
+                        self.on_result(position, item)
+                    except Exception as e:
+                        print(f"Error in audit result callback for {item.get('image_path')}: {e}")
+            async with self._changed:
+                self._changed.notify_all()
+
+    def submit(self, items):
+        """
+        Queues the flagged items of one image (grouped into one request when batch is on).
+
+        Returns:
+            list: The items' positions in the results.
+        """
+        items = list(items)
+        if not items:
+            return []
+        positions = list(range(self._submitted, self._submitted + len(items)))
+        self._submitted += len(items)
+        self.results.update(dict.fromkeys(positions))
+        units = [(positions, items)] if self.batch else [([p], [i]) for p, i in zip(positions, items)]
+        for unit in units:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, unit)
+        return positions
+
+    def get(self, position):
+        """
+        The audited item at a position returned by submit(), None while it is pending.
+
+        Raises:
+            KeyError: The position was never submitted or its item was dropped (see keep_results).
+        """
+        return self.results[position]
+
+    def take(self, position):
+        """Waits for the item at a position returned by submit(), then removes it from the results and returns it."""
+        async def done():
+            async with self._changed:
+                await self._changed.wait_for(lambda: self.results[position] is not None)
+            return self.results.pop(position)
+
+        return asyncio.run_coroutine_threadsafe(done(), self._loop).result()
+
+    def close(self):
+        """Waits for every queued audit and returns the kept results in submission order."""
+        async def drain():
+            for _ in self._workers:
+                self._queue.put_nowait(None)
+            await asyncio.gather(*self._workers)
+
+        asyncio.run_coroutine_threadsafe(drain(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self.stats['elapsed'] = time.perf_counter() - self._start
+        return [self.results[position] for position in sorted(self.results)]
@@ -0,0 +1,119 @@
+"""
+Benchmark: the old DataAggregator.data_aggregator loop vs aggregation.summarize (what
+data_aggregator computes now, from dicts and from a DetectionTable) and the single-pass
+aggregation.Aggregator fed with dicts, merged from shards, and fed with a DetectionTable.
+
+Run from the repo root: python -m bench.bench_aggregation
+"""
+import gc
+import time
+from pathlib import Path
+from aggregation import Aggregator, summarize, summarize_table
+from bench.bench_detection_table import make_detections, LABELS
+from detection_table import DetectionTable
+
+
+def legacy_safe_get_confidence(entry):
+    try:
+        return float(entry.get('confidence'))
+    except (ValueError, TypeError):
+        return 0
+
+
+def legacy_data_aggregator(validated_data, key='image_path'):
+    """
+    The per-image loop data_aggregator used before aggregation.py (without the file write),
+    grouping by `key` (a field name or a function of the entry) instead of the missing imgID.
+    """
+    aggregated_data = {}
+    for entry in validated_data:
+        imgID = key(entry) if callable(key) else entry.get(key)
+        if imgID not in aggregated_data:
+            aggregated_data[imgID] = {}
+            aggregated_data[imgID]['detections'] = [entry.get('label')]
+            aggregated_data[imgID]['max_conf'] = legacy_safe_get_confidence(entry)
+            aggregated_data[imgID]['count'] = 1
+        else:
+            if entry.get('label') not in aggregated_data[imgID]['detections']:
+                aggregated_data[imgID]['detections'].append(entry.get('label'))
+            if aggregated_data[imgID]['max_conf'] < legacy_safe_get_confidence(entry):
+                aggregated_data[imgID]['max_conf'] = legacy_safe_get_confidence(entry)
+            aggregated_data[imgID]['count'] += 1
+    return aggregated_data
+
+
+# The legacy loop only reads fields, so derived keys are computed for it
+LEGACY_KEYS = {'split': lambda entry: Path(entry['image_path']).parts[-3]}
+
+COCO_LIKE_LABELS = [f'class_{i}' for i in range(80)]
+
+# (name, group key, boxes per image, label set)
+SCENARIOS = [
+    ('per image, 8 boxes', 'image_path', 8, None),
+    ('per image, 200 boxes', 'image_path', 200, None),
+    ('per split, 80 classes', 'split', 8, COCO_LIKE_LABELS),
+    ('per label, 80 classes', 'label', 8, COCO_LIKE_LABELS),
+]
+
+
+def run(sizes=(100_000, 1_000_000), shards=4):
+    """
+    Times each implementation from detection dicts to per-group summary dicts, after a
+    full collection each so one's garbage does not land on the next one's clock.
+    The Aggregator also computes percentiles and flag histograms the legacy loop does not.
+    """
+    print(f"{'rows':>9} {'scenario':<24} {'legacy s':>9} {'summarize s':>12} {'+table s':>9} {'aggregator s':>13} "
+          f"{'4-shard merge s':>16} {'+table s':>9}")
+    for n in sizes:
+        for name, key, boxes, labels in SCENARIOS:
+            detections = make_detections(n, per_image=boxes, labels=labels or LABELS)
+
+            gc.collect()
+            start = time.perf_counter()
+            expected = legacy_data_aggregator(detections, key=LEGACY_KEYS.get(key, key))
+            legacy_s = time.perf_counter() - start
+
+            gc.collect()
+            start = time.perf_counter()
+            summary_result = summarize(detections, key)
+            summarize_s = time.perf_counter() - start
+            assert summary_result == expected
+
+            gc.collect()
+            start = time.perf_counter()
+            result = Aggregator(key).update(detections).result()
+            aggregator_s = time.perf_counter() - start
+
+            # Shards run one after another here; merge cost is what matters
+            gc.collect()
+            start = time.perf_counter()
+            size = -(-n // shards)
+            merged = Aggregator(key)
+            for i in range(shards):
+                merged.merge(Aggregator(key).update(detections[i * size:(i + 1) * size]))
+            merged_result = merged.result()
+            merge_s = time.perf_counter() - start
+
+            table = DetectionTable.from_dicts(detections)
+            gc.collect()
+            start = time.perf_counter()
+            summary_table_result = summarize_table(table, key)
+            summarize_table_s = time.perf_counter() - start
+            assert summary_table_result == expected
+
+            gc.collect()
+            start = time.perf_counter()
+            table_result = Aggregator(key).update_table(table).result()
+            table_s = time.perf_counter() - start
+
+            for group, summary in expected.items():
+                for got in (result[group], merged_result[group], table_result[group]):
+                    assert got['count'] == summary['count'] and got['max_conf'] == summary['max_conf']
+                    assert got['labels'] == summary['detections']
+
+            print(f"{n:>9} {name:<24} {legacy_s:>9.3f} {summarize_s:>12.3f} {summarize_table_s:>9.3f} "
+                  f"{aggregator_s:>13.3f} {merge_s:>16.3f} {table_s:>9.3f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,39 @@
+"""
+Benchmark: sequential VLM audit vs the async engine, against the local fake backend.
+
+Run from the repo root: python -m bench.bench_audit
+"""
+import time
+from pathlib import Path
+from audit_engine import audit_items
+from vlm_backends import FakeVLMBackend
+from vlm_auditor import get_vlm_opinion, apply_verdict
+
+
+def make_items(n, images_dir='data/train/images'):
+    images = sorted(Path(images_dir).iterdir())[:n]
+    return [{'image_path': str(p), 'label': 'Person', 'confidence': 0.5, 'flag_reason': 'Low Confidence'}
+            for p in images]
+
+
+def run(n=60, latency=0.2, error_rate=0.05, concurrency=16, rpm=6000):
+    items = make_items(n)
+
+    backend = FakeVLMBackend(latency=latency, jitter=latency / 2, error_rate=0.0)
+    start = time.perf_counter()
+    sequential = [apply_verdict(dict(item), get_vlm_opinion(item['image_path'], item['label'], backend))
+                  for item in items]
+    sequential_s = time.perf_counter() - start
+
+    backend = FakeVLMBackend(latency=latency, jitter=latency / 2, error_rate=error_rate)
+    results, stats = audit_items([dict(item) for item in items], backend, concurrency=concurrency, rpm=rpm)
+
+    assert [r['image_path'] for r in results] == [r['image_path'] for r in sequential], "order changed"
+    print(f"items={len(items)} latency={latency}s error_rate={error_rate}")
+    print(f"sequential (no sleep): {sequential_s:.2f}s  {len(items) / sequential_s:.1f} audits/s")
+    print(f"async x{concurrency}:      {stats['elapsed']:.2f}s  {len(items) / stats['elapsed']:.1f} audits/s"
+          f"  retries={stats['retries']}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,76 @@
+"""
+Benchmark: confidence filtering and per-class / per-image statistics on lists of
+detection dicts vs the columnar DetectionTable.
+
+Run from the repo root: python -m bench.bench_detection_table
+"""
+import copy
+import random
+import time
+from collections import defaultdict
+from data_filter import filter_detections
+from detection_table import DetectionTable
+
+LABELS = ['Person', 'Hardhat', 'Safety Vest', 'Safety Cone', 'truck']
+
+
+def make_detections(n, per_image=8, seed=0, labels=LABELS, split='train'):
+    rng = random.Random(seed)
+    detections = []
+    for i in range(n):
+        x1, y1 = rng.uniform(0, 600), rng.uniform(0, 600)
+        detections.append({
+            'image_path': f'data/{split}/images/img_{i // per_image:07d}.jpg',
+            'label': rng.choice(labels),
+            'confidence': round(rng.random(), 2),
+            'bbox': [x1, y1, x1 + rng.uniform(10, 120), y1 + rng.uniform(10, 120)],
+        })
+    return detections
+
+
+def dict_stats(detections):
+    """Per-class and per-image statistics the way the pipeline loops compute them today."""
+    per_class = defaultdict(lambda: {'count': 0, 'conf_sum': 0.0, 'max_conf': 0.0})
+    per_image = {}
+    for detection in detections:
+        stats = per_class[detection['label']]
+        stats['count'] += 1
+        stats['conf_sum'] += detection['confidence']
+        stats['max_conf'] = max(stats['max_conf'], detection['confidence'])
+
+        image = per_image.setdefault(detection['image_path'], {'labels': [], 'max_conf': 0.0, 'count': 0})
+        if detection['label'] not in image['labels']:
+            image['labels'].append(detection['label'])
+        image['max_conf'] = max(image['max_conf'], detection['confidence'])
+        image['count'] += 1
+    return per_class, per_image
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def run(sizes=(100_000, 1_000_000)):
+    print(f"{'rows':>9} {'dict filter s':>14} {'table filter s':>15} {'dict stats s':>13} {'table stats s':>14} "
+          f"{'from_dicts s':>13}")
+    for n in sizes:
+        detections = make_detections(n)
+        table, build_s = timed(DetectionTable.from_dicts, detections)
+
+        expected, dict_filter_s = timed(filter_detections, copy.deepcopy(detections))
+        (confident, audit), table_filter_s = timed(table.filter_confidence)
+        assert len(confident) == len(expected['confident_detections'])
+        assert len(audit) == len(expected['audit_required'])
+
+        (per_class, per_image), dict_stats_s = timed(dict_stats, detections)
+        (class_frame, image_frame), table_stats_s = timed(lambda: (table.per_class_stats(), table.per_image_stats()))
+        assert class_frame.height == len(per_class) and image_frame.height == len(per_image)
+
+        print(f"{n:>9} {dict_filter_s:>14.3f} {table_filter_s:>15.3f} {dict_stats_s:>13.3f} "
+              f"{table_stats_s:>14.3f} {build_s:>13.3f}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,78 @@
+"""
+Benchmark: the vectorized COCO evaluator (evaluation.py) on synthetic datasets with
+up to millions of boxes, against a per-image, per-threshold matching loop on the smallest.
+
+Run from the repo root: python -m bench.bench_evaluation
+"""
+import time
+import numpy as np
+from evaluation import match_greedy, precision_recall, IOU_THRESHOLDS
+from iou_matcher import iou_matrix
+
+
+def make_boxes(images, boxes_per_image, classes=10, seed=0):
+    """Synthetic GT and detections: most GT boxes found with jitter and a few per image spurious."""
+    rng = np.random.default_rng(seed)
+    n = images * boxes_per_image
+    gt_images = np.repeat(np.arange(images), boxes_per_image)
+    gt_classes = rng.integers(0, classes, n)
+    xy = rng.uniform(0, 600, (n, 2))
+    gt_boxes = np.hstack([xy, xy + rng.uniform(10, 120, (n, 2))])
+
+    found = rng.random(n) < 0.85
+    det_images = np.r_[gt_images[found], rng.integers(0, images, n // 10)]
+    det_classes = np.r_[np.where(rng.random(found.sum()) < 0.9, gt_classes[found], rng.integers(0, classes, found.sum())),
+                        rng.integers(0, classes, n // 10)]
+    spurious_xy = rng.uniform(0, 600, (n // 10, 2))
+    det_boxes = np.vstack([gt_boxes[found] + rng.normal(0, 5, (found.sum(), 4)),
+                           np.hstack([spurious_xy, spurious_xy + 40])])
+    det_scores = rng.random(len(det_images)).round(2)
+    return (det_images, det_classes, det_scores, det_boxes), (gt_images, gt_classes, gt_boxes), classes
+
+
+def loop_tp(dets, gts, classes):
+    """COCO matching with one IoU matrix per (image, class) and one greedy loop per threshold."""
+    det_images, det_classes, det_scores, det_boxes = dets
+    gt_images, gt_classes, gt_boxes = gts
+    tp = np.zeros((len(IOU_THRESHOLDS), len(det_images)), dtype=bool)
+    for image in np.unique(det_images):
+        for c in range(classes):
+            d = np.flatnonzero((det_images == image) & (det_classes == c))
+            g = np.flatnonzero((gt_images == image) & (gt_classes == c))
+            if not len(d) or not len(g):
+                continue
+            d = d[np.argsort(-det_scores[d], kind='stable')]
+            ious = iou_matrix(det_boxes[d], gt_boxes[g])
+            for t, threshold in enumerate(IOU_THRESHOLDS):
+                used = np.zeros(len(g), dtype=bool)
+                for row, det in enumerate(d):
+                    candidates = np.where(used | (ious[row] < threshold), -1, ious[row])
+                    best = int(candidates.argmax())
+                    if candidates[best] >= 0:
+                        used[best] = True
+                        tp[t, det] = True
+    return tp
+
+
+def run(sizes=((2_000, 10), (20_000, 25), (100_000, 20)), loop_images=2_000):
+    print(f"{'GT boxes':>10} {'detections':>11} {'match s':>8} {'PR/AP s':>8} {'loop s':>8}")
+    for images, per_image in sizes:
+        dets, gts, classes = make_boxes(images, per_image)
+        start = time.perf_counter()
+        tp = match_greedy(dets[0] * classes + dets[1], dets[2], dets[3], gts[0] * classes + gts[1], gts[2])
+        match_s = time.perf_counter() - start
+        start = time.perf_counter()
+        precision_recall(tp, dets[1], dets[2], np.bincount(gts[1], minlength=classes))
+        pr_s = time.perf_counter() - start
+
+        loop = '-'
+        if images <= loop_images:
+            start = time.perf_counter()
+            expected = loop_tp(dets, gts, classes)
+            loop = f"{time.perf_counter() - start:.2f}"
+            assert (expected == tp).all(), "vectorized matching diverged from the loop"
+        print(f"{len(gts[0]):>10} {len(dets[0]):>11} {match_s:>8.2f} {pr_s:>8.2f} {loop:>8}")
+
+
+if __name__ == "__main__":
+    run()
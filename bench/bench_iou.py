@@ -0,0 +1,97 @@
+"""
+Benchmark: per-box calculate_iou loop vs the vectorized iou_matcher on dense frames,
+and brute-force vs sweep-indexed matching on crowded frames.
+
+Run from the repo root: python -m bench.bench_iou
+"""
+import random
+import time
+from iou_matcher import match_detections, use_index
+from validator import calculate_iou
+
+LABELS = ['Person', 'Hardhat', 'Safety Vest', 'Safety Cone', 'truck']
+
+
+def make_frame(n_boxes, width=640, height=640, seed=0):
+    rng = random.Random(seed)
+    boxes, labels = [], []
+    for _ in range(n_boxes):
+        x1, y1 = rng.uniform(0, width - 40), rng.uniform(0, height - 40)
+        boxes.append([x1, y1, x1 + rng.uniform(10, 120), y1 + rng.uniform(10, 120)])
+        labels.append(rng.choice(LABELS))
+    return boxes, labels
+
+
+def loop_match(det_boxes, det_labels, gt_boxes, gt_labels, iou_threshold=0.5):
+    """The per-detection loop compare_to_gt used before the vectorized matcher."""
+    reasons = []
+    for det_bbox, det_label in zip(det_boxes, det_labels):
+        best_iou = 0
+        matched = None
+        for g, gt_bbox in enumerate(gt_boxes):
+            iou = calculate_iou(det_bbox, gt_bbox)
+            if iou > best_iou:
+                best_iou = iou
+                matched = g
+        if best_iou < iou_threshold:
+            reasons.append(f'Low IoU with GT ({best_iou:.2f})')
+        elif matched is not None and gt_labels[matched] != det_label:
+            reasons.append(f"Class Mismatch (Det: {det_label}, GT: {gt_labels[matched]})")
+        else:
+            reasons.append(None)
+    return reasons
+
+
+def jitter(boxes, seed=1):
+    rng = random.Random(seed)
+    return [[c + rng.uniform(-8, 8) for c in box] for box in boxes]
+
+
+def run(densities=(10, 30, 100, 300), repeats=20):
+    print(f"{'boxes':>6} {'loop ms':>10} {'vector ms':>10} {'speedup':>8}")
+    for n in densities:
+        gt_boxes, gt_labels = make_frame(n, seed=n)
+        det_boxes = jitter(gt_boxes)
+        det_labels = list(gt_labels)
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            expected = loop_match(det_boxes, det_labels, gt_boxes, gt_labels)
+        loop_ms = (time.perf_counter() - start) / repeats * 1000
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            got = match_detections(det_boxes, det_labels, gt_boxes, gt_labels)['flag_reason']
+        vector_ms = (time.perf_counter() - start) / repeats * 1000
+
+        assert got == expected, "vectorized matcher diverged from the loop"
+        print(f"{n:>6} {loop_ms:>10.3f} {vector_ms:>10.3f} {loop_ms / vector_ms:>7.1f}x")
+
+
+def run_index(densities=(50, 100, 200, 300, 600, 1000, 2000), frames=((640, 640), (1920, 1080)), repeats=5):
+    """Brute-force (every pair) vs sweep-indexed (overlapping pairs only) match_detections."""
+    print(f"{'frame':>10} {'boxes':>6} {'brute ms':>10} {'index ms':>10} {'speedup':>8} {'auto':>6}")
+    for width, height in frames:
+        for n in densities:
+            gt_boxes, gt_labels = make_frame(n, width=width, height=height, seed=n)
+            det_boxes = jitter(gt_boxes)
+            det_labels = list(gt_labels)
+
+            timings = {}
+            results = {}
+            for index in (False, True):
+                start = time.perf_counter()
+                for _ in range(repeats):
+                    results[index] = match_detections(det_boxes, det_labels, gt_boxes, gt_labels, index=index)
+                timings[index] = (time.perf_counter() - start) / repeats * 1000
+
+            assert results[True]['flag_reason'] == results[False]['flag_reason'], "indexed matcher diverged"
+            auto = 'index' if use_index(det_boxes, gt_boxes) else 'brute'
+            print(f"{width}x{height:<5} {n:>6} {timings[False]:>10.3f} {timings[True]:>10.3f} "
+                  f"{timings[False] / timings[True]:>7.1f}x {auto:>6}")
+
+
+if __name__ == "__main__":
+    run()
+    print()
+    run_index()
@@ -0,0 +1,311 @@
+"""
+Benchmark suite: every pipeline stage in isolation and end to end on a synthetic
+YOLO dataset, with the deterministic FakeDetector and the local FakeVLMBackend.
+Runs offline and writes the timings as JSON so runs can be compared.
+
+Run from the repo root:
+    python -m bench.bench_pipeline --images 500 --boxes 12 --vlm-latency 0.05
+    python -m bench.bench_pipeline --compare bench_results/pipeline.json --output bench_results/new.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+from pathlib import Path
+import matplotlib
+
+matplotlib.use('Agg')
+
+import metrics
+from bench.synthetic import make_dataset, FakeDetector
+from DataAggregator import data_aggregator
+from data_filter import filter_detections
+from dataset_catalog import DatasetCatalog
+from evaluation import Evaluator, GroundTruthBoxes, pipeline_tiers, save_evaluation
+from frame_dedup import FrameClusters
+from gt_index import GroundTruthIndex
+from jsonl_io import JsonlWriter, RecordFile
+from sharded_runner import run_stages
+from validator import calculate_iou, compare_to_gt, validate_detections
+from visual_report import render_report
+from class_stats import count_verdicts, save_class_stats
+from vlm_auditor import run_vlm_audit
+from vlm_backends import FakeVLMBackend
+from vlm_cache import VerdictCache
+
+# Stages slower than the baseline by more than this fraction are reported as regressions
+REGRESSION_THRESHOLD = 0.10
+
+
+def time_stage(fn, items, repeats=3, setup=None):
+    """
+    Runs fn(setup()) `repeats` times with stdout silenced (setup is untimed).
+
+    Returns:
+        tuple: (last result, timing dict with best/mean seconds, items and items per second)
+    """
+    runs = []
+    result = None
+    for _ in range(repeats):
+        arg = setup() if setup else None
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = fn(arg)
+            runs.append(time.perf_counter() - start)
+    best = min(runs)
+    return result, {'seconds': best, 'mean_seconds': sum(runs) / len(runs), 'runs': runs, 'items': items,
+                    'items_per_s': items / best if best > 0 else None}
+
+
+def copy_detections(detections):
+    # Validation and filtering write flag_reason into the dicts
+    return [dict(detection) for detection in detections]
+
+
+def iou_pairs(detections, gt_index):
+    """(detection bbox, GT bbox) for every detection against every GT box of its image."""
+    pairs = []
+    for detection in detections:
+        gt = gt_index.get(detection['image_path'])
+        if gt is not None:
+            pairs.extend((detection['bbox'], gt_box) for gt_box in gt[1].tolist())
+    return pairs
+
+
+def environment():
+    import numpy
+    import polars
+    return {'python': sys.version.split()[0], 'platform': platform.platform(), 'cpu_count': os.cpu_count(),
+            'numpy': numpy.__version__, 'polars': polars.__version__}
+
+
+def run_audit(workdir, audit_file, backend, concurrency, fresh_cache=True):
+    cache_path = Path(workdir) / 'bench_vlm_cache.sqlite'
+    if fresh_cache and cache_path.exists():
+        cache_path.unlink()
+    return run_vlm_audit(audit_file, Path(workdir) / 'final_report.jsonl', backend=backend,
+                         concurrency=concurrency, cache=VerdictCache(cache_path))
+
+
+def run_end_to_end(dataset, detector, gt_index, evaluator, workdir, backend, concurrency, audit_limit):
+    """
+    The main.py batch flow with the fake detector and backend, recorded with metrics.RunMetrics.
+    Like main.py it stops at the stats files; rendering them is the separate report stage.
+    """
+    workdir = Path(workdir)
+    cache_path = workdir / 'e2e_vlm_cache.sqlite'
+    if cache_path.exists():
+        cache_path.unlink()
+
+    run = metrics.start_run(rss_interval=None)
+    try:
+        stage_results = run_stages(detector, dataset.images, gt_index)
+        audit_required = (stage_results['filter_audit'] + stage_results['validation_audit'])[:audit_limit]
+        audit_file = workdir / 'e2e_to_audit.jsonl'
+        with metrics.stage('write_outputs'), JsonlWriter(audit_file) as writer:
+            writer.write_many(audit_required)
+        with metrics.stage('vlm_audit'):
+            verdicts = run_vlm_audit(audit_file, workdir / 'e2e_final_report.jsonl', backend=backend,
+                                     concurrency=concurrency, cache=VerdictCache(cache_path))
+        vlm_results = RecordFile(workdir / 'e2e_final_report.jsonl')
+        with metrics.stage('evaluation'):
+            save_evaluation(evaluator.evaluate_tiers(pipeline_tiers(stage_results, vlm_results), dataset.images),
+                            workdir / 'evaluation.json')
+        with metrics.stage('aggregate'):
+            data_aggregator(stage_results['detections'], output_path=workdir / 'e2e_aggregated.jsonl')
+        vlm_total, vlm_passed = sum(verdicts.values()), verdicts.get('YES', 0)
+        with metrics.stage('write_outputs'):
+            summary = {key: stage_results[key] for key in ('raw_total', 'raw_correct', 'filtered_total',
+                                                           'filtered_correct')}
+            summary.update(vlm_total=vlm_total, vlm_passed=vlm_passed, human_total=vlm_total - vlm_passed)
+            with open(workdir / 'run_summary.json', 'w') as f:
+                json.dump(summary, f)
+            save_class_stats(count_verdicts(stage_results['class_counts'], vlm_results),
+                             workdir / 'class_stats.json')
+    finally:
+        metrics.end_run()
+    with open(workdir / 'run_metrics.json', 'w') as f:
+        json.dump(run.to_dict(), f)
+    return run.to_dict()
+
+
+def run_report(workdir, force=True):
+    return render_report(workdir / 'reports', workdir / 'run_summary.json', workdir / 'class_stats.json',
+                         workdir / 'run_metrics.json', force=force, evaluation_path=workdir / 'evaluation.json')
+
+
+def run(images=200, boxes=8, image_size=(640, 480), seed=0, repeats=3, vlm_latency=0.05, concurrency=8,
+        audit_limit=200, data_dir='bench_data', output='bench_results/pipeline.json'):
+    """
+    Times each stage and the end-to-end flow, prints a table and writes the results to `output`.
+
+    Args:
+        images (int): Images in the synthetic dataset.
+        boxes (int): Mean GT boxes per image.
+        image_size (tuple): Synthetic image (width, height).
+        seed (int): Dataset and detector seed.
+        repeats (int): Runs per isolated stage, the best is reported.
+        vlm_latency (float): Mean seconds per fake VLM call (jitter is half of it).
+        concurrency (int): Audit requests in flight. 1 is the sequential loop, which also
+                           sleeps 1s after every call like the production path.
+        audit_limit (int): Audit at most this many flagged items.
+        data_dir (str): Where synthetic datasets are generated (reused while the config is unchanged).
+        output (str): JSON results file.
+
+    Returns:
+        dict: The results written to `output`.
+    """
+    config = {'images': images, 'boxes': boxes, 'image_size': list(image_size), 'seed': seed, 'repeats': repeats,
+              'vlm_latency': vlm_latency, 'concurrency': concurrency, 'audit_limit': audit_limit}
+    root = Path(data_dir) / f'synthetic_{images}x{boxes}_{image_size[0]}x{image_size[1]}_s{seed}'
+    workdir = root / 'work'
+
+    start = time.perf_counter()
+    dataset = make_dataset(root, images, boxes, image_size, seed=seed)
+    print(f"Dataset {root}: {len(dataset.images)} images ({time.perf_counter() - start:.1f}s)")
+    shutil.rmtree(workdir, ignore_errors=True)
+    workdir.mkdir(parents=True)
+
+    detector = FakeDetector(dataset.class_names, seed=seed)
+    backend = FakeVLMBackend(latency=vlm_latency, jitter=vlm_latency / 2, seed=seed)
+    results = {}
+
+    catalog_path = root / f'catalog_{dataset.split}.pkl'
+    _, results['catalog_build'] = time_stage(
+        lambda _: DatasetCatalog.for_split(dataset.split, data_dir=root, refresh=True), len(dataset.images), repeats,
+        setup=lambda: catalog_path.unlink(missing_ok=True))
+    catalog, results['catalog_load'] = time_stage(lambda _: DatasetCatalog.for_split(dataset.split, data_dir=root),
+                                                  len(dataset.images), repeats)
+    _, results['frame_clusters'] = time_stage(lambda _: FrameClusters.from_catalog(catalog), len(dataset.images),
+                                              repeats)
+
+    gt_index, results['gt_index'] = time_stage(
+        lambda _: GroundTruthIndex.for_split(dataset.split, data_dir=root, class_names=dataset.class_names,
+                                             use_cache=False, catalog=catalog), len(dataset.images), repeats)
+
+    detections, results['fake_detector'] = time_stage(lambda _: detector.process_images(dataset.images),
+                                                      len(dataset.images), repeats)
+
+    pairs = iou_pairs(detections, gt_index)
+    _, results['calculate_iou'] = time_stage(lambda _: [calculate_iou(a, b) for a, b in pairs], len(pairs), repeats)
+
+    _, results['compare_to_gt'] = time_stage(
+        lambda batch: [compare_to_gt(detection, gt_index) for detection in batch], len(detections), repeats,
+        setup=lambda: copy_detections(detections))
+
+    _, results['validate_detections'] = time_stage(
+        lambda batch: validate_detections(batch, gt_index), len(detections), repeats,
+        setup=lambda: copy_detections(detections))
+
+    filtered, results['filter_detections'] = time_stage(filter_detections, len(detections), repeats,
+                                                        setup=lambda: copy_detections(detections))
+
+    evaluator = Evaluator(GroundTruthBoxes.for_splits((dataset.split,), root, class_names=dataset.class_names))
+    _, results['evaluate'] = time_stage(lambda _: evaluator.evaluate(detections, dataset.images), len(detections),
+                                        repeats)
+
+    _, results['data_aggregator'] = time_stage(
+        lambda _: data_aggregator(detections, output_path=workdir / 'aggregated_data.jsonl'),
+        len(detections), repeats)
+
+    audit_required = filtered['audit_required'][:audit_limit]
+    audit_file = workdir / 'to_audit.jsonl'
+    with JsonlWriter(audit_file) as writer:
+        writer.write_many(audit_required)
+    audit_repeats = 1 if concurrency == 1 else repeats
+    _, results['run_vlm_audit'] = time_stage(lambda _: run_audit(workdir, audit_file, backend, concurrency),
+                                             len(audit_required), audit_repeats)
+    _, results['run_vlm_audit_cached'] = time_stage(
+        lambda _: run_audit(workdir, audit_file, backend, concurrency, fresh_cache=False),
+        len(audit_required), repeats)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        run_metrics = run_end_to_end(dataset, detector, gt_index, evaluator, workdir, backend, concurrency, audit_limit)
+        seconds = time.perf_counter() - start
+    results['end_to_end'] = {'seconds': seconds, 'mean_seconds': seconds, 'runs': [seconds],
+                             'items': len(dataset.images), 'items_per_s': len(dataset.images) / seconds,
+                             'metrics': run_metrics}
+
+    # Renders the stats the end-to-end run wrote: every chart, then none (all unchanged)
+    with contextlib.redirect_stdout(io.StringIO()):
+        charts = len(run_report(workdir))
+    _, results['report'] = time_stage(lambda _: run_report(workdir), charts, repeats)
+    _, results['report_unchanged'] = time_stage(lambda _: run_report(workdir, force=False), charts, repeats)
+
+    report = {'created_at': time.time(), 'config': config, 'environment': environment(),
+              'dataset': {'images': len(dataset.images), 'detections': len(detections),
+                          'audit_items': len(audit_required), 'iou_pairs': len(pairs)},
+              'results': results}
+    print_results(results)
+
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Results saved to {output}")
+    return report
+
+
+def print_results(results):
+    print(f"{'stage':<22} {'best s':>9} {'mean s':>9} {'items':>9} {'items/s':>11}")
+    for name, result in results.items():
+        rate = f"{result['items_per_s']:.0f}" if result['items_per_s'] else '-'
+        print(f"{name:<22} {result['seconds']:>9.4f} {result['mean_seconds']:>9.4f} {result['items']:>9} {rate:>11}")
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD):
+    """
+    Prints the best time of every stage against a previous run's results.
+
+    Returns:
+        list: Names of stages slower than the baseline by more than `threshold`.
+    """
+    if baseline['config'] != current['config']:
+        print(f"Warning: the baseline was run with a different config: {baseline['config']}")
+
+    regressions = []
+    print(f"{'stage':<22} {'baseline s':>11} {'current s':>10} {'change':>8}")
+    for name, result in current['results'].items():
+        previous = baseline['results'].get(name)
+        if previous is None or not previous['seconds']:
+            continue
+        change = result['seconds'] / previous['seconds'] - 1
+        flag = '  REGRESSION' if change > threshold else ''
+        if flag:
+            regressions.append(name)
+        print(f"{name:<22} {previous['seconds']:>11.4f} {result['seconds']:>10.4f} {change:>+8.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark on a synthetic dataset.")
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--boxes', type=int, default=8, help="Mean GT boxes per image.")
+    parser.add_argument('--image-size', type=int, nargs=2, default=(640, 480), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--vlm-latency', type=float, default=0.05)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--audit-limit', type=int, default=200)
+    parser.add_argument('--data-dir', default='bench_data')
+    parser.add_argument('--output', default='bench_results/pipeline.json')
+    parser.add_argument('--compare', help="Previous results file to compare against.")
+    args = parser.parse_args()
+
+    # Read first, the baseline may be the file this run writes
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    current = run(args.images, args.boxes, tuple(args.image_size), args.seed, args.repeats, args.vlm_latency,
+                  args.concurrency, args.audit_limit, args.data_dir, args.output)
+    if baseline is not None:
+        regressions = compare(baseline, current)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,216 @@
+"""
+Load test: latency percentiles and throughput of the validation service (service.py)
+at increasing concurrency, each virtual user sending requests back to back on its
+own keep-alive connection.
+
+Without --url, services are started in-process on a synthetic dataset, once with
+--max-batch 1 (every request its own inference batch) and once with batching, using
+the FakeDetector with a fixed cost per inference batch plus a per-image cost (what
+batching amortizes on a real model) and the FakeVLMBackend for the queued audits.
+With --url, a running service is loaded with the images of --images.
+
+Run from the repo root:
+    python -m bench.bench_service --concurrency 1 4 16 64
+    python -m bench.bench_service --url http://127.0.0.1:8765 --images data/train/images
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import shutil
+import time
+from pathlib import Path
+from urllib.parse import urlsplit
+import numpy as np
+from bench.synthetic import make_dataset, FakeDetector
+from gt_index import GroundTruthIndex
+from service import ValidationService, BATCH_WINDOW_S, MAX_BATCH_IMAGES
+from vision_worker import IMAGE_EXTENSIONS
+from vlm_backends import FakeVLMBackend
+from vlm_cache import VerdictCache
+
+
+async def post_json(reader, writer, host, path, payload):
+    """One request on a keep-alive connection. Returns (status, decoded JSON body)."""
+    body = json.dumps(payload).encode()
+    writer.write(f"POST {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(body)}\r\n\r\n".encode('latin-1') + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def load_level(host, port, images, concurrency, requests, images_per_request=1, audit=True):
+    """
+    Sends `requests` /validate requests from `concurrency` users.
+
+    Returns:
+        dict: Throughput, p50/p99/max client latency in ms and the mean inference batch size.
+    """
+    counter = itertools.count()
+    latencies, batch_images, errors = [], [], 0
+
+    async def user():
+        nonlocal errors
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            while (i := next(counter)) < requests:
+                chosen = [str(images[(i * images_per_request + k) % len(images)]) for k in range(images_per_request)]
+                start = time.perf_counter()
+                status, response = await post_json(reader, writer, host, '/validate',
+                                                   {'image_paths': chosen, 'audit': audit})
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    errors += 1
+                elif response['batch']:
+                    batch_images.append(response['batch']['images'])
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+    return {'concurrency': concurrency, 'requests': requests, 'errors': errors, 'seconds': elapsed,
+            'requests_per_s': requests / elapsed, 'images_per_s': requests * images_per_request / elapsed,
+            'p50_ms': float(np.percentile(latencies_ms, 50)), 'p99_ms': float(np.percentile(latencies_ms, 99)),
+            'max_ms': float(latencies_ms.max()),
+            'mean_batch_images': float(np.mean(batch_images)) if batch_images else None}
+
+
+async def load_levels(host, port, images, levels, requests, images_per_request=1, audit=True, label=''):
+    results = []
+    for concurrency in levels:
+        result = await load_level(host, port, images, concurrency, max(requests, concurrency), images_per_request,
+                                  audit)
+        result['label'] = label
+        results.append(result)
+        print_result(result)
+    return results
+
+
+async def load_in_process(service, images, levels, requests, images_per_request=1, audit=True, label=''):
+    """Starts `service` on a free local port in this event loop, loads it, then stops it."""
+    started, stop = asyncio.Event(), asyncio.Event()
+    ports = []
+    server = asyncio.create_task(service.serve('127.0.0.1', 0, started=lambda port: (ports.append(port),
+                                                                                    started.set()), stop=stop))
+    await started.wait()
+    try:
+        return await load_levels('127.0.0.1', ports[0], images, levels, requests, images_per_request, audit, label)
+    finally:
+        stop.set()
+        await server
+
+
+def print_header():
+    print(f"{'service':<14} {'users':>6} {'req/s':>8} {'img/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} "
+          f"{'batch':>6} {'errors':>6}")
+
+
+def print_result(result):
+    batch = f"{result['mean_batch_images']:.1f}" if result['mean_batch_images'] else '-'
+    print(f"{result['label']:<14} {result['concurrency']:>6} {result['requests_per_s']:>8.1f} "
+          f"{result['images_per_s']:>8.1f} {result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} "
+          f"{result['max_ms']:>8.1f} {batch:>6} {result['errors']:>6}")
+
+
+def run(levels=(1, 2, 4, 8, 16, 32), requests=200, images_per_request=1, images=200, boxes=8, seed=0,
+        batch_latency=0.02, image_latency=0.002, vlm_latency=0.01, window=BATCH_WINDOW_S, max_batch=MAX_BATCH_IMAGES,
+        audit=True, data_dir='bench_data', output='bench_results/service.json'):
+    """
+    Loads in-process services, unbatched then batched, and writes the results to `output`.
+
+    Args:
+        levels (tuple): Concurrent users per level.
+        requests (int): Requests per level (at least one per user).
+        images_per_request (int): Image paths per request.
+        images (int): Images in the synthetic dataset.
+        boxes (int): Mean GT boxes per image.
+        seed (int): Dataset and detector seed.
+        batch_latency (float): Fake inference seconds per batch.
+        image_latency (float): Fake inference seconds per image.
+        vlm_latency (float): Mean seconds per fake VLM call.
+        window (float): Batching window in seconds.
+        max_batch (int): Images per inference batch of the batched service.
+        audit (bool): Queue the flagged detections for the (fake) VLM audit.
+        data_dir (str): Where the synthetic dataset is generated.
+        output (str): JSON results file.
+    """
+    config = {'levels': list(levels), 'requests': requests, 'images_per_request': images_per_request,
+              'images': images, 'boxes': boxes, 'seed': seed, 'batch_latency': batch_latency,
+              'image_latency': image_latency, 'vlm_latency': vlm_latency, 'window': window, 'max_batch': max_batch,
+              'audit': audit}
+    root = Path(data_dir) / f'synthetic_{images}x{boxes}_640x480_s{seed}'
+    workdir = root / 'service'
+    dataset = make_dataset(root, images, boxes, seed=seed)
+    shutil.rmtree(workdir, ignore_errors=True)
+    workdir.mkdir(parents=True)
+    gt_index = GroundTruthIndex.for_split(dataset.split, data_dir=root, class_names=dataset.class_names)
+
+    results = []
+    print_header()
+    for label, service_window, service_batch in (('unbatched', 0.0, 1), ('batched', window, max_batch)):
+        detector = FakeDetector(dataset.class_names, seed=seed, batch_latency=batch_latency,
+                                image_latency=image_latency)
+        service = ValidationService(detector, gt_index, window=service_window, max_batch=service_batch,
+                                    upload_dir=workdir / 'uploads')
+        if audit:
+            service.open_audits(workdir / f'{label}_report.jsonl', concurrency=8,
+                                backend=FakeVLMBackend(latency=vlm_latency, jitter=vlm_latency / 2, seed=seed),
+                                cache=VerdictCache(workdir / f'{label}_vlm_cache.sqlite'))
+        results += asyncio.run(load_in_process(service, dataset.images, levels, requests, images_per_request,
+                                               audit, label))
+        start = time.perf_counter()
+        service.close()
+        if audit:
+            print(f"{label}: {service.stats['audits_queued']} audits queued, "
+                  f"drained {time.perf_counter() - start:.2f}s after the load")
+
+    report = {'created_at': time.time(), 'config': config, 'results': results}
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Results saved to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the validation service (service.py).")
+    parser.add_argument('--url', help="A running service; without it services are started in-process.")
+    parser.add_argument('--images', help="With --url: folder of images to request (paths as the service sees them).")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--requests', type=int, default=200, help="Requests per concurrency level.")
+    parser.add_argument('--images-per-request', type=int, default=1)
+    parser.add_argument('--no-audit', action='store_true')
+    parser.add_argument('--dataset-images', type=int, default=200, help="Synthetic dataset size (in-process).")
+    parser.add_argument('--batch-latency', type=float, default=0.02, help="Fake inference seconds per batch.")
+    parser.add_argument('--image-latency', type=float, default=0.002, help="Fake inference seconds per image.")
+    parser.add_argument('--vlm-latency', type=float, default=0.01)
+    parser.add_argument('--window', type=float, default=BATCH_WINDOW_S * 1000, help="Batching window in ms.")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH_IMAGES)
+    parser.add_argument('--data-dir', default='bench_data')
+    parser.add_argument('--output', default='bench_results/service.json')
+    args = parser.parse_args()
+
+    if args.url:
+        url = urlsplit(args.url)
+        folder = Path(args.images or 'data/train/images')
+        paths = sorted(path.resolve() for path in folder.iterdir() if path.suffix.lower() in IMAGE_EXTENSIONS)
+        print_header()
+        asyncio.run(load_levels(url.hostname, url.port or 80, paths, args.concurrency, args.requests,
+                                args.images_per_request, not args.no_audit, label=url.netloc))
+    else:
+        run(tuple(args.concurrency), args.requests, args.images_per_request, args.dataset_images,
+            batch_latency=args.batch_latency, image_latency=args.image_latency, vlm_latency=args.vlm_latency,
+            window=args.window / 1000, max_batch=args.max_batch, audit=not args.no_audit, data_dir=args.data_dir,
+            output=args.output)
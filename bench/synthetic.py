@@ -0,0 +1,158 @@
+"""
+Synthetic YOLO-format datasets and a deterministic fake detector for offline benchmarks.
+
+Datasets mirror data/data.yaml: the same class names, <split>/images and
+<split>/labels folders and a data.yaml at the root, so GroundTruthIndex.for_split
+and the validator work on them unchanged.
+"""
+import json
+import random
+import time
+from collections import namedtuple
+from pathlib import Path
+import yaml
+from PIL import Image, ImageDraw
+import metrics
+from gt_index import parse_label_file, read_image_size
+from validator import load_class_names
+
+SyntheticDataset = namedtuple('SyntheticDataset', ['root', 'split', 'images', 'class_names'])
+
+# Written next to data.yaml; a dataset is only regenerated when its config changes
+CONFIG_FILE = 'synthetic.json'
+
+
+def make_dataset(root, images=200, boxes_per_image=8, image_size=(640, 480), split='train', seed=0,
+                 class_names=None):
+    """
+    Writes a YOLO-format dataset of solid-colour JPEGs with one drawn rectangle per label box.
+
+    Args:
+        root (str): Dataset folder (data.yaml, <split>/images, <split>/labels).
+        images (int): Number of images.
+        boxes_per_image (int): Mean boxes per image, each image gets 50% to 150% of it.
+        image_size (tuple): (width, height) of every image.
+        split (str): Split folder name.
+        seed (int): Seed for colours, box counts, positions and classes.
+        class_names (list): Defaults to the 25 classes of data/data.yaml.
+
+    Returns:
+        SyntheticDataset: root, split, sorted image paths and class names.
+    """
+    class_names = list(class_names or load_class_names())
+    root = Path(root)
+    images_dir = root / split / 'images'
+    labels_dir = root / split / 'labels'
+    config = {'images': images, 'boxes_per_image': boxes_per_image, 'image_size': list(image_size),
+              'split': split, 'seed': seed, 'class_names': class_names}
+
+    config_path = root / CONFIG_FILE
+    if config_path.exists() and json.loads(config_path.read_text()) == config:
+        return SyntheticDataset(root, split, sorted(images_dir.iterdir()), class_names)
+
+    images_dir.mkdir(parents=True, exist_ok=True)
+    labels_dir.mkdir(parents=True, exist_ok=True)
+    for old in list(images_dir.iterdir()) + list(labels_dir.iterdir()):
+        old.unlink()
+    with open(root / 'data.yaml', 'w') as f:
+        yaml.safe_dump({split: f'../{split}/images', 'nc': len(class_names), 'names': class_names}, f)
+
+    rng = random.Random(seed)
+    width, height = image_size
+    low, high = boxes_per_image - boxes_per_image // 2, boxes_per_image + boxes_per_image // 2
+    for i in range(images):
+        stem = f'synthetic_{i:06d}'
+        image = Image.new('RGB', (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        lines = []
+        for _ in range(rng.randint(low, high)):
+            w, h = rng.uniform(0.02, 0.3), rng.uniform(0.02, 0.3)
+            xc, yc = rng.uniform(w / 2, 1 - w / 2), rng.uniform(h / 2, 1 - h / 2)
+            lines.append(f"{rng.randrange(len(class_names))} {xc:.6f} {yc:.6f} {w:.6f} {h:.6f}")
+            draw.rectangle([(xc - w / 2) * width, (yc - h / 2) * height, (xc + w / 2) * width,
+                            (yc + h / 2) * height], outline=tuple(rng.randrange(256) for _ in range(3)), width=3)
+        image.save(images_dir / f'{stem}.jpg', quality=75)
+        (labels_dir / f'{stem}.txt').write_text("\n".join(lines) + ("\n" if lines else ""))
+
+    config_path.write_text(json.dumps(config))
+    return SyntheticDataset(root, split, sorted(images_dir.iterdir()), class_names)
+
+
+class FakeDetector:
+    """
+    Deterministic stand-in for VisionWorker that derives detections from the label files.
+
+    Every GT box is detected with jittered coordinates, a high confidence and
+    sometimes the wrong class, or missed; false positives with low confidences are
+    added. Output per image depends only on the seed and the file stem, not on
+    the order or batching of the images.
+
+    Args:
+        class_names (list): Label names for class ids.
+        seed (int): Detection seed.
+        miss_rate (float): Fraction of GT boxes not detected.
+        mislabel_rate (float): Fraction of detections with a random wrong class.
+        false_positive_rate (float): False positives per GT box.
+        jitter (float): Max corner shift as a fraction of the box size.
+        batch_latency (float): Seconds slept per inference batch, like a model's fixed per-call cost.
+        image_latency (float): Seconds slept per image of a batch.
+    """
+
+    def __init__(self, class_names, seed=0, miss_rate=0.05, mislabel_rate=0.05, false_positive_rate=0.15,
+                 jitter=0.1, batch_latency=0.0, image_latency=0.0):
+        self.class_names = list(class_names)
+        self.seed = seed
+        self.miss_rate = miss_rate
+        self.mislabel_rate = mislabel_rate
+        self.false_positive_rate = false_positive_rate
+        self.jitter = jitter
+        self.batch_latency = batch_latency
+        self.image_latency = image_latency
+        self.last_stats = {}
+
+    def detect(self, image_path):
+        """Returns the detection dicts of one image, in VisionWorker's format."""
+        image_path = Path(image_path)
+        rng = random.Random(f'{self.seed}:{image_path.stem}')
+        width, height = read_image_size(image_path)
+        label_path = image_path.parent.parent / 'labels' / f'{image_path.stem}.txt'
+        cls_ids, boxes = parse_label_file(label_path, width, height) if label_path.exists() else ([], [])
+
+        detections = []
+        for cls_id, box in zip(list(cls_ids), list(boxes)):
+            if rng.random() < self.miss_rate:
+                continue
+            if rng.random() < self.mislabel_rate:
+                cls_id = rng.randrange(len(self.class_names))
+            box_w, box_h = box[2] - box[0], box[3] - box[1]
+            shifts = [rng.uniform(-self.jitter, self.jitter) * size for size in (box_w, box_h, box_w, box_h)]
+            detections.append(self._detection(image_path, cls_id, rng.betavariate(6, 2),
+                                              [float(c) + s for c, s in zip(box, shifts)]))
+            if rng.random() < self.false_positive_rate:
+                x1, y1 = rng.uniform(0, width * 0.9), rng.uniform(0, height * 0.9)
+                detections.append(self._detection(image_path, rng.randrange(len(self.class_names)),
+                                                  rng.betavariate(2, 5),
+                                                  [x1, y1, x1 + rng.uniform(10, width * 0.1),
+                                                   y1 + rng.uniform(10, height * 0.1)]))
+        return detections
+
+    def _detection(self, image_path, cls_id, confidence, bbox):
+        return {'image_path': str(image_path), 'label': self.class_names[int(cls_id)],
+                'confidence': round(confidence, 2), 'bbox': bbox}
+
+    def iter_image_detections(self, images, batch_size=16, workers=4):
+        """Yields (image_path, detections) per image, like VisionWorker.iter_image_detections."""
+        stats = {'images': 0}
+        images = list(images)
+        for i, image_path in enumerate(images):
+            if i % batch_size == 0 and (self.batch_latency or self.image_latency):
+                time.sleep(self.batch_latency + self.image_latency * len(images[i:i + batch_size]))
+            detections = self.detect(image_path)
+            stats['images'] += 1
+            metrics.count('images')
+            metrics.count('detections', len(detections))
+            yield str(image_path), detections
+        self.last_stats = stats
+
+    def process_images(self, images, batch_size=16, workers=4):
+        return [detection for _, detections in self.iter_image_detections(images) for detection in detections]
@@ -0,0 +1,111 @@
+import json
+
+# Written by main.run_pipeline, read by the report stage (visual_report.render_report)
+CLASS_STATS_FILE = 'class_stats.json'
+
+# correct: under the detector's label (precision); matched: under the GT label a correct detection
+# matched, its resolved_label if set (recall, comparable with gt); resolved: correct only through
+# the label taxonomy (taxonomy.py); audits_avoided: those of them that passed the confidence filter,
+# each a Class Mismatch audit without the taxonomy
+FIELDS = ('detections', 'correct', 'matched', 'resolved', 'audits_avoided', 'gt', 'audited', 'vlm_yes', 'vlm_no')
+
+
+def _row(counts, label):
+    return counts.setdefault(label, dict.fromkeys(FIELDS, 0))
+
+
+def gt_labels(gt_index, image_path):
+    """Class names of an image's GT boxes, empty if it has no (readable) label file."""
+    try:
+        gt = gt_index.get(image_path)
+    except ValueError:
+        return []
+    if gt is None:
+        return []
+    return [gt_index.class_name(c) for c in gt[0].tolist()]
+
+
+def count_detections(counts, detections, raw_results, labels=()):
+    """
+    Adds one image to per-class counts.
+
+    Args:
+        counts (dict): {label: {field: count}} updated in place.
+        detections (list): The image's detections.
+        raw_results (list): validator.validate_detections results for them (None = matches GT).
+        labels (list): Class names of the image's GT boxes.
+    """
+    for detection, result in zip(detections, raw_results):
+        if detection.get('label') is None:
+            continue
+        row = _row(counts, detection['label'])
+        row['detections'] += 1
+        row['correct'] += result is None
+        row['resolved'] += result is None and 'resolved_label' in detection
+        if result is None:
+            _row(counts, detection.get('resolved_label', detection['label']))['matched'] += 1
+    for label in labels:
+        _row(counts, label)['gt'] += 1
+    return counts
+
+
+def count_audited(counts, audit_items):
+    for item in audit_items:
+        if item.get('label') is not None:
+            _row(counts, item['label'])['audited'] += 1
+    return counts
+
+
+def count_avoided(counts, validated_confident):
+    """Adds the confident detections that passed validation only through the taxonomy."""
+    for detection in validated_confident:
+        if 'resolved_label' in detection:
+            _row(counts, detection['label'])['audits_avoided'] += 1
+    return counts
+
+
+def count_verdicts(counts, vlm_results):
+    """Adds the YES/NO VLM verdicts of audited items per label."""
+    for item in vlm_results:
+        verdict = item.get('vlm_verification')
+        if item.get('label') is not None and verdict in ('YES', 'NO'):
+            _row(counts, item['label'])['vlm_yes' if verdict == 'YES' else 'vlm_no'] += 1
+    return counts
+
+
+def merge_counts(into, counts):
+    for label, row in counts.items():
+        mine = _row(into, label)
+        for field in FIELDS:
+            mine[field] += row.get(field, 0)
+    return into
+
+
+def with_rates(counts):
+    """
+    Per class: the counts plus precision (correct / detections), recall (matched / GT boxes,
+    capped at 1 as duplicates can match one GT box), audit rate and VLM YES rate.
+    Rates are None where the denominator is 0.
+    """
+    def ratio(a, b):
+        return a / b if b else None
+
+    rows = {}
+    for label, row in counts.items():
+        recall = ratio(row.get('matched', 0), row['gt'])
+        rows[label] = {**row,
+                       'precision': ratio(row['correct'], row['detections']),
+                       'recall': min(1.0, recall) if recall is not None else None,
+                       'audit_rate': ratio(row['audited'], row['detections']),
+                       'vlm_yes_rate': ratio(row['vlm_yes'], row['vlm_yes'] + row['vlm_no'])}
+    return rows
+
+
+def save_class_stats(counts, path=CLASS_STATS_FILE):
+    with open(path, 'w') as f:
+        json.dump(with_rates(counts), f, indent=4, sort_keys=True)
+
+
+def load_class_stats(path=CLASS_STATS_FILE):
+    with open(path, 'r') as f:
+        return json.load(f)
@@ -1,18 +1,89 @@
+import hashlib
+import json
+from pathlib import Path
+
 CONFIDENCE_THRESHOLD = 0.7
 
-def filter_detections(detections):
+# Per-class thresholds written by threshold_calibration.py, used when present
+THRESHOLDS_FILE = 'class_thresholds.json'
+
+_loaded_thresholds = {}
+
+def load_thresholds(path=THRESHOLDS_FILE):
+    """
+    Loads per-class confidence thresholds, re-reading the file only when it changes.
+
+    Returns:
+        dict: {'default': float, 'classes': {label: float}}. Without a thresholds file
+              every class uses CONFIDENCE_THRESHOLD.
+    """
+    path = Path(path)
+    if not path.exists():
+        return {'default': CONFIDENCE_THRESHOLD, 'classes': {}}
+
+    mtime = path.stat().st_mtime_ns
+    cached = _loaded_thresholds.get(str(path))
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with open(path, 'r') as f:
+        data = json.load(f)
+    thresholds = {'default': float(data.get('default', CONFIDENCE_THRESHOLD)),
+                  'classes': {label: float(value) for label, value in data.get('classes', {}).items()}}
+    _loaded_thresholds[str(path)] = (mtime, thresholds)
+    return thresholds
+
+def thresholds_version(thresholds=None):
+    """Short fingerprint of the thresholds in use, so cached filter results can be invalidated."""
+    thresholds = thresholds if thresholds is not None else load_thresholds()
+    encoded = json.dumps(thresholds, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:12]
+
+def threshold_lookup(thresholds=None, taxonomy=None):
+    """
+    Returns a function giving the confidence threshold of a label, as filter_detections applies it.
+
+    Args:
+        thresholds (dict): Per-class thresholds as returned by load_thresholds, defaults to THRESHOLDS_FILE.
+        taxonomy (Taxonomy): Label taxonomy for labels without a threshold of their own (see filter_detections).
+    """
+    thresholds = thresholds if thresholds is not None else load_thresholds()
+    default_threshold = thresholds['default']
+    class_thresholds = thresholds['classes']
+    if taxonomy is None and class_thresholds:
+        from taxonomy import get_taxonomy
+        taxonomy = get_taxonomy()
+    # Thresholds by class id, so equivalent labels share them
+    id_thresholds = {taxonomy.label_id(label): value for label, value in class_thresholds.items()} if taxonomy else {}
+
+    def threshold_for(label):
+        threshold = class_thresholds.get(label)
+        if threshold is None and taxonomy:
+            threshold = id_thresholds.get(taxonomy.label_id(label))
+        return default_threshold if threshold is None else threshold
+
+    return threshold_for
+
+def filter_detections(detections, thresholds=None, taxonomy=None):
     """
     Filters a list of detection dictionaries into confident and audit-required categories.
-    
+
     Args:
         detections (list): A list of dictionaries, each containing detection info.
                            Expects keys like 'image_path', 'label', 'confidence', 'bbox'.
                            If an image has no detections, it's expected to be in the list
                            with 'label' as None.
+        thresholds (dict): Per-class thresholds as returned by load_thresholds. Defaults to
+                           THRESHOLDS_FILE if it exists, else CONFIDENCE_THRESHOLD for every class.
+        taxonomy (Taxonomy): A label without a threshold of its own uses the threshold of an
+                             equivalent label (e.g. 'person' that of 'Person'). Defaults to
+                             taxonomy.TAXONOMY_FILE; False to look up labels as they are.
 
     Returns:
         dict: A dictionary with 'confident_detections' and 'audit_required' lists.
     """
+    threshold_for = threshold_lookup(thresholds, taxonomy)
+
     filtered_results = {
         "confident_detections": [],
         "audit_required": []
@@ -27,8 +98,7 @@ def filter_detections(detections):
             continue
 
         confidence = detection.get('confidence', 0.0)
-
-        if confidence >= CONFIDENCE_THRESHOLD:
+        if confidence >= threshold_for(detection['label']):
             filtered_results['confident_detections'].append(detection)
         else:
             detection['flag_reason'] = 'Low Confidence'
@@ -0,0 +1,304 @@
+import argparse
+import os
+import pickle
+from pathlib import Path
+import numpy as np
+from gt_index import IMAGE_EXTENSIONS, read_image_size
+from vlm_cache import hash_file
+from frame_dedup import image_hashes
+
+CATALOG_VERSION = 2
+
+# Per-image columns besides the file name and content hash; -1 marks unknown
+COLUMNS = ('size', 'mtime_ns', 'width', 'height', 'label_mtime_ns', 'boxes')
+
+
+def count_boxes(label_path):
+    """Number of YOLO boxes (lines with at least 5 fields) in a label file."""
+    with open(label_path, 'r') as f:
+        return sum(1 for line in f if len(line.split()) >= 5)
+
+
+class DatasetCatalog:
+    """
+    Metadata of every image in a dataset split, kept in one file.
+
+    Per image (sorted by file name): size in bytes, mtime, width/height from the
+    header, SHA-256 content hash (as vlm_cache.hash_file), pHash and dHash
+    perceptual hashes (see frame_dedup.py), and the label file's mtime and box
+    count (-1 / 0 without a label file). Columns are numpy arrays, content hashes
+    are stored as raw 32-byte digests, perceptual hashes as uint64.
+
+    Loading a catalog is one file read plus a stat of every entry (os.scandir):
+    refresh() only re-reads images whose size or mtime changed, and labels whose
+    mtime changed, so files edited in place are caught too.
+
+    Rows are matched by file name, but only for paths in images_dir: a file with
+    the same name anywhere else is not the catalog's image.
+
+    Args:
+        images_dir (str): Folder with the images.
+        labels_dir (str): Folder with the YOLO label files, defaults to ../labels.
+    """
+
+    def __init__(self, images_dir, labels_dir=None):
+        self.images_dir = Path(images_dir)
+        self.labels_dir = Path(labels_dir) if labels_dir else self.images_dir.parent / 'labels'
+        self.names = []
+        self.columns = {name: np.zeros(0, dtype=np.int64) for name in COLUMNS}
+        self.hashes = np.zeros(0, dtype='S32')
+        self.phashes = np.zeros(0, dtype=np.uint64)
+        self.dhashes = np.zeros(0, dtype=np.uint64)
+        self.errors = {}
+        self._positions = None
+        self._stems = None
+        self._resolved_dir = None
+
+    @classmethod
+    def for_split(cls, split='train', data_dir='data', refresh='auto'):
+        """
+        Loads data/catalog_<split>.pkl, building or updating it as needed.
+
+        Args:
+            refresh (bool or str): 'auto' or True stat every image and label file and re-read the
+                                   changed ones (see refresh), False uses an existing catalog as is
+                                   (for worker processes whose parent just refreshed it).
+        """
+        images_dir = Path(data_dir) / split / 'images'
+        cache_path = Path(data_dir) / f'catalog_{split}.pkl'
+        catalog = cls.load(cache_path)
+        if catalog is None:
+            catalog = cls(images_dir)
+        elif refresh is False:
+            return catalog
+        changes = catalog.refresh()
+        if any(changes.values()) or not cache_path.exists():
+            catalog.save(cache_path)
+        return catalog
+
+    @classmethod
+    def for_folder(cls, folder, refresh='auto'):
+        """The catalog of <data_dir>/<split>/images folders, None for any other folder."""
+        folder = Path(folder)
+        if folder.name != 'images' or not folder.is_dir():
+            return None
+        return cls.for_split(folder.parent.name, folder.parent.parent, refresh)
+
+    def _scan(self):
+        images = {}
+        if self.images_dir.exists():
+            with os.scandir(self.images_dir) as entries:
+                for entry in entries:
+                    if Path(entry.name).suffix.lower() in IMAGE_EXTENSIONS and entry.is_file():
+                        images[entry.name] = entry.stat()
+        labels = {}
+        if self.labels_dir.exists():
+            with os.scandir(self.labels_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.txt'):
+                        labels[entry.name[:-4]] = entry.stat().st_mtime_ns
+        return images, labels
+
+    def refresh(self):
+        """
+        Rescans the folders and updates the catalog incrementally.
+
+        Returns:
+            dict: Counts of 'added', 'updated' (image or label changed), 'removed' images.
+        """
+        images, labels = self._scan()
+        old = self._position_map()
+        changes = {'added': 0, 'updated': 0, 'removed': len(set(old) - set(images))}
+
+        names = sorted(images)
+        columns = {name: np.full(len(names), -1, dtype=np.int64) for name in COLUMNS}
+        hashes = np.zeros(len(names), dtype='S32')
+        phashes = np.zeros(len(names), dtype=np.uint64)
+        dhashes = np.zeros(len(names), dtype=np.uint64)
+        errors = {}
+        changed = []
+        for i, name in enumerate(names):
+            stat = images[name]
+            stem = Path(name).stem
+            label_mtime = labels.get(stem, -1)
+            j = old.get(name)
+            image_same = (j is not None and self.columns['size'][j] == stat.st_size
+                          and self.columns['mtime_ns'][j] == stat.st_mtime_ns)
+            label_same = image_same and self.columns['label_mtime_ns'][j] == label_mtime
+            if j is None:
+                changes['added'] += 1
+            elif not label_same:
+                changes['updated'] += 1
+
+            columns['size'][i] = stat.st_size
+            columns['mtime_ns'][i] = stat.st_mtime_ns
+            columns['label_mtime_ns'][i] = label_mtime
+            if image_same:
+                columns['width'][i] = self.columns['width'][j]
+                columns['height'][i] = self.columns['height'][j]
+                hashes[i] = self.hashes[j]
+                phashes[i] = self.phashes[j]
+                dhashes[i] = self.dhashes[j]
+                if name in self.errors:
+                    errors[name] = self.errors[name]
+            else:
+                path = self.images_dir / name
+                try:
+                    columns['width'][i], columns['height'][i] = read_image_size(path)
+                    hashes[i] = bytes.fromhex(hash_file(path))
+                except Exception as e:
+                    # The hash stays zeroed, like the perceptual hashes of unreadable images
+                    errors[name] = str(e)
+                changed.append(i)
+
+            if label_same:
+                columns['boxes'][i] = self.columns['boxes'][j]
+            else:
+                columns['boxes'][i] = count_boxes(self.labels_dir / f'{stem}.txt') if label_mtime >= 0 else 0
+
+        # Perceptual hashes of all new or changed images in one vectorized pass
+        changed = [i for i in changed if names[i] not in errors]
+        if changed:
+            phashes[changed], dhashes[changed], hash_errors = image_hashes([self.images_dir / names[i]
+                                                                            for i in changed])
+            for position, error in hash_errors.items():
+                errors[names[changed[position]]] = error
+
+        self.names = names
+        self.columns = columns
+        self.hashes = hashes
+        self.phashes = phashes
+        self.dhashes = dhashes
+        self.errors = errors
+        self._positions = None
+        self._stems = None
+        return changes
+
+    def _position_map(self):
+        if self._positions is None:
+            self._positions = {name: i for i, name in enumerate(self.names)}
+        return self._positions
+
+    def __len__(self):
+        return len(self.names)
+
+    def _position(self, image_path):
+        """Row of an image path, None unless the path is in images_dir and cataloged."""
+        path = Path(image_path)
+        if path.parent != self.images_dir:
+            if self._resolved_dir is None:
+                self._resolved_dir = self.images_dir.resolve()
+            if path.parent.resolve() != self._resolved_dir:
+                return None
+        return self._position_map().get(path.name)
+
+    def __contains__(self, image_path):
+        return self._position(image_path) is not None
+
+    def paths(self, limit=None):
+        """Image paths in file name order, optionally only the first `limit`."""
+        names = self.names[:limit] if limit else self.names
+        return [self.images_dir / name for name in names]
+
+    def get(self, image_path):
+        """
+        Returns the catalog row of an image in images_dir as a dict, or None.
+        width/height are -1 and 'error' is set if the header could not be read.
+        """
+        i = self._position(image_path)
+        return self._row(i) if i is not None else None
+
+    def _row(self, i):
+        row = {'path': str(self.images_dir / self.names[i]), 'content_hash': self.hashes[i].hex(),
+               'phash': int(self.phashes[i]), 'dhash': int(self.dhashes[i]),
+               'has_label': bool(self.columns['label_mtime_ns'][i] >= 0),
+               'error': self.errors.get(self.names[i])}
+        row.update({name: int(self.columns[name][i]) for name in COLUMNS})
+        return row
+
+    def find_stem(self, stem):
+        """Row of the image with this file stem (as label files are named), or None."""
+        if self._stems is None:
+            self._stems = {Path(name).stem: name for name in self.names}
+        name = self._stems.get(stem)
+        return self._row(self._position_map()[name]) if name else None
+
+    def label_mtimes(self):
+        """{stem: label file mtime} of the images with a label file."""
+        labeled = np.flatnonzero(self.columns['label_mtime_ns'] >= 0)
+        return {Path(self.names[i]).stem: int(self.columns['label_mtime_ns'][i]) for i in labeled}
+
+    def content_hash(self, image_path):
+        i = self._position(image_path)
+        return self.hashes[i].hex() if i is not None else None
+
+    def content_hashes(self, image_paths):
+        """{str(path): hash} for paths in the catalog (as RunManifest.content_hash computes them)."""
+        hashes = {}
+        for path in image_paths:
+            content_hash = self.content_hash(path)
+            if content_hash is not None:
+                hashes[str(path)] = content_hash
+        return hashes
+
+    def summary(self):
+        labeled = int((self.columns['label_mtime_ns'] >= 0).sum())
+        return (f"Catalog {self.images_dir}: {len(self)} images ({self.columns['size'].sum() / 2 ** 20:.1f} MiB), "
+                f"{labeled} labeled with {int(self.columns['boxes'].sum())} boxes, {len(self.errors)} unreadable")
+
+    def save(self, path):
+        state = {
+            'version': CATALOG_VERSION,
+            'images_dir': str(self.images_dir),
+            'labels_dir': str(self.labels_dir),
+            'names': self.names,
+            'columns': self.columns,
+            'hashes': self.hashes,
+            'phashes': self.phashes,
+            'dhashes': self.dhashes,
+            'errors': self.errors,
+        }
+        with open(path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """Loads a saved catalog, or returns None if it is missing or from another version."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            print(f"Error loading catalog {path}: {e}")
+            return None
+        if state.get('version') != CATALOG_VERSION:
+            return None
+        catalog = cls(state['images_dir'], state['labels_dir'])
+        catalog.names = state['names']
+        catalog.columns = state['columns']
+        catalog.hashes = state['hashes']
+        catalog.phashes = state['phashes']
+        catalog.dhashes = state['dhashes']
+        catalog.errors = state['errors']
+        return catalog
+
+
+def list_split_images(folder, limit=None):
+    """Images of a folder from its split catalog when it is <data>/<split>/images, else from a directory scan."""
+    catalog = DatasetCatalog.for_folder(folder)
+    if catalog is not None:
+        return catalog.paths(limit)
+    from vision_worker import list_images
+    return list_images(folder, limit)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or update the image catalog of dataset splits.")
+    parser.add_argument('splits', nargs='*', default=['train', 'valid', 'test'])
+    parser.add_argument('--data-dir', default='data')
+    args = parser.parse_args()
+    for split in args.splits:
+        if (Path(args.data_dir) / split / 'images').exists():
+            print(DatasetCatalog.for_split(split, args.data_dir).summary())
@@ -0,0 +1,156 @@
+import polars as pl
+from data_filter import CONFIDENCE_THRESHOLD, load_thresholds, threshold_lookup
+
+BBOX_COLUMNS = ('x1', 'y1', 'x2', 'y2')
+
+# Typed columns; repeated strings are stored once per distinct value
+SCHEMA = {
+    'image_path': pl.Categorical,
+    'label': pl.Categorical,
+    'confidence': pl.Float64,
+    'x1': pl.Float64,
+    'y1': pl.Float64,
+    'x2': pl.Float64,
+    'y2': pl.Float64,
+    'flag_reason': pl.Categorical,
+    'vlm_verification': pl.Categorical,
+}
+
+
+class DetectionTable:
+    """
+    Columnar store for detections, one row per detection dict.
+
+    Columns follow SCHEMA: image_path, label, confidence, the xyxy bbox split into
+    x1/y1/x2/y2, flag_reason and vlm_verification (null where a dict lacks the key).
+    Other dict keys are not kept.
+
+    Args:
+        frame (pl.DataFrame): Data with the SCHEMA columns; missing ones are filled with nulls.
+    """
+
+    def __init__(self, frame):
+        missing = [pl.lit(None).alias(name) for name in SCHEMA if name not in frame.columns]
+        if missing:
+            frame = frame.with_columns(missing)
+        self.frame = frame.select([pl.col(name).cast(dtype) for name, dtype in SCHEMA.items()])
+
+    def __len__(self):
+        return self.frame.height
+
+    @classmethod
+    def from_dicts(cls, detections):
+        """Builds a table from detection dicts as produced by VisionWorker and the pipeline stages."""
+        columns = {name: [] for name in SCHEMA}
+        for detection in detections:
+            bbox = detection.get('bbox') or (None, None, None, None)
+            columns['image_path'].append(detection.get('image_path'))
+            columns['label'].append(detection.get('label'))
+            columns['confidence'].append(detection.get('confidence'))
+            for name, value in zip(BBOX_COLUMNS, bbox):
+                columns[name].append(value)
+            columns['flag_reason'].append(detection.get('flag_reason'))
+            columns['vlm_verification'].append(detection.get('vlm_verification'))
+        return cls(pl.DataFrame(columns, schema={name: pl.String if dtype == pl.Categorical else dtype
+                                                 for name, dtype in SCHEMA.items()}))
+
+    def to_dicts(self):
+        """
+        Returns detection dicts in the pipeline format. flag_reason and
+        vlm_verification are only set on rows where they are not null.
+        """
+        detections = []
+        for row in self.frame.iter_rows(named=True):
+            detection = {
+                'image_path': row['image_path'],
+                'label': row['label'],
+                'confidence': row['confidence'],
+                'bbox': [row[name] for name in BBOX_COLUMNS],
+            }
+            for key in ('flag_reason', 'vlm_verification'):
+                if row[key] is not None:
+                    detection[key] = row[key]
+            detections.append(detection)
+        return detections
+
+    @classmethod
+    def read_parquet(cls, path):
+        return cls(pl.read_parquet(path))
+
+    def write_parquet(self, path):
+        self.frame.write_parquet(path)
+
+    def filter_confidence(self, threshold=None, taxonomy=None):
+        """
+        Vectorized data_filter.filter_detections.
+
+        Args:
+            threshold (float or dict): One threshold for every class, or per-class thresholds as
+                                       returned by data_filter.load_thresholds (the default).
+            taxonomy (Taxonomy): Fallback for labels without a threshold of their own, as in
+                                 data_filter.filter_detections.
+
+        Returns:
+            tuple: (confident DetectionTable, audit-required DetectionTable with flag_reason
+                   'No Objects Found' for label-less rows and 'Low Confidence' below threshold).
+        """
+        thresholds = threshold if threshold is not None else load_thresholds()
+        if isinstance(thresholds, dict):
+            # One lookup per distinct label, so equivalent labels resolve as in filter_detections
+            threshold_for = threshold_lookup(thresholds, taxonomy)
+            labels = self.frame.get_column('label').drop_nulls().unique().cast(pl.String)
+            cutoff = pl.col('label').cast(pl.String).replace_strict(
+                {label: threshold_for(label) for label in labels}, default=thresholds['default'],
+                return_dtype=pl.Float64)
+        else:
+            cutoff = pl.lit(float(thresholds))
+
+        no_label = pl.col('label').is_null()
+        low = pl.col('confidence').fill_null(0.0) < cutoff
+        confident = self.frame.filter(~no_label & ~low)
+        audit = self.frame.filter(no_label | low).with_columns(
+            pl.when(pl.col('label').is_null()).then(pl.lit('No Objects Found'))
+            .otherwise(pl.lit('Low Confidence')).cast(pl.Categorical).alias('flag_reason')
+        )
+        return DetectionTable(confident), DetectionTable(audit)
+
+    def per_image_stats(self):
+        """
+        Per image: detection count, max and mean confidence, sorted unique labels,
+        flagged and VLM-confirmed (YES) counts.
+        """
+        return (
+            self.frame.group_by('image_path')
+            .agg(
+                pl.col('label').drop_nulls().len().alias('count'),
+                pl.col('confidence').max().alias('max_conf'),
+                pl.col('confidence').mean().alias('mean_conf'),
+                pl.col('label').drop_nulls().cast(pl.String).unique().sort().alias('labels'),
+                pl.col('flag_reason').is_not_null().sum().alias('flagged'),
+                (pl.col('vlm_verification') == 'YES').sum().alias('vlm_yes'),
+            )
+            .with_columns(pl.col('image_path').cast(pl.String))
+            .sort('image_path')
+        )
+
+    def per_class_stats(self):
+        """
+        Per label: detection count, image count, mean/max confidence, low-confidence
+        count (below CONFIDENCE_THRESHOLD), flagged count and VLM YES/NO counts.
+        """
+        return (
+            self.frame.filter(pl.col('label').is_not_null())
+            .group_by('label')
+            .agg(
+                pl.len().alias('count'),
+                pl.col('image_path').n_unique().alias('images'),
+                pl.col('confidence').mean().alias('mean_conf'),
+                pl.col('confidence').max().alias('max_conf'),
+                (pl.col('confidence') < CONFIDENCE_THRESHOLD).sum().alias('low_confidence'),
+                pl.col('flag_reason').is_not_null().sum().alias('flagged'),
+                (pl.col('vlm_verification') == 'YES').sum().alias('vlm_yes'),
+                (pl.col('vlm_verification') == 'NO').sum().alias('vlm_no'),
+            )
+            .with_columns(pl.col('label').cast(pl.String))
+            .sort('count', descending=True)
+        )
@@ -0,0 +1,411 @@
+import json
+from pathlib import Path
+import numpy as np
+from iou_matcher import paired_iou
+
+# Written by main.run_pipeline, read by the report stage (visual_report.render_report)
+EVALUATION_FILE = 'evaluation.json'
+
+# COCO: IoU thresholds .50:.05:.95, precision sampled at 101 recall points
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+RECALL_POINTS = np.linspace(0.0, 1.0, 101)
+
+SPLITS = ('train', 'valid', 'test')
+
+# Pipeline tiers in story order (see pipeline_tiers)
+TIERS = {
+    'raw': 'Raw YOLO',
+    'filtered': 'Filtered (High Conf)',
+    'verified': 'Final (VLM Verified)',
+}
+
+
+def image_key(image_path):
+    """'<split>/<stem>' of a data/<split>/images/<file> path (Windows separators too)."""
+    parts = str(image_path).replace('\\', '/').split('/')
+    split = parts[-3] if len(parts) >= 3 else ''
+    return f"{split}/{Path(parts[-1]).stem}"
+
+
+class GroundTruthBoxes:
+    """
+    Every GT box of a set of splits as flat arrays: image id, class id and xyxy pixel box.
+
+    Args:
+        image_keys (list): image_key of every labeled image; image ids index it.
+        image_ids (np.ndarray): (G,) int64.
+        cls_ids (np.ndarray): (G,) int64.
+        boxes (np.ndarray): (G, 4) float64.
+        class_names (list): Names of the class ids.
+    """
+
+    def __init__(self, image_keys, image_ids, cls_ids, boxes, class_names):
+        self.image_keys = list(image_keys)
+        self.image_ids = image_ids
+        self.cls_ids = cls_ids
+        self.boxes = boxes
+        self.class_names = list(class_names)
+
+    @classmethod
+    def for_splits(cls, splits=SPLITS, data_dir='data', class_names=None):
+        """Reads data/<split>/labels through each split's GroundTruthIndex (and catalog)."""
+        from gt_index import GroundTruthIndex
+        from dataset_catalog import DatasetCatalog
+        from validator import get_class_names
+
+        class_names = class_names if class_names is not None else get_class_names()
+        keys, image_ids, cls_ids, boxes = [], [], [], []
+        for split in splits:
+            if not (Path(data_dir) / split / 'labels').exists():
+                continue
+            index = GroundTruthIndex.for_split(split, data_dir, class_names=class_names,
+                                               catalog=DatasetCatalog.for_split(split, data_dir))
+            for stem in sorted(index.cls_ids):
+                image_ids.append(np.full(len(index.cls_ids[stem]), len(keys), dtype=np.int64))
+                cls_ids.append(index.cls_ids[stem].astype(np.int64))
+                boxes.append(index.boxes[stem])
+                keys.append(f"{split}/{stem}")
+        if not keys:
+            return cls([], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros((0, 4)), class_names)
+        return cls(keys, np.concatenate(image_ids), np.concatenate(cls_ids), np.concatenate(boxes).reshape(-1, 4),
+                   class_names)
+
+    def __len__(self):
+        return len(self.cls_ids)
+
+
+def detection_columns(detections):
+    """
+    (image paths, labels, confidences, boxes) of the labeled rows of detection dicts or a
+    DetectionTable: paths and labels as (unique values, int64 codes), the rest as arrays.
+    """
+    import polars as pl
+    from detection_table import DetectionTable
+
+    if not isinstance(detections, DetectionTable):
+        detections = DetectionTable.from_dicts(detections)
+    frame = detections.frame.filter(pl.col('label').is_not_null())
+
+    def codes(name):
+        values = frame[name].cast(pl.String)
+        return values.unique().sort().to_list(), (values.rank('dense').to_numpy().astype(np.int64) - 1)
+
+    boxes = frame.select('x1', 'y1', 'x2', 'y2').to_numpy().astype(np.float64).reshape(-1, 4)
+    return codes('image_path'), codes('label'), frame['confidence'].fill_null(0.0).to_numpy(), boxes
+
+
+def match_greedy(det_groups, det_scores, det_boxes, gt_groups, gt_boxes, iou_thresholds=IOU_THRESHOLDS):
+    """
+    COCO matching of detections to GT boxes of the same group (image and class), at every
+    IoU threshold at once: within a group, detections in descending score order each take
+    the highest-IoU GT box not matched yet with IoU >= the threshold.
+
+    Candidate pairs are generated for all groups at once. The greedy order only matters
+    within a group and a group holds one detection of each rank, so matching runs one
+    vectorized step per rank (the size of the largest group), not per detection.
+
+    Args:
+        det_groups (np.ndarray): (N,) int64 group per detection, -1 for no GT class.
+        det_scores (np.ndarray): (N,) confidences.
+        det_boxes (np.ndarray): (N, 4) xyxy boxes.
+        gt_groups (np.ndarray): (G,) int64 group per GT box.
+        gt_boxes (np.ndarray): (G, 4) xyxy boxes.
+
+    Returns:
+        np.ndarray: (T, N) bool, True where the detection is a true positive at that threshold.
+    """
+    n, thresholds = len(det_groups), np.asarray(iou_thresholds, dtype=np.float64)
+    tp = np.zeros((len(thresholds), n), dtype=bool)
+    if not n or not len(gt_groups):
+        return tp
+
+    # Rank of each detection within its group, by descending score (stable, like COCO's mergesort)
+    order = np.lexsort((-det_scores, det_groups))
+    sorted_groups = det_groups[order]
+    positions = np.arange(n)
+    starts = np.maximum.accumulate(np.where(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]], positions, 0))
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = positions - starts
+
+    # Every (detection, GT box) pair of a group
+    gt_order = np.argsort(gt_groups, kind='stable')
+    gt_sorted = gt_groups[gt_order]
+    lo = np.searchsorted(gt_sorted, det_groups, side='left')
+    counts = np.where(det_groups >= 0, np.searchsorted(gt_sorted, det_groups, side='right') - lo, 0)
+    pair_det = np.repeat(positions, counts)
+    offsets = np.arange(len(pair_det)) - np.repeat(np.cumsum(counts) - counts, counts)
+    pair_gt = gt_order[np.repeat(lo, counts) + offsets]
+    pair_iou = paired_iou(det_boxes[pair_det], gt_boxes[pair_gt])
+
+    keep = pair_iou >= thresholds.min()
+    pair_det, pair_gt, pair_iou = pair_det[keep], pair_gt[keep], pair_iou[keep]
+    # By rank, then detection, then descending IoU: a detection's first free pair is its best
+    pair_order = np.lexsort((pair_gt, -pair_iou, pair_det, rank[pair_det]))
+    pair_det, pair_gt, pair_iou = pair_det[pair_order], pair_gt[pair_order], pair_iou[pair_order]
+    bounds = np.searchsorted(rank[pair_det], np.arange(rank.max() + 2))
+
+    matched = np.zeros((len(gt_groups), len(thresholds)), dtype=bool)
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        if start == end:
+            continue
+        dets, gts = pair_det[start:end], pair_gt[start:end]
+        free = (pair_iou[start:end, None] >= thresholds[None, :]) & ~matched[gts]
+        candidates = np.where(free, np.arange(end - start)[:, None], end - start)
+        firsts = np.flatnonzero(np.r_[True, dets[1:] != dets[:-1]])
+        best = np.minimum.reduceat(candidates, firsts, axis=0)
+        hit = best < end - start
+        tp[:, dets[firsts]] = hit.T
+        segment, threshold = np.nonzero(hit)
+        matched[gts[best[segment, threshold]], threshold] = True
+    return tp
+
+
+def precision_recall(tp, det_classes, det_scores, gt_counts):
+    """
+    Per-class PR curves of matched detections in one pass over all classes: detections
+    are sorted by (class, descending score) once and TP/FP are cumulated per class segment.
+
+    Args:
+        tp (np.ndarray): (T, N) true positive flags (see match_greedy).
+        det_classes (np.ndarray): (N,) class ids, all >= 0.
+        det_scores (np.ndarray): (N,) confidences.
+        gt_counts (np.ndarray): (K,) GT boxes per class.
+
+    Returns:
+        dict: 'ap' (K, T) average precision (NaN for classes without GT boxes), 'curve' (K, T, 101)
+              interpolated precision at RECALL_POINTS, 'tp' (K, T) true positives, 'detections' (K,).
+    """
+    k, t = len(gt_counts), tp.shape[0]
+    curve = np.zeros((k, t, len(RECALL_POINTS)))
+    detections = np.bincount(det_classes, minlength=k)[:k]
+    true_positives = np.zeros((k, t), dtype=np.int64)
+
+    if len(det_classes):
+        order = np.lexsort((-det_scores, det_classes))
+        classes = det_classes[order]
+        hits = tp[:, order]
+        positions = np.arange(len(classes))
+        starts = np.maximum.accumulate(np.where(np.r_[True, classes[1:] != classes[:-1]], positions, 0))
+
+        # Cumulative TP/FP from the start of each class segment
+        tp_cum = np.cumsum(hits, axis=1)
+        before = np.where(starts > 0, tp_cum[:, np.maximum(starts - 1, 0)], 0)
+        tp_cum = tp_cum - before
+        fp_cum = (positions - starts + 1)[None, :] - tp_cum
+        gt_per_det = gt_counts[classes].astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            recall = np.where(gt_per_det > 0, tp_cum / gt_per_det, 0.0)
+        precision = tp_cum / (tp_cum + fp_cum)
+
+        # Precision envelope (max precision at any higher recall), per segment: the offset
+        # makes every earlier class exceed all later ones, so the running max resets per class
+        offset = 2.0 * (classes.max() - classes)
+        envelope = np.maximum.accumulate((precision + offset)[:, ::-1], axis=1)[:, ::-1] - offset
+
+        # First detection reaching each recall point, by searchsorted on recall shifted per class
+        present = np.unique(classes)
+        seg_end = np.searchsorted(classes, present, side='right')
+        shifted = recall + 2.0 * classes
+        queries = (RECALL_POINTS[None, :] + 2.0 * present[:, None]).ravel()
+        for threshold in range(t):
+            index = np.searchsorted(shifted[threshold], queries, side='left').reshape(len(present), -1)
+            valid = index < seg_end[:, None]
+            curve[present, threshold] = np.where(valid, envelope[threshold, np.minimum(index, len(classes) - 1)], 0.0)
+        true_positives[present] = tp_cum[:, seg_end - 1].T
+
+    ap = curve.mean(axis=2)
+    ap[gt_counts == 0] = np.nan
+    return {'ap': ap, 'curve': curve, 'tp': true_positives, 'detections': detections}
+
+
+class Evaluator:
+    """
+    COCO-style detection metrics against the dataset's ground truth: per-class PR curves,
+    AP@0.5, AP@[.5:.95], precision and recall, for one or several sets of detections.
+
+    Detector labels are mapped to GT classes by name, or through taxonomy equivalence
+    (aliases, case); detections whose label is no GT class count as false positives
+    in the overall precision but have no AP. There is no per-image detection cap.
+
+    Args:
+        gt (GroundTruthBoxes): Ground truth of the evaluated splits.
+        taxonomy (Taxonomy): Label taxonomy (see taxonomy.py), None for exact names only.
+    """
+
+    def __init__(self, gt, taxonomy=None):
+        self.gt = gt
+        self.taxonomy = taxonomy
+        self._key_ids = {key: i for i, key in enumerate(gt.image_keys)}
+        self._class_ids = {name: i for i, name in enumerate(gt.class_names)}
+        if taxonomy is not None:
+            for i, name in enumerate(gt.class_names):
+                self._class_ids.setdefault(taxonomy.label_id(name), i)
+
+    @classmethod
+    def for_splits(cls, splits=SPLITS, data_dir='data', taxonomy=None):
+        if taxonomy is None:
+            from taxonomy import get_taxonomy
+            taxonomy = get_taxonomy()
+        return cls(GroundTruthBoxes.for_splits(splits, data_dir), taxonomy or None)
+
+    def class_id(self, label):
+        class_id = self._class_ids.get(label)
+        if class_id is None and self.taxonomy is not None:
+            class_id = self._class_ids.get(self.taxonomy.label_id(label))
+        return -1 if class_id is None else class_id
+
+    def image_ids(self, images):
+        """Image ids of image paths; images without a label file get ids past the GT images."""
+        ids, extra = [], {}
+        for path in images:
+            key = image_key(path)
+            image_id = self._key_ids.get(key)
+            if image_id is None:
+                image_id = extra.setdefault(key, len(self.gt.image_keys) + len(extra))
+            ids.append(image_id)
+        return np.asarray(ids, dtype=np.int64)
+
+    def evaluate(self, detections, images=None):
+        """
+        Evaluates one set of detections.
+
+        Args:
+            detections (list or DetectionTable): Detection dicts ('image_path', 'label',
+                                                 'confidence', 'bbox') or a DetectionTable.
+            images (list): Image paths evaluated; their GT boxes count towards recall, detections
+                           on other images are ignored. None for every labeled image of the splits.
+
+        Returns:
+            dict: Overall 'map50', 'map', 'precision', 'recall' (at IoU 0.5), counts, and
+                  'classes' {class name: {gt, detections, tp, ap50, ap75, ap, precision, recall, curve}}
+                  with curve the interpolated precision at IoU 0.5 over RECALL_POINTS.
+        """
+        (paths, path_codes), (labels, label_codes), scores, boxes = detection_columns(detections)
+        det_images = self.image_ids(paths)[path_codes] if len(paths) else np.zeros(0, dtype=np.int64)
+        label_classes = np.asarray([self.class_id(label) for label in labels], dtype=np.int64)
+        det_classes = label_classes[label_codes] if len(labels) else np.zeros(0, dtype=np.int64)
+
+        gt_images, gt_classes, gt_boxes = self.gt.image_ids, self.gt.cls_ids, self.gt.boxes
+        if images is not None:
+            selected = np.unique(self.image_ids(images))
+            gt_keep = np.isin(gt_images, selected)
+            gt_images, gt_classes, gt_boxes = gt_images[gt_keep], gt_classes[gt_keep], gt_boxes[gt_keep]
+            det_keep = np.isin(det_images, selected)
+            det_images, det_classes = det_images[det_keep], det_classes[det_keep]
+            scores, boxes = scores[det_keep], boxes[det_keep]
+
+        k = max(len(self.gt.class_names), int(gt_classes.max()) + 1 if len(gt_classes) else 0)
+        gt_counts = np.bincount(gt_classes, minlength=k)
+        det_groups = np.where(det_classes >= 0, det_images * k + det_classes, -1)
+        tp = match_greedy(det_groups, scores, boxes, gt_images * k + gt_classes, gt_boxes)
+
+        known = det_classes >= 0
+        curves = precision_recall(tp[:, known], det_classes[known], scores[known], gt_counts)
+        total_tp = int(tp[0].sum())
+        classes = {}
+        for c in np.flatnonzero((gt_counts > 0) | (curves['detections'] > 0)).tolist():
+            n_gt, n_det, n_tp = int(gt_counts[c]), int(curves['detections'][c]), int(curves['tp'][c, 0])
+            ap = curves['ap'][c]
+            classes[self._class_name(c)] = {
+                'gt': n_gt, 'detections': n_det, 'tp': n_tp,
+                'ap50': _round(ap[0]), 'ap75': _round(ap[5]), 'ap': _round(np.nanmean(ap) if n_gt else np.nan),
+                'precision': _round(n_tp / n_det if n_det else np.nan),
+                'recall': _round(n_tp / n_gt if n_gt else np.nan),
+                'curve': [round(float(p), 4) for p in curves['curve'][c, 0]],
+            }
+        with_gt = gt_counts > 0
+        return {
+            'images': len(self.gt.image_keys) if images is None else int(len(selected)),
+            'gt': int(gt_counts.sum()),
+            'detections': int(len(det_classes)),
+            'unmatched_labels': int((~known).sum()),
+            'tp': total_tp,
+            'map50': _round(curves['ap'][with_gt, 0].mean() if with_gt.any() else np.nan),
+            'map': _round(curves['ap'][with_gt].mean() if with_gt.any() else np.nan),
+            'precision': _round(total_tp / len(det_classes) if len(det_classes) else np.nan),
+            'recall': _round(total_tp / gt_counts.sum() if gt_counts.sum() else np.nan),
+            'classes': classes,
+        }
+
+    def evaluate_tiers(self, tiers, images=None):
+        """
+        Evaluates the detections of every pipeline tier on the same images and GT.
+
+        Args:
+            tiers (dict): {tier: detections}, e.g. from pipeline_tiers.
+
+        Returns:
+            dict: {'iou_thresholds', 'recall_points', 'tiers': {tier: evaluate result}}.
+        """
+        return {
+            'iou_thresholds': [round(float(t), 2) for t in IOU_THRESHOLDS],
+            'recall_points': len(RECALL_POINTS),
+            'tiers': {tier: self.evaluate(detections, images) for tier, detections in tiers.items()},
+        }
+
+    def _class_name(self, class_id):
+        return self.gt.class_names[class_id] if class_id < len(self.gt.class_names) else str(class_id)
+
+
+def _round(value):
+    value = float(value)
+    return None if np.isnan(value) else round(value, 4)
+
+
+def pipeline_tiers(stage_results, vlm_results):
+    """
+    Detections of each pipeline tier from a batch run: every raw detection, those above
+    the confidence threshold, and the final dataset (confident detections that match the
+    ground truth plus the audited ones the VLM confirmed).
+    """
+    confident = stage_results['confident_detections']
+    return {
+        'raw': stage_results['detections'],
+        'filtered': confident + stage_results['validation_audit'],
+        'verified': confident + [item for item in vlm_results
+                                 if item.get('label') is not None and item.get('vlm_verification') == 'YES'],
+    }
+
+
+def _detection_key(item):
+    bbox = ','.join(f'{c:.2f}' for c in item.get('bbox') or [])
+    return item.get('image_path'), item.get('label'), bbox
+
+
+def file_tiers(detections, audited=(), thresholds=None, taxonomy=None):
+    """
+    pipeline_tiers from files: the filtered tier is recomputed with the confidence
+    thresholds; the verified tier drops filtered detections the audit report flagged
+    unless the VLM confirmed them, and adds the confirmed low-confidence ones.
+    """
+    from data_filter import threshold_lookup
+
+    threshold_for = threshold_lookup(thresholds, taxonomy)
+    labeled = [d for d in detections if d.get('label') is not None]
+    filtered = [d for d in labeled if (d.get('confidence') or 0.0) >= threshold_for(d['label'])]
+    confirmed = [item for item in audited
+                 if item.get('label') is not None and item.get('vlm_verification') == 'YES']
+    flagged = {_detection_key(item) for item in audited}
+    return {
+        'raw': labeled,
+        'filtered': filtered,
+        'verified': [d for d in filtered if _detection_key(d) not in flagged] + confirmed,
+    }
+
+
+def save_evaluation(evaluation, path=EVALUATION_FILE):
+    with open(path, 'w') as f:
+        json.dump(evaluation, f, indent=4)
+
+
+def summary_lines(evaluation):
+    """One line per tier: mAP@0.5, mAP@[.5:.95], precision and recall."""
+    lines = []
+    for tier, result in evaluation['tiers'].items():
+        def fmt(value):
+            return f"{value:.3f}" if value is not None else '-'
+        lines.append(f"{TIERS.get(tier, tier):22} mAP50 {fmt(result['map50'])}  mAP {fmt(result['map'])}  "
+                     f"P {fmt(result['precision'])}  R {fmt(result['recall'])}  "
+                     f"({result['detections']} detections, {result['gt']} GT boxes, {result['images']} images)")
+    return lines
+
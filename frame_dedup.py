@@ -0,0 +1,299 @@
+import argparse
+from pathlib import Path
+import numpy as np
+import metrics
+from iou_matcher import iou_matrix
+
+# pHash from the 8x8 lowest DCT frequencies of a 32x32 grayscale thumbnail, dHash from a 9x8 one
+THUMB_SIZE = 32
+HASH_SIZE = 8
+
+# Frames are near-duplicates when both hashes are within these Hamming distances (of 64 bits)
+MAX_PHASH_DISTANCE = 8
+MAX_DHASH_DISTANCE = 10
+
+# A sibling frame's audit item takes the representative's verdict when its box overlaps this much
+BOX_IOU = 0.8
+
+# Verdicts worth propagating; errors are image specific and re-audited, and an
+# UNCERTAIN (...) answer is no better a guess for the other frames
+PROPAGATED_VERDICTS = ('YES', 'NO')
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    return np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+
+
+_DCT = _dct_matrix(THUMB_SIZE)
+
+
+def thumbnails(image_path):
+    """
+    Grayscale (32, 32) and (8, 9) float32 thumbnails of an image. JPEGs are decoded
+    at reduced scale (PIL draft mode), so this reads much less than a full decode.
+    """
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        img.draft('L', (THUMB_SIZE * 2, THUMB_SIZE * 2))
+        gray = img.convert('L')
+        large = gray.resize((THUMB_SIZE, THUMB_SIZE), Image.LANCZOS)
+        small = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    return np.asarray(large, dtype=np.float32), np.asarray(small, dtype=np.float32)
+
+
+def _pack(bits):
+    # (N, 64) bools, most significant bit first, to uint64
+    return np.packbits(bits.reshape(len(bits), -1), axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def phash_batch(thumbs):
+    """pHashes of (N, 32, 32) thumbnails: DCT of the whole stack at once, low frequencies above their median."""
+    thumbs = np.asarray(thumbs, dtype=np.float64).reshape(-1, THUMB_SIZE, THUMB_SIZE)
+    low = (_DCT @ thumbs @ _DCT.T)[:, :HASH_SIZE, :HASH_SIZE].reshape(len(thumbs), -1)
+    return _pack(low > np.median(low, axis=1, keepdims=True))
+
+
+def dhash_batch(thumbs):
+    """dHashes of (N, 8, 9) thumbnails: whether each pixel is brighter than its right neighbour."""
+    thumbs = np.asarray(thumbs, dtype=np.float64).reshape(-1, HASH_SIZE, HASH_SIZE + 1)
+    return _pack(thumbs[:, :, 1:] > thumbs[:, :, :-1])
+
+
+def image_hashes(image_paths):
+    """
+    (phashes, dhashes, errors) of images: uint64 arrays (0 for unreadable images)
+    and {position: error message}.
+    """
+    large = np.zeros((len(image_paths), THUMB_SIZE, THUMB_SIZE), dtype=np.float32)
+    small = np.zeros((len(image_paths), HASH_SIZE, HASH_SIZE + 1), dtype=np.float32)
+    errors = {}
+    for i, path in enumerate(image_paths):
+        try:
+            large[i], small[i] = thumbnails(path)
+        except Exception as e:
+            errors[i] = str(e)
+    phashes, dhashes = phash_batch(large), dhash_batch(small)
+    for i in errors:
+        phashes[i] = dhashes[i] = 0
+    return phashes, dhashes, errors
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes with the Hamming distance. A search
+    only descends into children whose edge distance is within max_distance of
+    the query's distance to the node (triangle inequality).
+    """
+
+    def __init__(self):
+        self.root = None
+
+    def add(self, key, value):
+        node = self.root
+        if node is None:
+            self.root = (key, [value], {})
+            return
+        while True:
+            distance = (node[0] ^ key).bit_count()
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (key, [value], {})
+                return
+            node = child
+
+    def search(self, key, max_distance):
+        """Values of every key within max_distance, as (distance, value) pairs."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node_key, values, children = stack.pop()
+            distance = (node_key ^ key).bit_count()
+            if distance <= max_distance:
+                found.extend((distance, value) for value in values)
+            for edge, child in children.items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        return found
+
+
+class FrameClusters:
+    """
+    Groups of near-identical images (consecutive video frames), by perceptual hash.
+
+    Two images are linked when their pHashes and dHashes are both within the max
+    distances; clusters are the connected components. Images are matched by file
+    name, like DatasetCatalog.get.
+
+    Args:
+        cluster_of (dict): {file name: cluster id}, only for images in a cluster of 2 or more.
+    """
+
+    def __init__(self, cluster_of=None):
+        self.cluster_of = cluster_of or {}
+
+    @classmethod
+    def build(cls, names, phashes, dhashes, max_phash_distance=MAX_PHASH_DISTANCE,
+              max_dhash_distance=MAX_DHASH_DISTANCE):
+        phashes = [int(h) for h in phashes]
+        dhashes = [int(h) for h in dhashes]
+        parent = list(range(len(names)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        tree = BKTree()
+        for i, phash in enumerate(phashes):
+            for _, j in tree.search(phash, max_phash_distance):
+                if (dhashes[i] ^ dhashes[j]).bit_count() <= max_dhash_distance:
+                    parent[find(i)] = find(j)
+            tree.add(phash, i)
+
+        members = {}
+        for i in range(len(names)):
+            members.setdefault(find(i), []).append(i)
+        cluster_of = {}
+        for cluster_id, positions in enumerate(group for group in members.values() if len(group) > 1):
+            for i in positions:
+                cluster_of[Path(names[i]).name] = cluster_id
+        return cls(cluster_of)
+
+    @classmethod
+    def from_catalog(cls, catalog, **kwargs):
+        """Clusters a split from the hashes in its DatasetCatalog (unreadable images are left out)."""
+        keep = [i for i, name in enumerate(catalog.names) if name not in catalog.errors]
+        return cls.build([catalog.names[i] for i in keep], catalog.phashes[keep], catalog.dhashes[keep], **kwargs)
+
+    @classmethod
+    def for_images(cls, image_paths, **kwargs):
+        """
+        Clusters images, taking hashes from the catalog of <data>/<split>/images folders
+        and hashing images anywhere else.
+        """
+        from dataset_catalog import DatasetCatalog
+
+        names, phashes, dhashes, loose = [], [], [], []
+        by_folder = {}
+        for path in dict.fromkeys(str(path) for path in image_paths):
+            by_folder.setdefault(Path(path).parent, []).append(path)
+        for folder, paths in by_folder.items():
+            catalog = DatasetCatalog.for_folder(folder)
+            for path in paths:
+                row = catalog.get(path) if catalog is not None else None
+                if row is None:
+                    loose.append(path)
+                elif not row['error']:
+                    names.append(path)
+                    phashes.append(row['phash'])
+                    dhashes.append(row['dhash'])
+        if loose:
+            loose_phashes, loose_dhashes, errors = image_hashes(loose)
+            for i, path in enumerate(loose):
+                if i not in errors and Path(path).exists():
+                    names.append(path)
+                    phashes.append(int(loose_phashes[i]))
+                    dhashes.append(int(loose_dhashes[i]))
+        return cls.build(names, phashes, dhashes, **kwargs)
+
+    def cluster(self, image_path):
+        """Cluster id of an image, None if it has no near-duplicates."""
+        return self.cluster_of.get(Path(image_path).name)
+
+    def __len__(self):
+        return len(set(self.cluster_of.values()))
+
+    def summary(self):
+        return f"Frame clusters: {len(self.cluster_of)} near-duplicate images in {len(self)} clusters"
+
+
+def dedup_audit_items(items, clusters, iou_threshold=BOX_IOU):
+    """
+    Picks the audit items that can take the verdict of an item in a sibling frame.
+
+    An item follows the first earlier item of another image in the same cluster
+    with the same label and a box IoU of at least iou_threshold (frames of one
+    video share the resolution, so pixel boxes compare directly).
+
+    Returns:
+        dict: {follower position: leader position}; every other item is audited.
+    """
+    leaders = {}
+    followers = {}
+    for position, item in enumerate(items):
+        cluster = clusters.cluster(item.get('image_path', ''))
+        if cluster is None or item.get('label') is None or not item.get('bbox'):
+            continue
+        candidates = leaders.setdefault((cluster, item['label']), [])
+        others = [p for p in candidates if items[p]['image_path'] != item['image_path']]
+        if others:
+            ious = iou_matrix([item['bbox']], [items[p]['bbox'] for p in others])[0]
+            best = int(ious.argmax())
+            if ious[best] >= iou_threshold:
+                followers[position] = others[best]
+                continue
+        candidates.append(position)
+    return followers
+
+
+def propagate_verdict(item, leader):
+    """Copies the leader's vlm_* fields onto a follower item."""
+    for key, value in leader.items():
+        if key.startswith('vlm_'):
+            item[key] = value
+    item['vlm_propagated_from'] = leader['image_path']
+    metrics.count('dedup_propagated')
+    return item
+
+
+def iter_with_followers(items, followers, audited, audit_one, stats=None):
+    """
+    Yields every item in order: leaders and unclustered items from `audited` (the
+    audit of the non-follower items, in order), followers with their leader's verdict.
+    A follower whose leader got no usable verdict is audited on its own with audit_one.
+    Propagated verdicts are counted in stats['propagated'].
+    """
+    audited = iter(audited)
+    leader_positions = set(followers.values())
+    leaders = {}
+    for position, item in enumerate(items):
+        if position not in followers:
+            result = next(audited)
+            if position in leader_positions:
+                leaders[position] = result
+            yield result
+            continue
+        leader = leaders[followers[position]]
+        if leader.get('vlm_verification') in PROPAGATED_VERDICTS:
+            if stats is not None:
+                stats['propagated'] = stats.get('propagated', 0) + 1
+            yield propagate_verdict(item, leader)
+        else:
+            yield audit_one(item)
+
+
+if __name__ == "__main__":
+    from dataset_catalog import DatasetCatalog
+
+    parser = argparse.ArgumentParser(description="Lists clusters of near-duplicate frames in a dataset split.")
+    parser.add_argument('split', nargs='?', default='train')
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--max-phash-distance', type=int, default=MAX_PHASH_DISTANCE)
+    parser.add_argument('--max-dhash-distance', type=int, default=MAX_DHASH_DISTANCE)
+    args = parser.parse_args()
+
+    catalog = DatasetCatalog.for_split(args.split, args.data_dir)
+    clusters = FrameClusters.from_catalog(catalog, max_phash_distance=args.max_phash_distance,
+                                          max_dhash_distance=args.max_dhash_distance)
+    print(clusters.summary())
+    groups = {}
+    for name, cluster_id in clusters.cluster_of.items():
+        groups.setdefault(cluster_id, []).append(name)
+    for names in sorted(groups.values(), key=len, reverse=True)[:20]:
+        print(f"{len(names):4d}  {', '.join(sorted(names)[:4])}{' ...' if len(names) > 4 else ''}")
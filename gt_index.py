@@ -0,0 +1,205 @@
+import pickle
+from pathlib import Path
+import numpy as np
+
+INDEX_VERSION = 1
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+
+def read_image_size(image_path):
+    """
+    Reads (width, height) from the image header. PIL opens lazily, so no pixels are decoded.
+    """
+    from PIL import Image
+
+    with Image.open(image_path) as img:
+        return img.size
+
+
+def parse_label_file(label_path, img_width, img_height):
+    """
+    Parses a YOLO label file into class ids and xyxy boxes in pixel coordinates.
+
+    Returns:
+        tuple: (cls_ids int32 array of shape (M,), boxes float64 array of shape (M, 4))
+    """
+    cls_ids = []
+    rows = []
+    with open(label_path, 'r') as f:
+        for line in f:
+            parts = line.strip().split()
+            if len(parts) >= 5:
+                cls_ids.append(int(parts[0]))
+                rows.append([float(p) for p in parts[1:5]])
+
+    if not rows:
+        return np.zeros(0, dtype=np.int32), np.zeros((0, 4), dtype=np.float64)
+
+    yolo = np.asarray(rows, dtype=np.float64)
+    # Same operation order as validator.yolo_to_xyxy so the boxes match it bit for bit
+    x_center = yolo[:, 0] * img_width
+    y_center = yolo[:, 1] * img_height
+    width = yolo[:, 2] * img_width
+    height = yolo[:, 3] * img_height
+    boxes = np.stack([x_center - (width / 2), y_center - (height / 2),
+                      x_center + (width / 2), y_center + (height / 2)], axis=1)
+    return np.asarray(cls_ids, dtype=np.int32), boxes
+
+
+class GroundTruthIndex:
+    """
+    In-memory index of every ground truth label in a dataset split.
+
+    Each label file and image header is read once. Boxes are kept per image
+    (keyed by file stem) as xyxy float64 arrays next to their class ids.
+    """
+
+    def __init__(self, labels_dir, images_dir=None, class_names=None, catalog=None):
+        self.labels_dir = Path(labels_dir)
+        self.images_dir = Path(images_dir) if images_dir else self.labels_dir.parent / 'images'
+        self.class_names = list(class_names) if class_names is not None else []
+        # dataset_catalog.DatasetCatalog of the split: label mtimes and image sizes without touching the files
+        self.catalog = catalog
+        self.boxes = {}
+        self.cls_ids = {}
+        self.sizes = {}
+        self.errors = {}
+        self.label_mtimes = {}
+
+    @classmethod
+    def for_split(cls, split='train', data_dir='data', class_names=None, use_cache=True, catalog=None):
+        """
+        Builds (or reloads from disk) the index for data/<split>/labels.
+
+        With the split's DatasetCatalog, freshness and image sizes come from the catalog
+        instead of a labels folder scan and image header reads.
+        """
+        labels_dir = Path(data_dir) / split / 'labels'
+        cache_path = Path(data_dir) / f'gt_index_{split}.pkl'
+        if use_cache:
+            index = cls.load(cache_path, class_names=class_names)
+            if index is not None:
+                index.catalog = catalog
+                if index.is_fresh():
+                    return index
+        index = cls(labels_dir, class_names=class_names, catalog=catalog)
+        index.build()
+        if use_cache:
+            index.save(cache_path)
+        return index
+
+    def _find_image(self, stem):
+        for ext in IMAGE_EXTENSIONS:
+            candidate = self.images_dir / f'{stem}{ext}'
+            if candidate.exists():
+                return candidate
+        return None
+
+    def _current_mtimes(self):
+        if self.catalog is not None:
+            return self.catalog.label_mtimes()
+        if not self.labels_dir.exists():
+            return {}
+        return {p.stem: p.stat().st_mtime_ns for p in self.labels_dir.iterdir() if p.suffix == '.txt'}
+
+    def build(self):
+        """Loads every label file in the split."""
+        self.label_mtimes = self._current_mtimes()
+        for stem in self.label_mtimes:
+            self._load_one(stem)
+        return self
+
+    def _load_one(self, stem):
+        try:
+            if self.catalog is not None:
+                row = self.catalog.find_stem(stem)
+                if row is None:
+                    raise FileNotFoundError(f"No image for label {stem}")
+                if row['error']:
+                    raise ValueError(row['error'])
+                img_width, img_height = row['width'], row['height']
+            else:
+                image_path = self._find_image(stem)
+                if image_path is None:
+                    raise FileNotFoundError(f"No image for label {stem}")
+                img_width, img_height = read_image_size(image_path)
+        except Exception as e:
+            self.errors[stem] = str(e)
+            return
+        cls_ids, boxes = parse_label_file(self.labels_dir / f'{stem}.txt', img_width, img_height)
+        self.sizes[stem] = (img_width, img_height)
+        self.cls_ids[stem] = cls_ids
+        self.boxes[stem] = boxes
+
+    def is_fresh(self):
+        """True if no label file was added, removed or modified since the index was built."""
+        return self._current_mtimes() == self.label_mtimes
+
+    def __contains__(self, image_path):
+        return Path(image_path).stem in self.label_mtimes
+
+    def __len__(self):
+        return len(self.label_mtimes)
+
+    def get(self, image_path):
+        """
+        Returns the GT entry for an image.
+
+        Returns:
+            tuple or None: (cls_ids, boxes) arrays, or None if the image has no label file.
+
+        Raises:
+            ValueError: If the label exists but the image size could not be read.
+        """
+        stem = Path(image_path).stem
+        if stem not in self.label_mtimes:
+            return None
+        if stem in self.errors:
+            raise ValueError(self.errors[stem])
+        return self.cls_ids[stem], self.boxes[stem]
+
+    def class_counts(self):
+        """GT boxes per class id over the split, (K,) int64 array (K >= len(class_names))."""
+        cls_ids = [ids for ids in self.cls_ids.values() if len(ids)]
+        ids = np.concatenate(cls_ids) if cls_ids else np.zeros(0, dtype=np.int32)
+        return np.bincount(ids[ids >= 0], minlength=len(self.class_names))
+
+    def class_name(self, cls_id):
+        cls_id = int(cls_id)
+        return self.class_names[cls_id] if 0 <= cls_id < len(self.class_names) else str(cls_id)
+
+    def save(self, path):
+        state = {
+            'version': INDEX_VERSION,
+            'labels_dir': str(self.labels_dir),
+            'images_dir': str(self.images_dir),
+            'boxes': self.boxes,
+            'cls_ids': self.cls_ids,
+            'sizes': self.sizes,
+            'errors': self.errors,
+            'label_mtimes': self.label_mtimes,
+        }
+        with open(path, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path, class_names=None):
+        """Loads a saved index, or returns None if it is missing or from another version."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            print(f"Error loading GT index {path}: {e}")
+            return None
+        if state.get('version') != INDEX_VERSION:
+            return None
+        index = cls(state['labels_dir'], state['images_dir'], class_names=class_names)
+        index.boxes = state['boxes']
+        index.cls_ids = state['cls_ids']
+        index.sizes = state['sizes']
+        index.errors = state['errors']
+        index.label_mtimes = state['label_mtimes']
+        return index
@@ -0,0 +1,311 @@
+import numpy as np
+
+ASSIGNMENT_MODES = (None, 'greedy', 'hungarian')
+
+# match_detections uses the sweep index from this many detection x GT pairs on, when
+# the sweep windows hold at most this fraction of them (see bench/bench_iou.py run_index)
+INDEX_MIN_PAIRS = 20_000
+MAX_WINDOW_FRACTION = 0.2
+
+
+def iou_matrix(det_boxes, gt_boxes):
+    """
+    Calculates IoU between every detection and every GT box in one vectorized pass.
+
+    Uses the same arithmetic as validator.calculate_iou, so values are identical.
+
+    Args:
+        det_boxes (array-like): (N, 4) xyxy boxes.
+        gt_boxes (array-like): (M, 4) xyxy boxes.
+
+    Returns:
+        np.ndarray: (N, M) float64 IoU matrix.
+    """
+    det = np.asarray(det_boxes, dtype=np.float64).reshape(-1, 4)
+    gt = np.asarray(gt_boxes, dtype=np.float64).reshape(-1, 4)
+
+    x1 = np.maximum(det[:, None, 0], gt[None, :, 0])
+    y1 = np.maximum(det[:, None, 1], gt[None, :, 1])
+    x2 = np.minimum(det[:, None, 2], gt[None, :, 2])
+    y2 = np.minimum(det[:, None, 3], gt[None, :, 3])
+
+    intersection = np.maximum(0, x2 - x1) * np.maximum(0, y2 - y1)
+
+    det_area = (det[:, 2] - det[:, 0]) * (det[:, 3] - det[:, 1])
+    gt_area = (gt[:, 2] - gt[:, 0]) * (gt[:, 3] - gt[:, 1])
+
+    union = det_area[:, None] + gt_area[None, :] - intersection
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = np.where(union == 0, 0.0, intersection / np.where(union == 0, 1.0, union))
+    return iou
+
+
+def paired_iou(boxes_a, boxes_b):
+    """
+    IoU of each box with the box at the same position of the other array (same arithmetic as iou_matrix).
+
+    Args:
+        boxes_a, boxes_b (array-like): (P, 4) xyxy boxes.
+
+    Returns:
+        np.ndarray: (P,) float64 IoUs.
+    """
+    a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+
+    intersection = (np.maximum(0, np.minimum(a[:, 2], b[:, 2]) - np.maximum(a[:, 0], b[:, 0]))
+                    * np.maximum(0, np.minimum(a[:, 3], b[:, 3]) - np.maximum(a[:, 1], b[:, 1])))
+    union = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1]) + (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]) - intersection
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(union == 0, 0.0, intersection / np.where(union == 0, 1.0, union))
+
+
+def _as_boxes(boxes):
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def _sweep_windows(det, gt):
+    """GT order by x1 and, per detection, the start and length of its candidate window in that order."""
+    order = np.argsort(gt[:, 0], kind='stable')
+    gt_x1 = gt[order, 0]
+    # Padded so float rounding of x1 + width never drops a candidate; the exact check follows
+    max_width = max(0.0, float(np.max(gt[:, 2] - gt[:, 0])))
+    reach = max_width * (1 + 1e-9) + 1e-9
+    lo = np.searchsorted(gt_x1, det[:, 0] - reach, side='left')
+    hi = np.searchsorted(gt_x1, det[:, 2], side='left')
+    return order, lo, np.maximum(hi - lo, 0)
+
+
+def use_index(det_boxes, gt_boxes):
+    """
+    Whether the sweep index pays off for a frame: enough pairs (INDEX_MIN_PAIRS) and
+    candidate windows covering at most MAX_WINDOW_FRACTION of them. Boxes that are
+    large relative to the frame make every window wide and brute force is faster.
+    """
+    det = _as_boxes(det_boxes)
+    gt = _as_boxes(gt_boxes)
+    pairs = len(det) * len(gt)
+    if pairs < INDEX_MIN_PAIRS:
+        return False
+    _, _, counts = _sweep_windows(det, gt)
+    return int(counts.sum()) <= MAX_WINDOW_FRACTION * pairs
+
+
+def candidate_pairs(det_boxes, gt_boxes):
+    """
+    Finds the (detection, GT) pairs whose boxes overlap with positive area, the only
+    pairs with a positive IoU, using a sorted-interval sweep along x.
+
+    GT boxes are sorted by x1; a detection can only overlap GT boxes with
+    x1 < det.x2 and x1 > det.x1 - (widest GT box), a contiguous window of the
+    sorted order. Pairs in the window are then checked exactly on both axes.
+
+    Returns:
+        tuple: (det_idx, gt_idx) int arrays.
+    """
+    det = _as_boxes(det_boxes)
+    gt = _as_boxes(gt_boxes)
+    if not len(det) or not len(gt):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    order, lo, counts = _sweep_windows(det, gt)
+    det_idx = np.repeat(np.arange(len(det)), counts)
+    window_start = np.repeat(lo, counts)
+    offsets = np.arange(int(counts.sum())) - np.repeat(np.cumsum(counts) - counts, counts)
+    gt_idx = order[window_start + offsets]
+
+    d, g = det[det_idx], gt[gt_idx]
+    overlap = (
+        (np.maximum(d[:, 0], g[:, 0]) < np.minimum(d[:, 2], g[:, 2]))
+        & (np.maximum(d[:, 1], g[:, 1]) < np.minimum(d[:, 3], g[:, 3]))
+    )
+    return det_idx[overlap], gt_idx[overlap]
+
+
+def pair_ious(det_boxes, gt_boxes):
+    """
+    IoU of the candidate_pairs only, all positive and bit-identical to iou_matrix.
+
+    Returns:
+        tuple: (det_idx, gt_idx, iou) arrays, sorted by (det_idx, gt_idx).
+    """
+    det = _as_boxes(det_boxes)
+    gt = _as_boxes(gt_boxes)
+    det_idx, gt_idx = candidate_pairs(det, gt)
+    order = np.lexsort((gt_idx, det_idx))
+    det_idx, gt_idx = det_idx[order], gt_idx[order]
+
+    d, g = det[det_idx], gt[gt_idx]
+    intersection = (np.maximum(0, np.minimum(d[:, 2], g[:, 2]) - np.maximum(d[:, 0], g[:, 0]))
+                    * np.maximum(0, np.minimum(d[:, 3], g[:, 3]) - np.maximum(d[:, 1], g[:, 1])))
+    det_area = (d[:, 2] - d[:, 0]) * (d[:, 3] - d[:, 1])
+    gt_area = (g[:, 2] - g[:, 0]) * (g[:, 3] - g[:, 1])
+    # Overlapping boxes have positive areas, so the union is never 0 here
+    union = det_area + gt_area - intersection
+    return det_idx, gt_idx, intersection / union
+
+
+def iou_matrix_indexed(det_boxes, gt_boxes):
+    """
+    iou_matrix filled from pair_ious; every other pair has no positive overlap and is 0.
+    """
+    det_idx, gt_idx, values = pair_ious(det_boxes, gt_boxes)
+    iou = np.zeros((len(_as_boxes(det_boxes)), len(_as_boxes(gt_boxes))), dtype=np.float64)
+    iou[det_idx, gt_idx] = values
+    return iou
+
+
+def _best_pairs(det_idx, gt_idx, pair_iou, n):
+    """Best GT per detection from pairs sorted by (det, gt): the highest IoU, lowest GT index on ties."""
+    best_idx = np.full(n, -1, dtype=np.int64)
+    best_iou = np.zeros(n, dtype=np.float64)
+    order = np.lexsort((gt_idx, -pair_iou, det_idx))
+    first = order[np.r_[True, det_idx[order][1:] != det_idx[order][:-1]]] if len(order) else order
+    best_idx[det_idx[first]] = gt_idx[first]
+    best_iou[det_idx[first]] = pair_iou[first]
+    return best_idx, best_iou
+
+
+def _greedy_pairs(det_idx, gt_idx, pair_iou, n, m):
+    """_greedy_assignment over positive-IoU pairs sorted by (det, gt), the same order on ties."""
+    det_taken = np.zeros(n, dtype=bool)
+    gt_taken = np.zeros(m, dtype=bool)
+    assigned = np.full(n, -1, dtype=np.int64)
+    for p in np.argsort(-pair_iou, kind='stable'):
+        d, g = int(det_idx[p]), int(gt_idx[p])
+        if det_taken[d] or gt_taken[g]:
+            continue
+        det_taken[d] = gt_taken[g] = True
+        assigned[d] = g
+    return assigned
+
+
+def _greedy_assignment(iou):
+    """Assigns pairs in descending IoU order, each detection and GT box used at most once."""
+    n, m = iou.shape
+    det_taken = np.zeros(n, dtype=bool)
+    gt_taken = np.zeros(m, dtype=bool)
+    assigned = np.full(n, -1, dtype=np.int64)
+    # Stable sort keeps the lower (det, gt) index first on ties
+    order = np.argsort(-iou, axis=None, kind='stable')
+    for flat in order:
+        d, g = divmod(int(flat), m)
+        if iou[d, g] <= 0:
+            break
+        if det_taken[d] or gt_taken[g]:
+            continue
+        det_taken[d] = gt_taken[g] = True
+        assigned[d] = g
+    return assigned
+
+
+def _hungarian_assignment(iou):
+    """Assigns pairs maximizing total IoU (scipy linear_sum_assignment)."""
+    from scipy.optimize import linear_sum_assignment
+
+    assigned = np.full(iou.shape[0], -1, dtype=np.int64)
+    rows, cols = linear_sum_assignment(iou, maximize=True)
+    keep = iou[rows, cols] > 0
+    assigned[rows[keep]] = cols[keep]
+    return assigned
+
+
+def match_detections(det_boxes, det_labels, gt_boxes, gt_labels, iou_threshold=0.5, assignment=None,
+                     index='auto', taxonomy=None):
+    """
+    Matches all detections of one image against its GT boxes at once.
+
+    Args:
+        det_boxes (array-like): (N, 4) xyxy detection boxes.
+        det_labels (list): N detection label names.
+        gt_boxes (array-like): (M, 4) xyxy GT boxes.
+        gt_labels (list): M GT class names.
+        iou_threshold (float): Minimum IoU required to consider a match valid.
+        assignment (str or None): None keeps the best GT per detection (same as compare_to_gt),
+                                  'greedy' or 'hungarian' enforce one-to-one matching.
+        index (str or bool): True to score only overlapping pairs (iou_matrix_indexed), False for
+                             every pair (iou_matrix), 'auto' to decide per frame (use_index).
+                             Both give the same result.
+        taxonomy (Taxonomy): Accepts different but equivalent or compatible labels (see taxonomy.py);
+                             None requires identical labels.
+
+    Returns:
+        dict: 'gt_index' (N,) int array (-1 when unmatched), 'iou' (N,) best IoU,
+              'class_match' (N,) bool array, 'resolved' (N,) bool array (matched only through
+              the taxonomy) and 'flag_reason' list (None when valid).
+    """
+    if assignment not in ASSIGNMENT_MODES:
+        raise ValueError(f"Unknown assignment mode: {assignment}")
+
+    n, m = len(det_labels), len(gt_labels)
+    if index == 'auto':
+        index = use_index(det_boxes, gt_boxes)
+
+    if index and assignment != 'hungarian':
+        # Sparse path: only overlapping pairs are scored, sorted and assigned
+        det_idx, gt_idx, pair_iou = pair_ious(det_boxes, gt_boxes)
+        best_idx, best_iou = _best_pairs(det_idx, gt_idx, pair_iou, n)
+        row_max = best_iou
+        if assignment == 'greedy':
+            best_idx = _greedy_pairs(det_idx, gt_idx, pair_iou, n, m)
+            assigned = best_idx >= 0
+            best_iou = np.zeros(n, dtype=np.float64)
+            lookup = dict(zip(zip(det_idx.tolist(), gt_idx.tolist()), pair_iou.tolist()))
+            best_iou[assigned] = [lookup[(d, int(best_idx[d]))] for d in np.nonzero(assigned)[0].tolist()]
+    else:
+        iou = iou_matrix_indexed(det_boxes, gt_boxes) if index else iou_matrix(det_boxes, gt_boxes)
+        row_max = iou.max(axis=1) if m else np.zeros(n, dtype=np.float64)
+
+        if m == 0:
+            best_idx = np.full(n, -1, dtype=np.int64)
+            best_iou = np.zeros(n, dtype=np.float64)
+        elif assignment is None:
+            # argmax returns the first maximum, like the strict '>' in the compare_to_gt loop
+            best_idx = iou.argmax(axis=1)
+            best_iou = iou[np.arange(n), best_idx]
+            # Non-positive IoUs never beat the loop's starting best of 0
+            best_idx = np.where(best_iou > 0, best_idx, -1)
+            best_iou = np.where(best_iou > 0, best_iou, 0.0)
+        else:
+            if assignment == 'greedy':
+                best_idx = _greedy_assignment(iou)
+            else:
+                best_idx = _hungarian_assignment(iou)
+            best_iou = np.where(best_idx >= 0, iou[np.arange(n), np.maximum(best_idx, 0)], 0.0)
+
+    relation = None
+    if taxonomy is not None and n and m:
+        # Ids first: unseen labels extend the relation table
+        det_ids = taxonomy.label_ids(det_labels)
+        gt_ids = taxonomy.label_ids(gt_labels)
+        relation = taxonomy.relations[det_ids, gt_ids[np.maximum(best_idx, 0)]]
+
+    class_match = np.zeros(n, dtype=bool)
+    resolved = np.zeros(n, dtype=bool)
+    flag_reasons = []
+    for i in range(n):
+        g = int(best_idx[i])
+        if best_iou[i] < iou_threshold:
+            if assignment is not None and row_max[i] >= iou_threshold:
+                flag_reasons.append('Duplicate Detection (GT already matched)')
+            else:
+                flag_reasons.append(f'Low IoU with GT ({float(best_iou[i]):.2f})')
+            continue
+        if g >= 0 and gt_labels[g] != det_labels[i]:
+            if relation is None or not relation[i]:
+                flag_reasons.append(f"Class Mismatch (Det: {det_labels[i]}, GT: {gt_labels[g]})")
+                continue
+            resolved[i] = True
+        class_match[i] = g >= 0
+        flag_reasons.append(None)
+
+    return {
+        'gt_index': best_idx,
+        'iou': best_iou,
+        'class_match': class_match,
+        'resolved': resolved,
+        'flag_reason': flag_reasons,
+    }
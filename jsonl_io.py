@@ -0,0 +1,228 @@
+import gzip
+import io
+import json
+import sys
+from pathlib import Path
+
+JSONL_SUFFIXES = ('.jsonl', '.ndjson')
+COMPRESSED_SUFFIXES = ('.gz', '.zst')
+
+
+def _suffixes(path):
+    """Returns (record suffix, compression suffix) of a path, e.g. ('.jsonl', '.gz')."""
+    suffixes = [s.lower() for s in Path(path).suffixes]
+    compression = suffixes[-1] if suffixes and suffixes[-1] in COMPRESSED_SUFFIXES else None
+    rest = suffixes[:-1] if compression else suffixes
+    return (rest[-1] if rest else ''), compression
+
+
+def is_jsonl(path):
+    """True for .jsonl/.ndjson paths, optionally compressed (.jsonl.gz, .jsonl.zst)."""
+    return _suffixes(path)[0] in JSONL_SUFFIXES
+
+
+def open_text(path, mode='r'):
+    """
+    Opens a text file, compressed by suffix: .gz with gzip, .zst with zstandard
+    (optional dependency, only needed for .zst files).
+
+    Args:
+        path (str): File path.
+        mode (str): 'r', 'w' or 'a'.
+    """
+    compression = _suffixes(path)[1]
+    if compression == '.gz':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if compression == '.zst':
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(f"Reading or writing {path} needs the 'zstandard' package (pip install zstandard)")
+        if mode == 'r':
+            return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True),
+                                    encoding='utf-8')
+        # Appending writes a new zstd frame, which readers decode as one stream
+        raw = zstandard.ZstdCompressor().stream_writer(open(path, mode + 'b'), closefd=True)
+        return io.TextIOWrapper(raw, encoding='utf-8', write_through=True)
+    return open(path, mode, encoding='utf-8')
+
+
+class JsonlWriter:
+    """
+    Append-only JSONL writer: one compact JSON record per line.
+
+    Every record is flushed as it is written (flush_every=1), so a crashed run
+    keeps everything written so far and readers can follow the file while it
+    grows. Compressed files flush a compressor block per flush, so raise
+    flush_every for better ratios when durability per record is not needed.
+
+    Args:
+        path (str): Output path (.jsonl, .jsonl.gz or .jsonl.zst).
+        append (bool): Append to an existing file instead of truncating it.
+        flush_every (int): Records between flushes.
+    """
+
+    def __init__(self, path, append=False, flush_every=1):
+        self.path = path
+        self.count = 0
+        self.flush_every = max(1, flush_every)
+        self._file = open_text(path, 'a' if append else 'w')
+
+    def write(self, record):
+        self._file.write(json.dumps(record) + '\n')
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self._file.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class JsonArrayTap:
+    """
+    Writes items to a JSON array file as they pass, so the file stays readable
+    by json.load (e.g. to_audit.json for run_vlm_audit) without holding the list.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = open_text(path, 'w')
+        self._file.write('[')
+
+    def write(self, item):
+        self._file.write(',\n' if self.count else '\n')
+        self._file.write(json.dumps(item, indent=4))
+        self.count += 1
+
+    def write_many(self, items):
+        for item in items:
+            self.write(item)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.write('\n]' if self.count else ']')
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_record_writer(path, append=False):
+    """Returns a JsonlWriter for JSONL paths and a JsonArrayTap for anything else."""
+    if is_jsonl(path):
+        return JsonlWriter(path, append=append)
+    if append:
+        raise ValueError(f"Cannot append to JSON array file {path}, use a .jsonl path")
+    return JsonArrayTap(path)
+
+
+def iter_jsonl(path):
+    """
+    Yields the records of a JSONL file one at a time (constant memory).
+
+    Blank lines are skipped. A truncated last line, as left by a crash while
+    writing, is reported and dropped; a bad line anywhere else raises.
+    """
+    with open_text(path) as f:
+        pending_error = None
+        for line_number, line in enumerate(f, start=1):
+            if pending_error:
+                raise pending_error
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                if line.endswith('\n'):
+                    raise ValueError(f"{path}:{line_number}: invalid JSON record ({e})") from e
+                pending_error = ValueError(f"{path}:{line_number}: invalid JSON record ({e})")
+        if pending_error:
+            print(f"Warning: dropped truncated last record in {path}")
+
+
+def iter_json_array(path, chunk_size=1 << 16):
+    """
+    Yields the items of a top-level JSON array file one at a time, decoding it
+    in chunks so large pretty-printed reports never need to be loaded whole.
+    """
+    decoder = json.JSONDecoder()
+    with open_text(path) as f:
+        buffer = f.read(chunk_size).lstrip()
+        if not buffer.startswith('['):
+            raise ValueError(f"{path}: expected a JSON array")
+        buffer = buffer[1:]
+        eof = False
+        while True:
+            buffer = buffer.lstrip().lstrip(',').lstrip()
+            if buffer.startswith(']'):
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+                # A number cut at the chunk end (e.g. '2.' of '2.5') decodes early, so the
+                # next delimiter must be in the buffer before the item is taken
+                complete = eof or buffer[end:].lstrip()[:1] in (',', ']')
+            except json.JSONDecodeError:
+                if eof:
+                    raise ValueError(f"{path}: truncated or invalid JSON array")
+                complete = False
+            if not complete:
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer += chunk
+                continue
+            yield item
+            buffer = buffer[end:]
+
+
+def iter_records(path):
+    """Yields the records of a JSONL file or the items of a JSON array file, whichever `path` is."""
+    if is_jsonl(path):
+        return iter_jsonl(path)
+    return iter_json_array(path)
+
+
+class RecordFile:
+    """A JSONL or JSON array file that can be iterated any number of times, reading it lazily each time."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        return iter_records(self.path)
+
+
+def convert_report(src, dst):
+    """
+    Converts a JSON array report (e.g. final_verified_report.json) to JSONL, or back.
+    The format of each side follows its suffix, compression included.
+
+    Returns:
+        int: Records written.
+    """
+    with open_record_writer(dst) as writer:
+        writer.write_many(iter_records(src))
+        return writer.count
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python jsonl_io.py <src.json|.jsonl[.gz|.zst]> <dst.json|.jsonl[.gz|.zst]>")
+        sys.exit(1)
+    count = convert_report(sys.argv[1], sys.argv[2])
+    print(f"Converted {count} records from {sys.argv[1]} to {sys.argv[2]}")
@@ -1,110 +1,527 @@
+import argparse
 import json
+import os
+import subprocess
+import sys
 from pathlib import Path
-from vision_worker import VisionWorker
-from data_filter import filter_detections
-from validator import compare_to_gt
-from visual_report import generate_report_graph, generate_pipeline_story_graph
-from vlm_auditor import run_vlm_audit
+import metrics
+
+# Heavy dependencies (ultralytics/torch, google-genai, matplotlib, polars) are imported
+# inside the stage that needs them, so e.g. `python main.py report` starts in milliseconds.
+
+# Counts of the last run, read back by the report subcommand
+SUMMARY_FILE = "run_summary.json"
+
+# Charts of the report stage (see visual_report.render_report)
+REPORT_DIR = "reports"
+
+def main(limit=10, batch_size=16, processes=1, stream=False, incremental=False, metrics_path="run_metrics",
+         profile_dir=None, report="background", dedup=True, budget=None):
+    """
+    Runs the pipeline with stage timers, counters and peak RSS recorded (see metrics.py).
+
+    Args:
+        limit, batch_size, processes, stream, incremental: As in run_pipeline.
+        metrics_path (str): Prefix of the <metrics_path>.json and .prom files written at the end of
+                            the run, also when it fails.
+        profile_dir (str): Write one cProfile <stage>.prof per stage there (view with snakeviz or pstats).
+        report (str): 'background' renders the report charts in a detached process so the run
+                      does not wait on plotting, 'inline' renders them before returning, 'off' skips them.
+        dedup (bool): Propagate VLM verdicts between near-duplicate frames (see frame_dedup.py),
+                      batch runs only.
+        budget (triage.AuditBudget): VLM calls/tokens of this run, batch runs only. Audit items are
+                                     scheduled by expected value and the rest deferred to the backlog.
+    """
+    run = metrics.start_run(profile_dir=profile_dir)
+    # External samplers attach by pid, e.g. py-spy record --pid <pid>
+    print(f"Pipeline pid {os.getpid()}, metrics to {metrics_path}.json/.prom")
+    try:
+        run_pipeline(limit, batch_size, processes, stream, incremental, dedup, budget)
+    finally:
+        metrics.end_run()
+        print("\n--- Stage Timings ---")
+        print(run.summary())
+        written = run.export(metrics_path)
+        print(f"Metrics saved to {', '.join(str(path) for path in written)}")
+
+    if report == "inline":
+        from visual_report import render_report
+        render_report(REPORT_DIR, metrics_path=f"{metrics_path}.json")
+    elif report == "background":
+        start_background_report(f"{metrics_path}.json")
+
+def start_background_report(metrics_file):
+    """Starts `main.py report` in a detached process, logging to reports/report.log."""
+    Path(REPORT_DIR).mkdir(exist_ok=True)
+    log_path = Path(REPORT_DIR) / "report.log"
+    with open(log_path, 'w') as log:
+        subprocess.Popen([sys.executable, str(Path(__file__).resolve()), "report", "--metrics", metrics_file],
+                         stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    print(f"Rendering the report in the background into {REPORT_DIR}/ (log: {log_path})")
+
+def run_pipeline(limit=10, batch_size=16, processes=1, stream=False, incremental=False, dedup=True, budget=None):
+    from vision_worker import VisionWorker
+    from validator import get_class_names
+    from gt_index import GroundTruthIndex
+    from dataset_catalog import DatasetCatalog
+    from sharded_runner import run_stages, run_sharded
+    from stream_pipeline import run_streaming
+    from run_manifest import RunManifest, run_incremental, model_version
+    from vlm_auditor import run_vlm_audit, open_audit_stream
+    from vlm_cache import VerdictCache
+    from vlm_payload import PayloadBuilder
+    from triage import AuditTriage, AuditBacklog, run_triage, known_verdicts
+    from jsonl_io import JsonlWriter, RecordFile
+    from detection_table import DetectionTable
+    from data_filter import thresholds_version
+    from class_stats import count_verdicts, save_class_stats
+    from taxonomy import avoided_audits
+    from evaluation import Evaluator, pipeline_tiers, save_evaluation, summary_lines, EVALUATION_FILE
 
-def main():
     # Define paths
-    images_path = Path("data/train/images")
-    audit_file = "to_audit.json"
-    human_intervention_file = "human_intervention_required.json"
+    # JSONL outputs are appended and flushed per record (see jsonl_io.py)
+    audit_file = "to_audit.jsonl"
+    report_file = "final_report.jsonl"
+    human_intervention_file = "human_intervention_required.jsonl"
+    detections_file = "detections.parquet"
 
-    # Initialize VisionWorker
-    worker = VisionWorker()
+    # One file read instead of a folder walk; only changed images are re-read (see dataset_catalog.py)
+    with metrics.stage('catalog'):
+        catalog = DatasetCatalog.for_split("train")
 
-    # 1. Run inference
-    print(f"Processing images in {images_path}...")
-    # Limit to 10 images for testing
-    detections = worker.process_folder(str(images_path), limit=10)
-    
-    # 2. Post-YOLO Validation (Raw Stats)
-    print("Performing initial Raw Validation...")
-    raw_total = len(detections)
-    raw_correct = 0
-    
-    for detection in detections:
-        if compare_to_gt(detection) is None:
-            raw_correct += 1
+    # Limit to 10 images for testing by default, pass limit=None for the whole split
+    images = catalog.paths(limit)
+
+    # Verdicts of incremental runs resume from it
+    manifest = None
+
+    # 1-4. Inference, raw validation, confidence filter and confident validation
+    print(f"Processing {len(images)} images in {catalog.images_dir}...")
+    if stream:
+        # Audits start while inference is still running; to_audit.jsonl is written as a tap
+        with metrics.stage('model_load'):
+            worker = VisionWorker()
+        with metrics.stage('gt_index'):
+            gt_index = GroundTruthIndex.for_split("train", class_names=get_class_names(), catalog=catalog)
+        print("\n--- Streaming inference into VLM Audit ---")
+        audit_stream = open_audit_stream(cache=VerdictCache(catalog=catalog))
+        stage_results = run_streaming(worker, images, gt_index, audit_stream, batch_size=batch_size,
+                                      audit_tap=audit_file)
+    else:
+        def process(paths, on_record=None):
+            if processes > 1:
+                return run_sharded(paths, processes=processes, split="train", batch_size=batch_size,
+                                   on_record=on_record)
+
+            # Initialize VisionWorker
+            with metrics.stage('model_load'):
+                worker = VisionWorker()
+
+            # Load ground truth once for the whole run (cached next to data/data.yaml)
+            with metrics.stage('gt_index'):
+                gt_index = GroundTruthIndex.for_split("train", class_names=get_class_names(), catalog=catalog)
+
+            return run_stages(worker, paths, gt_index, batch_size=batch_size, on_record=on_record)
+
+        if incremental:
+            # Only new or changed images are re-run, verdicts resume from the manifest
+            manifest = RunManifest()
+            # Stored filter outcomes depend on the thresholds too (see threshold_calibration.py)
+            version = f"{model_version('yolov8n.pt')}|thresholds:{thresholds_version()}"
+            stage_results = run_incremental(images, manifest, version, process,
+                                            hashes=catalog.content_hashes(images))
+        else:
+            stage_results = process(images)
 
+    raw_total = stage_results['raw_total']
+    raw_correct = stage_results['raw_correct']
     initial_accuracy = (raw_correct / raw_total * 100) if raw_total > 0 else 0
     print(f"Initial Raw Accuracy: {initial_accuracy:.2f}%")
 
-    # 3. Filter results (Confidence Check)
-    filtered_results = filter_detections(detections)
-    
-    confident_detections = filtered_results["confident_detections"]
-    audit_required = filtered_results["audit_required"]
-
-    # 4. Post-Filter Validation (Confident Stats)
-    print("Validating confident detections against Ground Truth...")
-    filtered_total = len(confident_detections)
-    filtered_correct = 0
-    validated_confident = []
-    
-    for detection in confident_detections:
-        validation_result = compare_to_gt(detection)
-        if validation_result:
-            audit_required.append(validation_result)
-        else:
-            filtered_correct += 1
-            validated_confident.append(detection)
-            
-    confident_detections = validated_confident
+    filtered_total = stage_results['filtered_total']
+    filtered_correct = stage_results['filtered_correct']
     clean_accuracy = (filtered_correct / filtered_total * 100) if filtered_total > 0 else 0
 
-    # Save audit list
-    with open(audit_file, "w") as f:
-        json.dump(audit_required, f, indent=4)
-    
-    # 5. Run VLM Audit
-    print("\n--- Running VLM Audit ---")
-    vlm_results = run_vlm_audit(audit_file)
+    if stream:
+        vlm_results = stage_results['vlm_results']
+        triage_deferred = 0
+        with metrics.stage('write_outputs'), JsonlWriter(report_file) as writer:
+            writer.write_many(vlm_results)
+        # Streamed runs keep no detection list to evaluate; drop the last batch run's numbers
+        Path(EVALUATION_FILE).unlink(missing_ok=True)
+    else:
+        audit_required = stage_results['filter_audit'] + stage_results['validation_audit']
+        cache = VerdictCache(catalog=catalog)
+
+        # Highest expected value first; what the budget leaves waits in the backlog (see triage.py)
+        with metrics.stage('triage'):
+            backlog = AuditBacklog()
+            triage = AuditTriage.for_split("train", catalog=catalog)
+            payload_builder = PayloadBuilder()
+            audit_required, deferred = run_triage(
+                audit_required, triage, budget, backlog, processed_images=images, payload_builder=payload_builder,
+                known=lambda items: known_verdicts(items, cache, manifest, payload_builder=payload_builder),
+                dedup=dedup)
+
+        with metrics.stage('write_outputs'):
+            # Columnar copy of every detection for analytics (see detection_table.py)
+            DetectionTable.from_dicts(stage_results['detections']).write_parquet(detections_file)
+
+            # Save audit list
+            with JsonlWriter(audit_file) as writer:
+                writer.write_many(audit_required)
+
+        # 5. Run VLM Audit
+        print("\n--- Running VLM Audit ---")
+        with metrics.stage('vlm_audit'):
+            run_vlm_audit(audit_file, report_file, cache=cache, manifest=manifest, dedup=dedup)
+        # Read back lazily from the report by each pass below instead of held in memory
+        vlm_results = RecordFile(report_file)
+        backlog.settle(vlm_results)
+        print(backlog.summary())
+        triage_deferred = len(deferred)
+
+        # COCO-style precision/recall and mAP of each tier on the processed images (see evaluation.py)
+        with metrics.stage('evaluation'):
+            evaluation = Evaluator.for_splits(("train",)).evaluate_tiers(pipeline_tiers(stage_results, vlm_results),
+                                                                       images)
+            save_evaluation(evaluation)
+        print("\n--- Evaluation ---")
+        for line in summary_lines(evaluation):
+            print(line)
     
     human_intervention_required = []
-    vlm_passed_list = []
+    vlm_total = 0
+    vlm_passed = 0
+    # Audit items answered with the verdict of a near-duplicate frame (see frame_dedup.py)
+    dedup_propagated = 0
 
     for item in vlm_results:
+        vlm_total += 1
+        dedup_propagated += 'vlm_propagated_from' in item
         vlm_verification = item.get('vlm_verification')
         if vlm_verification not in ["YES", "NO"]:
             item['human_flag_reason'] = 'Uncertain VLM Response'
             human_intervention_required.append(item)
-        else:
-            vlm_passed_list.append(item)
+        elif vlm_verification == 'YES':
+            vlm_passed += 1
 
-    vlm_total = len(vlm_results)
-    vlm_passed = sum(1 for item in vlm_passed_list if item.get('vlm_verification') == 'YES')
     human_total = len(human_intervention_required)
 
+    # Confident detections the label taxonomy matched to their GT box instead of flagging a Class Mismatch
+    taxonomy_avoided, avoided_by_label = avoided_audits(stage_results['class_counts'])
+
+    metrics.count('audits', vlm_total)
+    metrics.count('human_intervention', human_total)
+    metrics.count('taxonomy_avoided', taxonomy_avoided)
+
     # Save human intervention list
-    with open(human_intervention_file, "w") as f:
-        json.dump(human_intervention_required, f, indent=4)
+    with metrics.stage('write_outputs'), JsonlWriter(human_intervention_file) as writer:
+        writer.write_many(human_intervention_required)
 
     # Calculate file statistics
-    total_images = 0
-    if images_path.exists():
-        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
-        # Just counting files here, but we only processed 10
-        total_images = sum(1 for f in images_path.iterdir() if f.suffix.lower() in image_extensions and f.is_file())
+    total_images = len(catalog)
     
     # Print summary
     print("\n--- Processing Summary ---")
     print(f"Total Images in Folder: {total_images}")
-    print(f"Images Processed: {min(10, total_images)}")
+    print(f"Images Processed: {stage_results['images']}")
     print(f"Total Raw Detections: {raw_total}")
     print(f"Correct Raw Detections: {raw_correct}")
     print(f"Total Filtered (Confident) Detections: {filtered_total}")
     print(f"Correct Filtered Detections: {filtered_correct}")
     print(f"VLM Audit Total: {vlm_total}")
+    print(f"VLM Verdicts Propagated from Near-Duplicate Frames: {dedup_propagated}")
+    print(f"VLM Audits Deferred to the Backlog: {triage_deferred}")
     print(f"VLM Audit Passed (YES): {vlm_passed}")
     print(f"Human Intervention Required: {human_total}")
+    print(f"Audits Avoided by Label Taxonomy: {taxonomy_avoided}"
+          + (f" ({', '.join(f'{label}: {n}' for label, n in avoided_by_label.items())})" if avoided_by_label else ""))
     print(f"Clean Data Accuracy: {clean_accuracy:.2f}%")
 
-    # Generate Graphs
-    generate_report_graph(raw_total, raw_correct, filtered_total, filtered_correct, vlm_total, vlm_passed, human_total)
-    generate_pipeline_story_graph()
+    # Stats for the report stage, which renders after the run (see main and visual_report.render_report)
+    with metrics.stage('write_outputs'):
+        summary = {'raw_total': raw_total, 'raw_correct': raw_correct, 'filtered_total': filtered_total,
+                   'filtered_correct': filtered_correct, 'vlm_total': vlm_total, 'vlm_passed': vlm_passed,
+                   'human_total': human_total, 'taxonomy_avoided': taxonomy_avoided,
+                   'dedup_propagated': dedup_propagated, 'triage_deferred': triage_deferred}
+        with open(SUMMARY_FILE, 'w') as f:
+            json.dump(summary, f, indent=4)
+        save_class_stats(count_verdicts(stage_results['class_counts'], vlm_results))
+
+def load_detections(path):
+    """Reads detection dicts from a Parquet DetectionTable or a JSONL/JSON record file."""
+    if Path(path).suffix == '.parquet':
+        from detection_table import DetectionTable
+        return DetectionTable.read_parquet(path).to_dicts()
+    from jsonl_io import iter_records
+    return list(iter_records(path))
+
+def save_records(path, records):
+    """Writes records as Parquet (detections only) or JSONL/JSON by suffix."""
+    if Path(path).suffix == '.parquet':
+        from detection_table import DetectionTable
+        DetectionTable.from_dicts(records).write_parquet(path)
+        return
+    from jsonl_io import open_record_writer
+    with open_record_writer(path) as writer:
+        writer.write_many(records)
+
+def cmd_run(args):
+    from triage import AuditBudget
+
+    main(args.limit or None, args.batch_size, args.processes, args.stream, args.incremental, args.metrics,
+         args.profile_dir, args.report, not args.no_dedup, AuditBudget(args.max_calls, args.max_tokens))
+
+def cmd_infer(args):
+    from vision_worker import VisionWorker
+    from dataset_catalog import list_split_images
+
+    images = list_split_images(args.images, args.limit or None)
+    detections = VisionWorker(args.model).process_images(images, batch_size=args.batch_size)
+    save_records(args.output, detections)
+    print(f"{len(detections)} detections from {len(images)} images saved to {args.output}")
+
+def load_taxonomy(args):
+    """The --taxonomy file, False with --no-taxonomy, None (the default file) otherwise."""
+    if args.no_taxonomy:
+        return False
+    if args.taxonomy:
+        from taxonomy import get_taxonomy
+        return get_taxonomy(args.taxonomy)
+    return None
+
+def cmd_validate(args):
+    from gt_index import GroundTruthIndex
+    from dataset_catalog import DatasetCatalog
+    from validator import validate_detections, get_class_names
+
+    detections = load_detections(args.detections)
+    gt_index = GroundTruthIndex.for_split(args.split, class_names=get_class_names(),
+                                          catalog=DatasetCatalog.for_split(args.split))
+    flagged = [result for result in validate_detections(detections, gt_index, taxonomy=load_taxonomy(args))
+               if result is not None]
+    save_records(args.output, flagged)
+    correct = len(detections) - len(flagged)
+    resolved = sum(1 for detection in detections if 'resolved_label' in detection)
+    accuracy = correct / len(detections) * 100 if detections else 0
+    print(f"{correct} of {len(detections)} detections match the {args.split} ground truth ({accuracy:.2f}%, "
+          f"{resolved} through the label taxonomy), {len(flagged)} flagged saved to {args.output}")
+
+def cmd_filter(args):
+    from data_filter import filter_detections, load_thresholds
+
+    results = filter_detections(load_detections(args.detections), load_thresholds(args.thresholds),
+                                taxonomy=load_taxonomy(args))
+    save_records(args.audit_output, results['audit_required'])
+    save_records(args.confident_output, results['confident_detections'])
+    print(f"{len(results['confident_detections'])} confident detections saved to {args.confident_output}, "
+          f"{len(results['audit_required'])} to audit saved to {args.audit_output}")
+
+def cmd_triage(args):
+    from dataset_catalog import DatasetCatalog
+    from jsonl_io import iter_records
+    from vlm_payload import PayloadBuilder
+    from vlm_cache import VerdictCache
+    from triage import AuditTriage, AuditBacklog, AuditBudget, run_triage, known_verdicts, DEFAULT_BACKLOG_PATH
+
+    catalog = DatasetCatalog.for_split(args.split)
+    triage = AuditTriage.for_split(args.split, catalog=catalog)
+    backlog = AuditBacklog(args.backlog or DEFAULT_BACKLOG_PATH) if not args.no_backlog else None
+    cache, payload_builder = VerdictCache(catalog=catalog), PayloadBuilder()
+    scheduled, _ = run_triage(list(iter_records(args.input)), triage, AuditBudget(args.max_calls, args.max_tokens),
+                              backlog, payload_builder=payload_builder,
+                              known=lambda items: known_verdicts(items, cache, payload_builder=payload_builder),
+                              batch=args.batch, dedup=args.dedup)
+    save_records(args.output, scheduled)
+    print(f"{len(scheduled)} audit items saved to {args.output} in priority order")
+    if backlog is not None:
+        print(backlog.summary())
+
+def cmd_audit(args):
+    from vlm_auditor import run_vlm_audit
+
+    run_vlm_audit(args.input, args.output, concurrency=args.concurrency, rpm=args.rpm,
+                  use_cache=not args.no_cache, crop=not args.no_crop, batch=args.batch, dedup=args.dedup)
+    from jsonl_io import RecordFile
+    from triage import AuditBacklog, DEFAULT_BACKLOG_PATH
+
+    backlog_path = args.backlog or DEFAULT_BACKLOG_PATH
+    if Path(backlog_path).exists() and Path(args.output).exists():
+        AuditBacklog(backlog_path).settle(RecordFile(args.output))
+
+def cmd_aggregate(args):
+    from DataAggregator import data_aggregator
+
+    keys = args.keys[0] if len(args.keys) == 1 else tuple(args.keys)
+    if Path(args.input).suffix == '.parquet':
+        from detection_table import DetectionTable
+        detections = DetectionTable.read_parquet(args.input)
+    else:
+        detections = load_detections(args.input)
+    result = data_aggregator(detections, keys=keys, output_path=args.output, detailed=args.detailed)
+    print(f"{len(result)} groups saved to {args.output}")
+
+def cmd_evaluate(args):
+    from data_filter import load_thresholds
+    from evaluation import Evaluator, file_tiers, save_evaluation, summary_lines
+    from jsonl_io import iter_records
+
+    detections = load_detections(args.detections)
+    audited = list(iter_records(args.report)) if Path(args.report).exists() else []
+    taxonomy = load_taxonomy(args)
+    tiers = file_tiers(detections, audited, load_thresholds(args.thresholds), taxonomy)
+    # Recall counts the GT boxes of the images that have detections, unless --all-images
+    images = None if args.all_images else sorted({d['image_path'] for d in detections if d.get('image_path')})
+    evaluation = Evaluator.for_splits(tuple(args.splits), taxonomy=taxonomy).evaluate_tiers(tiers, images)
+    save_evaluation(evaluation, args.output)
+    for line in summary_lines(evaluation):
+        print(line)
+    print(f"Evaluation saved to {args.output}")
+
+def cmd_serve(args):
+    from service import run_service
+
+    run_service(args.split, args.host, args.port, args.window / 1000, args.max_batch, args.model,
+                not args.no_audit, args.concurrency, args.rpm, args.report, args.metrics)
+
+def cmd_report(args):
+    from visual_report import render_report
+
+    render_report(args.output_dir, args.summary, args.class_stats, args.metrics, per_class=not args.no_per_class,
+                  processes=args.processes, force=args.force, evaluation_path=args.evaluation)
+
+def add_budget_arguments(parser):
+    parser.add_argument('--max-calls', type=int, help="VLM calls for this run; the rest waits in the audit backlog.")
+    parser.add_argument('--max-tokens', type=int, help="Estimated VLM input tokens for this run.")
+
+def add_taxonomy_arguments(parser):
+    parser.add_argument('--taxonomy', help="Label taxonomy file, defaults to data/taxonomy.yaml.")
+    parser.add_argument('--no-taxonomy', action='store_true', help="Only accept identical labels.")
+
+def build_parser():
+    from data_filter import THRESHOLDS_FILE
+    from class_stats import CLASS_STATS_FILE
+
+    parser = argparse.ArgumentParser(description="YOLO + VLM audit pipeline. Without a subcommand, runs `run`.")
+    commands = parser.add_subparsers(dest='command')
+
+    run = commands.add_parser('run', help="Whole pipeline: inference, validation, filter, audit and report.")
+    run.add_argument('--limit', type=int, default=10, help="Images to process, 0 for the whole split.")
+    run.add_argument('--batch-size', type=int, default=16)
+    run.add_argument('--processes', type=int, default=1)
+    run.add_argument('--stream', action='store_true', help="Audit while inference is still running.")
+    run.add_argument('--incremental', action='store_true', help="Only re-run new or changed images.")
+    run.add_argument('--metrics', default='run_metrics', help="Prefix of the metrics .json/.prom files.")
+    run.add_argument('--profile-dir', help="Write a cProfile dump per stage there.")
+    run.add_argument('--report', choices=['background', 'inline', 'off'], default='background',
+                     help="Render the report charts in a detached process (default), before exiting, or not.")
+    run.add_argument('--no-dedup', action='store_true',
+                     help="Audit near-duplicate frames separately instead of propagating verdicts.")
+    add_budget_arguments(run)
+    run.set_defaults(handler=cmd_run)
+
+    infer = commands.add_parser('infer', help="YOLO inference over a folder of images.")
+    infer.add_argument('--images', default='data/train/images')
+    infer.add_argument('--limit', type=int, default=0, help="Images to process, 0 for all.")
+    infer.add_argument('--batch-size', type=int, default=16)
+    infer.add_argument('--model', default='yolov8n.pt')
+    infer.add_argument('--output', default='detections.parquet', help=".parquet, .jsonl or .json")
+    infer.set_defaults(handler=cmd_infer)
+
+    validate = commands.add_parser('validate', help="Check detections against the split's ground truth.")
+    validate.add_argument('detections', nargs='?', default='detections.parquet')
+    validate.add_argument('--split', default='train')
+    validate.add_argument('--output', default='validation_flags.jsonl')
+    add_taxonomy_arguments(validate)
+    validate.set_defaults(handler=cmd_validate)
+
+    filter_ = commands.add_parser('filter', help="Split detections by (per-class) confidence thresholds.")
+    filter_.add_argument('detections', nargs='?', default='detections.parquet')
+    filter_.add_argument('--thresholds', default=THRESHOLDS_FILE)
+    filter_.add_argument('--audit-output', default='to_audit.jsonl')
+    filter_.add_argument('--confident-output', default='confident_detections.jsonl')
+    add_taxonomy_arguments(filter_)
+    filter_.set_defaults(handler=cmd_filter)
+
+    triage = commands.add_parser('triage', help="Order flagged detections by audit value under a VLM budget.")
+    triage.add_argument('input', nargs='?', default='to_audit.jsonl')
+    triage.add_argument('--output', default='to_audit_scheduled.jsonl')
+    triage.add_argument('--split', default='train')
+    triage.add_argument('--backlog', help="Deferred items of earlier runs, defaults to audit_backlog.sqlite.")
+    triage.add_argument('--no-backlog', action='store_true', help="Drop deferred items instead of keeping them.")
+    triage.add_argument('--batch', action='store_true', help="Count costs as for an audit with --batch.")
+    triage.add_argument('--dedup', action='store_true', help="Count costs as for an audit with --dedup.")
+    add_budget_arguments(triage)
+    triage.set_defaults(handler=cmd_triage)
+
+    audit = commands.add_parser('audit', help="VLM audit of flagged detections.")
+    audit.add_argument('input', nargs='?', default='to_audit.jsonl')
+    audit.add_argument('--output', default='final_report.jsonl')
+    audit.add_argument('--concurrency', type=int, default=1)
+    audit.add_argument('--rpm', type=float)
+    audit.add_argument('--batch', action='store_true', help="One request per image for all of its boxes.")
+    audit.add_argument('--no-cache', action='store_true')
+    audit.add_argument('--no-crop', action='store_true', help="Send full frames instead of bbox crops.")
+    audit.add_argument('--dedup', action='store_true',
+                       help="Give items on near-duplicate frames the verdict of a sibling frame's matching box.")
+    audit.add_argument('--backlog', help="Audit backlog to remove the audited items from (see the triage subcommand), "
+                                         "defaults to audit_backlog.sqlite.")
+    audit.set_defaults(handler=cmd_audit)
+
+    evaluate = commands.add_parser('evaluate', help="COCO-style precision/recall and mAP of each pipeline tier.")
+    evaluate.add_argument('detections', nargs='?', default='detections.parquet')
+    evaluate.add_argument('--report', default='final_report.jsonl', help="VLM audit report for the verified tier.")
+    evaluate.add_argument('--thresholds', default=THRESHOLDS_FILE)
+    evaluate.add_argument('--splits', nargs='+', default=['train', 'valid', 'test'])
+    evaluate.add_argument('--all-images', action='store_true',
+                          help="Count the GT boxes of every image in the splits, not only of images with detections.")
+    evaluate.add_argument('--output', default='evaluation.json')
+    add_taxonomy_arguments(evaluate)
+    evaluate.set_defaults(handler=cmd_evaluate)
+
+    aggregate = commands.add_parser('aggregate', help="Per-group detection statistics.")
+    aggregate.add_argument('input', nargs='?', default='detections.parquet')
+    aggregate.add_argument('--keys', nargs='+', default=['image_path'],
+                           help="Group keys, e.g. label, split, flag_kind (see aggregation.py).")
+    aggregate.add_argument('--output', default='aggregated_data.jsonl')
+    aggregate.add_argument('--detailed', action='store_true',
+                           help="Add mean/percentile confidence and flag histograms (different record fields).")
+    aggregate.set_defaults(handler=cmd_aggregate)
+
+    serve = commands.add_parser('serve', help="Resident validation service on localhost, model kept loaded.")
+    serve.add_argument('--split', default='train', help="Ground truth to validate against.")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--window', type=float, default=10.0,
+                       help="Milliseconds to wait for more requests to batch with the first waiting one.")
+    serve.add_argument('--max-batch', type=int, default=16, help="Images per inference batch.")
+    serve.add_argument('--model', default='yolov8n.pt')
+    serve.add_argument('--no-audit', action='store_true', help="Only validate, do not queue VLM audits.")
+    serve.add_argument('--concurrency', type=int, default=8, help="VLM audit requests in flight.")
+    serve.add_argument('--rpm', type=float)
+    serve.add_argument('--report', default='service_report.jsonl', help="Audit verdicts are appended here.")
+    serve.add_argument('--metrics', default='service_metrics', help="Prefix of the metrics .json/.prom files.")
+    serve.set_defaults(handler=cmd_serve)
+
+    report = commands.add_parser('report', help="Render the charts of the last run's stats (changed ones only).")
+    report.add_argument('--output-dir', default=REPORT_DIR)
+    report.add_argument('--summary', default=SUMMARY_FILE)
+    report.add_argument('--class-stats', default=CLASS_STATS_FILE)
+    report.add_argument('--metrics', default='run_metrics.json')
+    report.add_argument('--evaluation', default='evaluation.json', help="Tier metrics for the PR charts.")
+    report.add_argument('--processes', type=int, help="Rendering processes, defaults to one per CPU.")
+    report.add_argument('--no-per-class', action='store_true', help="Skip the per-class detail charts.")
+    report.add_argument('--force', action='store_true', help="Re-render unchanged charts too.")
+    report.set_defaults(handler=cmd_report)
+    return parser
+
+def cli(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        args = parser.parse_args(['run'])
+    args.handler(args)
 
 if __name__ == "__main__":
-    main()
+    cli()
@@ -0,0 +1,291 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+
+# Upper bounds in seconds of the VLM latency histogram buckets (+Inf is implied)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Prefix of every exported Prometheus metric
+METRIC_PREFIX = 'pipeline'
+
+# The run stage()/count()/observe() report to, set by start_run
+_active = None
+
+
+class Histogram:
+    """Fixed-bucket histogram in the Prometheus layout (per-bucket counts, sum, count)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, data):
+        for i, n in enumerate(data['counts']):
+            self.counts[i] += n
+        self.sum += data['sum']
+        self.count += data['count']
+
+    def to_dict(self):
+        return {'buckets': list(self.buckets), 'counts': list(self.counts), 'sum': self.sum, 'count': self.count}
+
+
+class RunMetrics:
+    """
+    Instrumentation of one pipeline run: per-stage wall and CPU time, counters,
+    latency histograms and peak RSS, exported as JSON and Prometheus text.
+
+    Stage times are inclusive and accumulate over every entry, so a stage entered
+    once per image (validation, filter) reports its total for the run. CPU time is
+    process CPU, so it includes threads running alongside the stage.
+
+    Args:
+        profile_dir (str): If set, every stage also runs under cProfile and one
+                           <stage>.prof per stage is written there by export().
+                           Only the outermost profiled stage is active at a time.
+        rss_interval (float): Seconds between background RSS samples, None to only
+                              sample at stage boundaries.
+    """
+
+    def __init__(self, profile_dir=None, rss_interval=0.5):
+        import psutil
+
+        self.profile_dir = Path(profile_dir) if profile_dir else None
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+        self.worker_peak_rss = 0
+        self.peak_rss = 0
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self.duration = None
+        self.cpu = None
+        self._process = psutil.Process()
+        self._lock = threading.Lock()
+        self._profiles = {}
+        self._profiling = False
+        self._stop = threading.Event()
+        self._sampler = None
+        self.sample_rss()
+        if rss_interval:
+            self._sampler = threading.Thread(target=self._sample_loop, args=(rss_interval,), daemon=True)
+            self._sampler.start()
+
+    def _sample_loop(self, interval):
+        while not self._stop.wait(interval):
+            self.sample_rss()
+
+    def sample_rss(self):
+        rss = self._process.memory_info().rss
+        if rss > self.peak_rss:
+            self.peak_rss = rss
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block as `name` (and profiles it when profile_dir is set)."""
+        profile = self._start_profile(name)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            cpu = time.process_time() - cpu_start
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            self.add_stage_time(name, wall, cpu)
+            self.sample_rss()
+
+    def _start_profile(self, name):
+        if self.profile_dir is None:
+            return None
+        with self._lock:
+            if self._profiling:
+                return None
+            profile = self._profiles.setdefault(name, cProfile.Profile())
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler (e.g. an outer tool) is active
+                return None
+            self._profiling = True
+            return profile
+
+    def add_stage_time(self, name, wall, cpu=0.0, calls=1):
+        """Adds time measured elsewhere (e.g. VisionWorker timings) to a stage."""
+        with self._lock:
+            stage = self.stages.setdefault(name, {'wall_s': 0.0, 'cpu_s': 0.0, 'calls': 0})
+            stage['wall_s'] += wall
+            stage['cpu_s'] += cpu
+            stage['calls'] += calls
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def close(self):
+        """Stops RSS sampling and freezes the run duration."""
+        if self.duration is None:
+            self._stop.set()
+            if self._sampler is not None:
+                self._sampler.join()
+            self.sample_rss()
+            self.duration = time.perf_counter() - self._start
+            self.cpu = time.process_time() - self._cpu_start
+
+    def merge(self, data):
+        """
+        Adds a to_dict() snapshot from another process (e.g. a sharded_runner worker).
+        Its peak RSS is kept separately as the largest worker peak.
+        """
+        with self._lock:
+            for name, stage in data['stages'].items():
+                mine = self.stages.setdefault(name, {'wall_s': 0.0, 'cpu_s': 0.0, 'calls': 0})
+                for key in mine:
+                    mine[key] += stage[key]
+            for name, value in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, histogram in data['histograms'].items():
+                self.histograms.setdefault(name, Histogram(histogram['buckets'])).merge(histogram)
+            self.worker_peak_rss = max(self.worker_peak_rss, data['peak_rss_bytes'], data['worker_peak_rss_bytes'])
+
+    def to_dict(self):
+        duration = self.duration if self.duration is not None else time.perf_counter() - self._start
+        cpu = self.cpu if self.cpu is not None else time.process_time() - self._cpu_start
+        with self._lock:
+            return {
+                'started_at': self.started_at,
+                'pid': os.getpid(),
+                'duration_s': duration,
+                'cpu_s': cpu,
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': dict(self.counters),
+                'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                'peak_rss_bytes': self.peak_rss,
+                'worker_peak_rss_bytes': self.worker_peak_rss,
+            }
+
+    def to_prometheus(self):
+        """Renders the metrics in the Prometheus text exposition format."""
+        data = self.to_dict()
+        p = METRIC_PREFIX
+        lines = [f"# TYPE {p}_run_duration_seconds gauge", f"{p}_run_duration_seconds {data['duration_s']:.6f}",
+                 f"# TYPE {p}_run_cpu_seconds gauge", f"{p}_run_cpu_seconds {data['cpu_s']:.6f}",
+                 f"# TYPE {p}_peak_rss_bytes gauge", f"{p}_peak_rss_bytes {data['peak_rss_bytes']}"]
+        if data['worker_peak_rss_bytes']:
+            lines += [f"# TYPE {p}_worker_peak_rss_bytes gauge",
+                      f"{p}_worker_peak_rss_bytes {data['worker_peak_rss_bytes']}"]
+
+        for metric, key in (('stage_wall_seconds_total', 'wall_s'), ('stage_cpu_seconds_total', 'cpu_s'),
+                            ('stage_calls_total', 'calls')):
+            lines.append(f"# TYPE {p}_{metric} counter")
+            for name, stage in sorted(data['stages'].items()):
+                lines.append(f'{p}_{metric}{{stage="{name}"}} {stage[key]:g}')
+
+        for name, value in sorted(data['counters'].items()):
+            lines += [f"# TYPE {p}_{name}_total counter", f"{p}_{name}_total {value}"]
+
+        for name, histogram in sorted(data['histograms'].items()):
+            lines.append(f"# TYPE {p}_{name} histogram")
+            cumulative = 0
+            for bound, n in zip(list(histogram['buckets']) + ['+Inf'], histogram['counts']):
+                cumulative += n
+                lines.append(f'{p}_{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines += [f"{p}_{name}_sum {histogram['sum']:.6f}", f"{p}_{name}_count {histogram['count']}"]
+        return "\n".join(lines) + "\n"
+
+    def export(self, path_prefix='run_metrics'):
+        """
+        Writes <path_prefix>.json and <path_prefix>.prom, plus the cProfile
+        dumps when profiling. Returns the paths written.
+        """
+        json_path = Path(f"{path_prefix}.json")
+        prom_path = Path(f"{path_prefix}.prom")
+        with open(json_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=4)
+        prom_path.write_text(self.to_prometheus())
+        paths = [json_path, prom_path]
+
+        if self.profile_dir is not None:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            for name, profile in self._profiles.items():
+                profile_path = self.profile_dir / f"{name}.prof"
+                profile.dump_stats(profile_path)
+                paths.append(profile_path)
+        return paths
+
+    def summary(self):
+        """One line per stage, slowest first, for the end-of-run printout."""
+        data = self.to_dict()
+        header = f"Run: {data['duration_s']:.2f}s, peak RSS {data['peak_rss_bytes'] / 2 ** 20:.0f} MiB"
+        if data['worker_peak_rss_bytes']:
+            header += f" (largest worker {data['worker_peak_rss_bytes'] / 2 ** 20:.0f} MiB)"
+        lines = [header]
+        for name, stage in sorted(data['stages'].items(), key=lambda item: -item[1]['wall_s']):
+            lines.append(f"  {name:<20} {stage['wall_s']:>9.3f}s wall {stage['cpu_s']:>9.3f}s cpu "
+                         f"{stage['calls']:>8} calls")
+        return "\n".join(lines)
+
+
+def start_run(profile_dir=None, rss_interval=0.5):
+    """Starts a RunMetrics and makes it the one the module-level helpers report to."""
+    global _active
+    _active = RunMetrics(profile_dir, rss_interval)
+    return _active
+
+
+def end_run():
+    """Closes and detaches the active run. Returns it (None if there was none)."""
+    global _active
+    run, _active = _active, None
+    if run is not None:
+        run.close()
+    return run
+
+
+def active_run():
+    return _active
+
+
+def stage(name):
+    """Times a block on the active run; a no-op when no run is active."""
+    return _active.stage(name) if _active is not None else nullcontext()
+
+
+def count(name, n=1):
+    if _active is not None:
+        _active.count(name, n)
+
+
+def observe(name, value):
+    if _active is not None:
+        _active.observe(name, value)
+
+
+def add_stage_time(name, wall, cpu=0.0, calls=1):
+    if _active is not None:
+        _active.add_stage_time(name, wall, cpu, calls)
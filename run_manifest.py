@@ -0,0 +1,159 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from vlm_cache import hash_file
+
+DEFAULT_MANIFEST_PATH = 'run_manifest.sqlite'
+
+
+def model_version(model_path):
+    """Identifies model weights by name and content hash (name only if the file is not local)."""
+    path = Path(model_path)
+    if path.is_file():
+        return f"{path.name}:{hash_file(path)[:16]}"
+    return path.name
+
+
+class RunManifest:
+    """
+    Persistent record of what a pipeline run has already done.
+
+    Per image it stores the content hash, model version and the stage record
+    (detections, validation and filter outcome) from sharded_runner.run_image_stages.
+    Per audit item it stores the VLM verdict as soon as it is known, so a
+    crashed audit resumes from the last committed item.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST_PATH):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "image_path TEXT PRIMARY KEY, content_hash TEXT NOT NULL, size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, model_version TEXT NOT NULL, record TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS audits ("
+            "audit_key TEXT PRIMARY KEY, image_path TEXT NOT NULL, item TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def content_hash(self, image_path):
+        """Hash of an image, reusing the stored hash while its size and mtime are unchanged."""
+        stat = Path(image_path).stat()
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash, size, mtime_ns FROM images WHERE image_path = ?",
+                                     (str(image_path),)).fetchone()
+        if row and row[1] == stat.st_size and row[2] == stat.st_mtime_ns:
+            return row[0]
+        return hash_file(image_path)
+
+    def get_record(self, image_path, content_hash, version):
+        """Returns the stored stage record if the image and model are unchanged, else None."""
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash, model_version, record FROM images WHERE image_path = ?",
+                                     (str(image_path),)).fetchone()
+        if row and row[0] == content_hash and row[1] == version:
+            return json.loads(row[2])
+        return None
+
+    def put_record(self, image_path, content_hash, version, record):
+        stat = Path(image_path).stat()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(image_path), content_hash, stat.st_size, stat.st_mtime_ns, version, json.dumps(record),
+                 time.time()),
+            )
+            self._conn.commit()
+
+    def audit_key(self, item):
+        """Identifies an audit item by its image content, model version, label, bbox and flag."""
+        image_path = str(item.get('image_path'))
+        with self._lock:
+            row = self._conn.execute("SELECT content_hash, model_version FROM images WHERE image_path = ?",
+                                     (image_path,)).fetchone()
+        image_id = f"{row[0]}|{row[1]}" if row else image_path
+        bbox = ','.join(f'{c:.2f}' for c in item.get('bbox') or [])
+        return f"{image_id}|{item.get('label')}|{bbox}|{item.get('flag_reason')}"
+
+    def get_audit(self, item):
+        """Returns the stored audited item (with its vlm_* fields) or None."""
+        key = self.audit_key(item)
+        with self._lock:
+            row = self._conn.execute("SELECT item FROM audits WHERE audit_key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_audit(self, item):
+        """Commits one audited item."""
+        key = self.audit_key(item)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO audits VALUES (?, ?, ?, ?)",
+                               (key, str(item.get('image_path')), json.dumps(item), time.time()))
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def run_incremental(images, manifest, version, process_fn, hashes=None):
+    """
+    Runs the detection stages only for images that are new or changed since the last run.
+
+    Args:
+        images (list): Image paths, in run order.
+        manifest (RunManifest): Where per-image records are kept.
+        version (str): Model version (see model_version); a change reprocesses every image.
+        process_fn (callable): Takes a list of image paths and an on_record(image_path, record)
+                               callback and returns run_stages-style results with 'per_image'
+                               records (see sharded_runner.run_stages).
+        hashes (dict): Precomputed {str(path): content hash}, e.g. DatasetCatalog.content_hashes;
+                       missing images are hashed through the manifest.
+
+    Returns:
+        dict: Merged results over all images (see sharded_runner.merge_image_records) plus
+              'reused_images' and 'processed_images' counts.
+    """
+    from sharded_runner import merge_image_records, failed_image_record
+
+    hashes = dict(hashes or {})
+    for path in images:
+        if str(path) not in hashes:
+            hashes[str(path)] = manifest.content_hash(path)
+    records = {}
+    changed = []
+    for path in images:
+        record = manifest.get_record(path, hashes[str(path)], version)
+        if record is None:
+            changed.append(path)
+        else:
+            records[str(path)] = record
+
+    print(f"Manifest: {len(records)} unchanged images reused, {len(changed)} to process.")
+
+    def on_record(path, record):
+        # Committed per image, so a crash keeps everything processed so far
+        manifest.put_record(path, hashes[str(path)], version, record)
+        records[str(path)] = record
+
+    if changed:
+        fresh = process_fn(changed, on_record)
+        for path, record in fresh['per_image'].items():
+            if str(path) not in records:
+                on_record(path, record)
+        # Unreadable images are committed as failed too, so they are only retried once they change
+        failed = [path for path in changed if str(path) not in records]
+        for path in failed:
+            on_record(path, failed_image_record())
+        if failed:
+            print(f"Manifest: {len(failed)} images could not be read, recorded as failed.")
+
+    # Merge in run order so totals and audit order match a full run
+    ordered = {str(path): records[str(path)] for path in images if str(path) in records}
+    merged = merge_image_records(ordered)
+    merged['reused_images'] = len(images) - len(changed)
+    merged['processed_images'] = len(changed)
+    return merged
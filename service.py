@@ -0,0 +1,495 @@
+import asyncio
+import json
+import shutil
+import threading
+import time
+import uuid
+from http import HTTPStatus
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+import metrics
+from sharded_runner import run_image_stages
+from vision_worker import IMAGE_EXTENSIONS
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Requests arriving within this many seconds of the first waiting one share an inference batch
+BATCH_WINDOW_S = 0.01
+
+# Images per inference batch; a batch closes early once it has this many
+MAX_BATCH_IMAGES = 16
+
+# Uploaded images are kept here (one folder per upload, original file name) for their audits
+UPLOAD_DIR = 'service_uploads'
+
+# Most recent uploads kept on disk; older ones are deleted once their request and audits are done
+MAX_UPLOADS = 1000
+
+# Done audits kept in memory for /audits/<id>; older verdicts are only in the report file
+MAX_AUDIT_RESULTS = 10000
+
+# Largest accepted request body (an upload or a JSON list of paths)
+MAX_BODY_BYTES = 32 * 1024 * 1024
+
+# Audit verdicts of the service, appended as they come in (see jsonl_io.py)
+REPORT_FILE = 'service_report.jsonl'
+
+# Request latency histogram buckets in seconds, finer than the VLM ones in metrics.py
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class PendingRequest:
+    """Images of one /validate request waiting for a batch, answered through `future`."""
+
+    def __init__(self, paths, audit, future):
+        self.paths = paths
+        self.audit = audit
+        self.future = future
+        self.received = time.perf_counter()
+
+
+class ValidationService:
+    """
+    The validation pipeline kept warm between requests: one loaded model, the split's
+    ground truth and a background VLM audit stream.
+
+    Requests queue image paths. The batcher takes the first waiting request, keeps
+    collecting requests for `window` seconds (or until `max_batch` images), runs them
+    as one inference batch in a worker thread, then GT validation and the confidence
+    filter per image (sharded_runner.run_image_stages), and answers each request with
+    its images' results. While a batch runs, new requests queue up for the next one,
+    so batches grow with the load. A batch that fails answers its requests with the
+    error and the batcher moves on. Flagged detections are submitted to the audit
+    stream and audited in the background; verdicts are appended to the report file
+    and can be polled by id while they are among the last `keep_audits`.
+
+    Uploads are written under upload_dir and the newest `max_uploads` are kept.
+    Every upload gets its own folder, and the verdict cache keys an image outside the
+    catalog's images_dir by its own content hash (see DatasetCatalog), so an upload
+    named like a dataset image never reuses that image's verdicts.
+
+    Args:
+        worker (VisionWorker): Loaded model (anything with iter_image_detections).
+        gt_index (GroundTruthIndex): Ground truth of the split.
+        window (float): Seconds to wait for more requests once one is waiting.
+        max_batch (int): Images per inference batch.
+        upload_dir (str): Folder for uploaded images.
+        catalog (DatasetCatalog): Catalog of the split, for the verdict cache's image hashes.
+        max_uploads (int): Uploads kept on disk.
+        keep_audits (int): Done audits kept for polling.
+    """
+
+    def __init__(self, worker, gt_index, window=BATCH_WINDOW_S, max_batch=MAX_BATCH_IMAGES, upload_dir=UPLOAD_DIR,
+                 catalog=None, max_uploads=MAX_UPLOADS, keep_audits=MAX_AUDIT_RESULTS):
+        self.worker = worker
+        self.gt_index = gt_index
+        self.catalog = catalog
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.upload_dir = Path(upload_dir)
+        self.max_uploads = max_uploads
+        self.keep_audits = keep_audits
+        self.audit_stream = None
+        # Upload path -> its unfinished uses (the request, then its queued audits), oldest first;
+        # also updated from the audit thread
+        self._uploads = {}
+        self._uploads_lock = threading.Lock()
+        self.stats = {'requests': 0, 'images': 0, 'batches': 0, 'audits_queued': 0, 'audits_done': 0}
+        self._report = None
+        self._queue = None
+
+    @classmethod
+    def load(cls, split='train', data_dir='data', model_path='yolov8n.pt', **kwargs):
+        """Loads the model and the split's ground truth (kwargs as in the constructor)."""
+        from vision_worker import VisionWorker
+        from validator import get_class_names
+        from gt_index import GroundTruthIndex
+        from dataset_catalog import DatasetCatalog
+
+        with metrics.stage('catalog'):
+            catalog = DatasetCatalog.for_split(split, data_dir)
+        with metrics.stage('model_load'):
+            worker = VisionWorker(model_path)
+        with metrics.stage('gt_index'):
+            gt_index = GroundTruthIndex.for_split(split, data_dir, class_names=get_class_names(), catalog=catalog)
+        return cls(worker, gt_index, catalog=catalog, **kwargs)
+
+    def open_audits(self, report_path=REPORT_FILE, **kwargs):
+        """
+        Starts the background audit; verdicts are appended to report_path.
+
+        Args:
+            report_path (str): JSONL report, appended to across restarts.
+            **kwargs: As in vlm_auditor.open_audit_stream (backend, concurrency, rpm, cache, ...).
+        """
+        from jsonl_io import JsonlWriter
+        from vlm_auditor import open_audit_stream
+
+        self._report = JsonlWriter(report_path, append=True)
+        kwargs.setdefault('keep_results', self.keep_audits)
+        self.audit_stream = open_audit_stream(on_result=self._on_audit, **kwargs)
+
+    def _on_audit(self, position, item):
+        # Runs on the audit stream's thread, the only writer of the report
+        item['audit_id'] = position
+        try:
+            self._report.write(item)
+            self.stats['audits_done'] += 1
+            metrics.count('service_audits')
+        finally:
+            # The upload is released even when the report write fails
+            self._release_upload(item.get('image_path'))
+
+    def close(self):
+        """Waits for the queued audits and closes the report. Returns the audited items."""
+        results = []
+        if self.audit_stream is not None:
+            pending = self.stats['audits_queued'] - self.stats['audits_done']
+            if pending:
+                print(f"Waiting for {pending} queued audits...")
+            results = self.audit_stream.close()
+            self.audit_stream = None
+        if self._report is not None:
+            self._report.close()
+            self._report = None
+        return results
+
+    async def validate(self, paths, audit=True):
+        """
+        Validates images with the next inference batch.
+
+        Returns:
+            dict: 'images' (one result per path, in order), 'batch' (images and requests
+                  in the batch, queue and processing milliseconds) and 'latency_ms'.
+        """
+        request = PendingRequest([str(path) for path in paths], audit, asyncio.get_running_loop().create_future())
+        self.stats['requests'] += 1
+        missing = [path for path in request.paths if not Path(path).is_file()]
+        request.paths = [path for path in request.paths if path not in missing]
+        if request.paths:
+            for path in request.paths:
+                self._hold_upload(path)
+            await self._queue.put(request)
+            response = await request.future
+        else:
+            response = {'images': {}, 'batch': None}
+
+        results = response['images']
+        response['images'] = [results.get(path) or {'image_path': path, 'error': 'Image not found'}
+                              for path in [str(path) for path in paths]]
+        latency = time.perf_counter() - request.received
+        response['latency_ms'] = round(latency * 1000, 2)
+        run = metrics.active_run()
+        if run is not None:
+            run.observe('service_request_seconds', latency, REQUEST_BUCKETS)
+        return response
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            images = len(batch[0].paths)
+            deadline = loop.time() + self.window
+            while images < self.max_batch:
+                # Requests that queued up during the last batch join without waiting
+                if self._queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        request = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    request = self._queue.get_nowait()
+                batch.append(request)
+                images += len(request.paths)
+            try:
+                await self._run_batch(batch)
+            except Exception as e:
+                print(f"Error processing a batch of {images} images: {e}")
+                metrics.count('service_batch_errors')
+                for request in batch:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+            finally:
+                for request in batch:
+                    for path in request.paths:
+                        self._release_upload(path)
+
+    def _process(self, paths):
+        """Inference and per-image stages of one batch (runs in a worker thread)."""
+        records = {}
+        with metrics.stage('service_batch'):
+            for image_path, detections in self.worker.iter_image_detections(
+                    paths, batch_size=min(len(paths), self.max_batch)):
+                records[image_path] = run_image_stages(detections, self.gt_index, image_path)
+        return records
+
+    async def _run_batch(self, batch):
+        start = time.perf_counter()
+        # Two requests for the same image in one batch share its inference and audits
+        paths = list(dict.fromkeys(path for request in batch for path in request.paths))
+        records = await asyncio.to_thread(self._process, paths)
+        process_ms = round((time.perf_counter() - start) * 1000, 2)
+        self.stats['batches'] += 1
+        self.stats['images'] += len(paths)
+        metrics.count('service_batches')
+
+        audited = {path for request in batch if request.audit for path in request.paths}
+        results = {}
+        for path in paths:
+            record = records.get(path)
+            if record is None:
+                results[path] = {'image_path': path, 'error': 'Could not read image'}
+                continue
+            audit_required = record['filter_audit'] + record['validation_audit']
+            audit_ids = []
+            if path in audited and self.audit_stream is not None and audit_required:
+                # Held before submit: a cached verdict can come back before submit returns
+                self._hold_upload(path, len(audit_required))
+                audit_ids = self.audit_stream.submit([dict(item) for item in audit_required])
+                self.stats['audits_queued'] += len(audit_ids)
+            results[path] = {
+                'image_path': path,
+                'detections': record['detections'],
+                'confident_detections': record['confident_detections'],
+                'audit_required': audit_required,
+                'audit_ids': audit_ids,
+                'raw_correct': record['raw_correct'],
+                'filtered_correct': record['filtered_correct'],
+            }
+
+        for request in batch:
+            if request.future.done():
+                continue
+            request.future.set_result({
+                'images': {path: results[path] for path in request.paths},
+                'batch': {'images': len(paths), 'requests': len(batch),
+                          'queue_ms': round((start - request.received) * 1000, 2), 'process_ms': process_ms},
+            })
+
+    def audit_status(self, audit_id):
+        """The audited item of an id returned by validate, {'status': 'pending'} until its verdict is in."""
+        if self.audit_stream is None:
+            raise HTTPError(404, f"Unknown audit id {audit_id}")
+        try:
+            item = self.audit_stream.get(audit_id)
+        except KeyError:
+            raise HTTPError(404, f"Unknown audit id {audit_id} (older verdicts are in the report file)")
+        if item is None:
+            return {'audit_id': audit_id, 'status': 'pending'}
+        return {'audit_id': audit_id, 'status': 'done', 'item': item}
+
+    def health(self):
+        stats = dict(self.stats, pending_requests=self._queue.qsize() if self._queue else 0,
+                     mean_batch_images=round(self.stats['images'] / self.stats['batches'], 2)
+                     if self.stats['batches'] else None)
+        if self.audit_stream is not None:
+            stats['vlm_calls'] = self.audit_stream.stats['calls']
+        return stats
+
+    def save_upload(self, filename, body):
+        """Writes an uploaded image under its own folder, keeping the file name (GT is matched by stem)."""
+        name = Path(filename or 'upload.jpg').name
+        if Path(name).suffix.lower() not in IMAGE_EXTENSIONS:
+            raise HTTPError(400, f"Unsupported image type: {name}")
+        if not body:
+            raise HTTPError(400, "Empty upload")
+        folder = self.upload_dir / uuid.uuid4().hex
+        folder.mkdir(parents=True)
+        path = folder / name
+        path.write_bytes(body)
+        with self._uploads_lock:
+            self._uploads[str(path)] = 0
+        self._prune_uploads(keep=str(path))
+        return str(path)
+
+    def _hold_upload(self, path, uses=1):
+        with self._uploads_lock:
+            if path in self._uploads:
+                self._uploads[path] += uses
+
+    def _release_upload(self, path):
+        with self._uploads_lock:
+            if path in self._uploads:
+                self._uploads[path] -= 1
+
+    def _load_uploads(self):
+        """Registers the uploads left by earlier runs, oldest first, so they count toward max_uploads."""
+        if not self.upload_dir.is_dir():
+            return
+        paths = sorted((path for path in self.upload_dir.glob('*/*') if path.is_file()),
+                       key=lambda path: path.stat().st_mtime)
+        with self._uploads_lock:
+            for path in paths:
+                self._uploads.setdefault(str(path), 0)
+
+    def _prune_uploads(self, keep=None):
+        """Deletes the oldest uploads beyond max_uploads whose request and audits are done, except `keep`."""
+        with self._uploads_lock:
+            excess = len(self._uploads) - self.max_uploads
+            expired = [path for path, uses in self._uploads.items() if uses <= 0 and path != keep][:max(0, excess)]
+            for path in expired:
+                del self._uploads[path]
+        for path in expired:
+            shutil.rmtree(Path(path).parent, ignore_errors=True)
+
+    async def _route(self, method, target, headers, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == '/validate':
+            if method != 'POST':
+                raise HTTPError(405, "POST image paths as JSON or an image as the body")
+            if headers.get('content-type', '').startswith('application/json'):
+                try:
+                    request = json.loads(body or b'{}')
+                except ValueError as e:
+                    raise HTTPError(400, f"Invalid JSON: {e}")
+                paths = request.get('image_paths') or ([request['image_path']] if request.get('image_path') else [])
+                if not paths or not all(isinstance(path, str) for path in paths):
+                    raise HTTPError(400, "Expected 'image_paths': a list of image paths")
+                audit = bool(request.get('audit', True))
+            else:
+                paths = [self.save_upload(query.get('filename', [None])[0], body)]
+                audit = query.get('audit', ['1'])[0] not in ('0', 'false', 'no')
+            return 200, await self.validate(paths, audit)
+        if url.path.startswith('/audits/') and method == 'GET':
+            try:
+                audit_id = int(url.path.rsplit('/', 1)[1])
+            except ValueError:
+                raise HTTPError(400, "Audit ids are integers")
+            return 200, self.audit_status(audit_id)
+        if url.path == '/health' and method == 'GET':
+            return 200, self.health()
+        if url.path == '/metrics' and method == 'GET':
+            run = metrics.active_run()
+            return 200, run.to_prometheus() if run is not None else ''
+        raise HTTPError(404, f"No route for {method} {url.path}")
+
+    async def _handle_connection(self, reader, writer):
+        """HTTP/1.1 with keep-alive, one request at a time per connection."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_BYTES:
+                    await self._respond(writer, 413, {'error': f"Body over {MAX_BODY_BYTES} bytes"}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                try:
+                    status, payload = await self._route(method, target, headers, body)
+                except HTTPError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except Exception as e:
+                    print(f"Error handling {method} {target}: {e}")
+                    status, payload = 500, {'error': str(e)}
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), 'text/plain; version=0.0.4'
+        else:
+            body, content_type = json.dumps(payload).encode(), 'application/json'
+        writer.write(f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, started=None, stop=None):
+        """
+        Serves HTTP until `stop` (an asyncio.Event) is set, or forever.
+
+        Args:
+            host (str): Bind address; the default only accepts local connections.
+            port (int): Port, 0 for any free one.
+            started (callable): Called with the bound port once the server listens.
+            stop (asyncio.Event): Shuts the server down when set.
+        """
+        self._queue = asyncio.Queue()
+        self._load_uploads()
+        self._prune_uploads()
+        batcher = asyncio.create_task(self._batch_loop())
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        port = server.sockets[0].getsockname()[1]
+        print(f"Validation service on http://{host}:{port} (batch window {self.window * 1000:.0f} ms, "
+              f"up to {self.max_batch} images)")
+        if started:
+            started(port)
+        try:
+            async with server:
+                if stop is None:
+                    await server.serve_forever()
+                else:
+                    await stop.wait()
+        finally:
+            batcher.cancel()
+
+
+def run_service(split='train', host=DEFAULT_HOST, port=DEFAULT_PORT, window=BATCH_WINDOW_S,
+                max_batch=MAX_BATCH_IMAGES, model_path='yolov8n.pt', audit=True, concurrency=8, rpm=None,
+                report_path=REPORT_FILE, metrics_path='service_metrics'):
+    """
+    Loads the service once and serves until interrupted; queued audits are finished on exit.
+
+    Args:
+        split (str): Dataset split whose ground truth requests are validated against.
+        host, port: Bind address.
+        window (float): Batching window in seconds (see ValidationService).
+        max_batch (int): Images per inference batch.
+        model_path (str): YOLO weights.
+        audit (bool): Queue flagged detections for the VLM audit.
+        concurrency (int): Audit requests in flight.
+        rpm (float): VLM requests-per-minute budget, None for unlimited.
+        report_path (str): JSONL file the verdicts are appended to.
+        metrics_path (str): Prefix of the metrics .json/.prom files written on exit.
+    """
+    from vlm_cache import VerdictCache
+
+    run = metrics.start_run()
+    service = ValidationService.load(split, model_path=model_path, window=window, max_batch=max_batch)
+    if audit:
+        service.open_audits(report_path, concurrency=concurrency, rpm=rpm,
+                            cache=VerdictCache(catalog=service.catalog))
+    try:
+        asyncio.run(service.serve(host, port))
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+    finally:
+        service.close()
+        metrics.end_run()
+        print("\n--- Stage Timings ---")
+        print(run.summary())
+        written = run.export(metrics_path)
+        print(f"Metrics saved to {', '.join(str(path) for path in written)}")
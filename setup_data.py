@@ -2,6 +2,7 @@ import os
 from dotenv import load_dotenv
 from roboflow import Roboflow
 from pathlib import Path
+from dataset_catalog import DatasetCatalog
 
 # Load the .env file
 load_dotenv()
@@ -24,13 +25,17 @@ def setup_roboflow():
     # Download the dataset in yolov8 format and extract to 'data' folder
     dataset = version.download("yolov8", location="data")
 
+    # Catalog every split once now, so pipeline runs start from a single file read
+    for split in ('train', 'valid', 'test'):
+        if Path("data", split, "images").exists():
+            print(DatasetCatalog.for_split(split, refresh=True).summary())
+
     # Print the first 5 image file paths in 'data/train/images'
     train_images_path = Path("data/train/images")
 
     if train_images_path.exists():
-        # Get all files in the directory
-        images = [f for f in train_images_path.iterdir() if f.is_file()]
-        
+        images = DatasetCatalog.for_split("train").paths()
+
         print(f"Found {len(images)} images. Listing the first 5:")
         for img in images[:5]:
             print(img)
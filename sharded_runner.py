@@ -0,0 +1,185 @@
+import os
+import metrics
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from data_filter import filter_detections
+from validator import validate_detections, get_class_names
+from gt_index import GroundTruthIndex
+from dataset_catalog import DatasetCatalog
+from class_stats import count_detections, count_audited, count_avoided, merge_counts, gt_labels
+
+COUNTERS = ('images', 'raw_total', 'raw_correct', 'filtered_total', 'filtered_correct')
+LISTS = ('detections', 'filter_audit', 'validation_audit', 'confident_detections')
+
+# Per-process state, set once by _init_worker
+_worker = None
+_gt_index = None
+
+
+def run_image_stages(detections, gt_index, image_path=None):
+    """
+    Runs raw validation, confidence filtering and confident validation on one image's detections.
+
+    Returns:
+        dict: Per-image record with the lists in LISTS, the counters in COUNTERS and
+              'class_counts' (see class_stats.py; GT boxes are only counted with `image_path`).
+    """
+    with metrics.stage('validation'):
+        raw_results = validate_detections(detections, gt_index)
+    raw_correct = sum(1 for result in raw_results if result is None)
+
+    with metrics.stage('filter'):
+        filtered_results = filter_detections(detections)
+    confident_detections = filtered_results["confident_detections"]
+
+    validation_audit = []
+    validated_confident = []
+    with metrics.stage('validation'):
+        confident_results = validate_detections(confident_detections, gt_index)
+    for detection, validation_result in zip(confident_detections, confident_results):
+        if validation_result:
+            validation_audit.append(validation_result)
+        else:
+            validated_confident.append(detection)
+
+    class_counts = count_detections({}, detections, raw_results,
+                                    gt_labels(gt_index, image_path) if image_path else ())
+    count_audited(class_counts, filtered_results["audit_required"] + validation_audit)
+    count_avoided(class_counts, validated_confident)
+
+    return {
+        'detections': detections,
+        'filter_audit': filtered_results["audit_required"],
+        'validation_audit': validation_audit,
+        'confident_detections': validated_confident,
+        'images': 1,
+        'raw_total': len(detections),
+        'raw_correct': raw_correct,
+        'filtered_total': len(confident_detections),
+        'filtered_correct': len(validated_confident),
+        'class_counts': class_counts,
+    }
+
+
+def run_stages(worker, image_paths, gt_index, batch_size=16, on_record=None):
+    """
+    Runs inference, raw validation, confidence filtering and confident validation on a list of images.
+
+    Returns:
+        dict: 'detections', 'filter_audit' (flagged by filter_detections), 'validation_audit'
+              (confident detections failing GT validation), 'confident_detections' (passing),
+              the counters in COUNTERS and 'per_image' (image_path -> record from run_image_stages).
+        on_record (callable): Called with (image_path, record) as soon as each image is done.
+    """
+    per_image = {}
+    for image_path, detections in worker.iter_image_detections(image_paths, batch_size=batch_size):
+        per_image[image_path] = run_image_stages(detections, gt_index, image_path)
+        if on_record:
+            on_record(image_path, per_image[image_path])
+    return merge_image_records(per_image)
+
+
+def merge_image_records(per_image):
+    """
+    Combines per-image records (in dict order) into run totals.
+
+    Lists are concatenated per kind, so the merged audit list is every filter flag
+    followed by every validation flag, the same order a single batch run produces.
+    """
+    merged = {key: [] for key in LISTS}
+    merged.update({key: 0 for key in COUNTERS})
+    merged['class_counts'] = {}
+    for record in per_image.values():
+        for key in LISTS:
+            merged[key].extend(record[key])
+        for key in COUNTERS:
+            merged[key] += record[key]
+        # Records stored by older runs in a RunManifest have no class counts
+        merge_counts(merged['class_counts'], record.get('class_counts', {}))
+    merged['per_image'] = per_image
+    return merged
+
+
+def failed_image_record(error='Could not read image'):
+    """Record of an image inference could not read: it adds nothing to the totals."""
+    record = {key: [] for key in LISTS}
+    record.update({key: 0 for key in COUNTERS})
+    record.update(class_counts={}, error=error)
+    return record
+
+
+def merge_shard_results(shard_results):
+    """Merges run_stages outputs in shard order, identical to a single-process run."""
+    per_image = {}
+    for result in shard_results:
+        per_image.update(result['per_image'])
+    return merge_image_records(per_image)
+
+
+def _init_worker(model_path, split, torch_threads, collect_metrics=False):
+    global _worker, _gt_index
+    import torch
+    from vision_worker import VisionWorker
+
+    # Worker metrics go back to the parent with the shard result (see _run_shard)
+    if collect_metrics:
+        metrics.start_run(rss_interval=None)
+
+    # Keep N processes from each spawning a thread per core
+    torch.set_num_threads(torch_threads)
+    with metrics.stage('model_load'):
+        _worker = VisionWorker(model_path)
+    with metrics.stage('gt_index'):
+        # The parent already refreshed the catalog, workers only read it
+        catalog = DatasetCatalog.for_split(split, refresh=False)
+        _gt_index = GroundTruthIndex.for_split(split, class_names=get_class_names(), catalog=catalog)
+
+
+def _run_shard(image_paths, batch_size):
+    result = run_stages(_worker, image_paths, _gt_index, batch_size)
+    # A worker runs many shards: send what this one recorded and start the next one from zero
+    run = metrics.end_run()
+    if run is not None:
+        result['metrics'] = run.to_dict()
+        metrics.start_run(rss_interval=None)
+    return result
+
+
+def run_sharded(image_paths, processes=None, model_path='yolov8n.pt', split='train', batch_size=16,
+                on_record=None):
+    """
+    Runs run_stages over `processes` worker processes, each loading its own model once.
+
+    Images are handed out in chunks of one inference batch, so on_record(image_path, record)
+    is called in the parent as each batch finishes (in completion order) rather than once
+    per process at the end, and a crash loses at most the batches in flight.
+    Worker stage timings and counters are merged into the active metrics run, if any.
+
+    Returns:
+        dict: Merged results (see merge_shard_results), identical to a single-process run.
+    """
+    image_paths = list(image_paths)
+    processes = max(1, min(processes or os.cpu_count() or 1, len(image_paths)))
+    chunks = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+    if not chunks:
+        return merge_shard_results([])
+
+    # Build (or refresh) the catalog and GT index caches once so workers only load them
+    GroundTruthIndex.for_split(split, class_names=get_class_names(), catalog=DatasetCatalog.for_split(split))
+
+    torch_threads = max(1, (os.cpu_count() or 1) // processes)
+    print(f"Running {len(chunks)} batches on {processes} processes ({torch_threads} torch threads each)...")
+    run = metrics.active_run()
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                             initargs=(model_path, split, torch_threads, run is not None)) as pool:
+        futures = {pool.submit(_run_shard, chunk, batch_size): i for i, chunk in enumerate(chunks)}
+        shard_results = [None] * len(chunks)
+        for future in as_completed(futures):
+            result = future.result()
+            worker_metrics = result.pop('metrics', None)
+            if run is not None and worker_metrics is not None:
+                run.merge(worker_metrics)
+            shard_results[futures[future]] = result
+            if on_record:
+                for image_path, record in result['per_image'].items():
+                    on_record(image_path, record)
+    return merge_shard_results(shard_results)
@@ -0,0 +1,96 @@
+import metrics
+from data_filter import filter_detections
+from validator import validate_detections
+from jsonl_io import open_record_writer
+from class_stats import count_detections, count_audited, count_avoided, gt_labels
+
+
+def new_counters():
+    return {'images': 0, 'raw_total': 0, 'raw_correct': 0, 'filtered_total': 0, 'filtered_correct': 0,
+            'audit_submitted': 0, 'class_counts': {}}
+
+
+def validate_stream(image_stream, gt_index, counters):
+    """Raw GT validation per image. Yields (image_path, detections) unchanged apart from flag_reason."""
+    for image_path, detections in image_stream:
+        counters['images'] += 1
+        counters['raw_total'] += len(detections)
+        with metrics.stage('validation'):
+            raw_results = validate_detections(detections, gt_index)
+        counters['raw_correct'] += sum(1 for result in raw_results if result is None)
+        count_detections(counters['class_counts'], detections, raw_results, gt_labels(gt_index, image_path))
+        yield image_path, detections
+
+
+def filter_stream(image_stream, counters):
+    """Confidence filter per image. Yields (image_path, audit_required, confident_detections)."""
+    for image_path, detections in image_stream:
+        with metrics.stage('filter'):
+            filtered_results = filter_detections(detections)
+        counters['filtered_total'] += len(filtered_results['confident_detections'])
+        yield image_path, filtered_results['audit_required'], filtered_results['confident_detections']
+
+
+def confident_validation_stream(filtered_stream, gt_index, counters):
+    """
+    GT validation of confident detections per image.
+    Yields (image_path, audit_required, validated_confident), failures appended to audit_required.
+    """
+    for image_path, audit_required, confident_detections in filtered_stream:
+        validated_confident = []
+        with metrics.stage('validation'):
+            confident_results = validate_detections(confident_detections, gt_index)
+        for detection, validation_result in zip(confident_detections, confident_results):
+            if validation_result:
+                audit_required.append(validation_result)
+            else:
+                validated_confident.append(detection)
+        counters['filtered_correct'] += len(validated_confident)
+        yield image_path, audit_required, validated_confident
+
+
+def run_streaming(worker, images, gt_index, audit_stream=None, batch_size=16, audit_tap=None):
+    """
+    Streams images through inference, validation, filtering and into the VLM audit.
+
+    Detections are never collected into a full list: each image's flagged items are
+    submitted to `audit_stream` (an audit_engine.AuditStream) as soon as its batch
+    has run, so audits overlap with inference. Audit items are ordered per image,
+    filter flags before validation flags.
+
+    Args:
+        worker (VisionWorker): Loaded model.
+        images (iterable): Image paths.
+        gt_index (GroundTruthIndex): Ground truth for the split.
+        audit_stream (AuditStream): Audit consumer, None to skip the audit.
+        batch_size (int): Inference batch size.
+        audit_tap (str): Optional path to also write the audit queue to, as JSONL for .jsonl
+                         paths (see jsonl_io.py) and as a JSON array otherwise.
+
+    Returns:
+        dict: The counters in new_counters() plus 'vlm_results' (empty without an audit stream).
+    """
+    counters = new_counters()
+    tap = open_record_writer(audit_tap) if audit_tap else None
+
+    stream = worker.iter_image_detections(images, batch_size=batch_size)
+    stream = validate_stream(stream, gt_index, counters)
+    stream = filter_stream(stream, counters)
+    stream = confident_validation_stream(stream, gt_index, counters)
+
+    try:
+        for image_path, audit_required, validated_confident in stream:
+            counters['audit_submitted'] += len(audit_required)
+            count_audited(counters['class_counts'], audit_required)
+            count_avoided(counters['class_counts'], validated_confident)
+            if tap:
+                for item in audit_required:
+                    tap.write(item)
+            if audit_stream is not None:
+                audit_stream.submit(audit_required)
+    finally:
+        if tap:
+            tap.close()
+
+    counters['vlm_results'] = audit_stream.close() if audit_stream is not None else []
+    return counters
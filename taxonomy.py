@@ -0,0 +1,131 @@
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
+
+# Declarative mapping between the detector's and the dataset's label sets, next to data.yaml
+TAXONOMY_FILE = 'data/taxonomy.yaml'
+
+# Relation codes of Taxonomy.relations
+MISMATCH = 0
+EQUIVALENT = 1
+COMPATIBLE = 2
+
+
+class Taxonomy:
+    """
+    Resolves detector labels against dataset labels.
+
+    Two labels are EQUIVALENT when they name the same class after case folding and
+    aliases, COMPATIBLE when one is an ancestor of the other in the hierarchy (a
+    COCO "truck" on a GT "dump truck", or on a GT "vehicle"), else a MISMATCH.
+
+    Labels are compiled to integer ids, one per canonical class, and the relation
+    of every id pair is precomputed into `relations`, an (K, K) int8 table. Labels
+    seen for the first time get a new id that only matches itself.
+
+    Args:
+        aliases (dict): {alias: canonical name}.
+        hierarchy (dict): {parent: [children]}; a class may have several parents.
+        case_fold (bool): Ignore case and surrounding whitespace.
+        labels (list): Labels to compile up front, e.g. the dataset's class names.
+    """
+
+    def __init__(self, aliases=None, hierarchy=None, case_fold=True, labels=()):
+        self.case_fold = case_fold
+        self.aliases = {self._fold(alias): self._fold(name) for alias, name in (aliases or {}).items()}
+        self.parents = {}
+        for parent, children in (hierarchy or {}).items():
+            for child in children:
+                self.parents.setdefault(self._canonical(child), set()).add(self._canonical(parent))
+
+        self.names = []
+        self._ids = {}
+        self._label_ids = {}
+        self.relations = np.zeros((0, 0), dtype=np.int8)
+        known = set(self.aliases.values()) | set(self.parents)
+        known.update(parent for parents in self.parents.values() for parent in parents)
+        self._add(sorted(known))
+        self.label_ids(labels)
+
+    @classmethod
+    def load(cls, path=TAXONOMY_FILE, labels=()):
+        """Reads a taxonomy file. Without one, labels only match when they are identical."""
+        import yaml
+
+        path = Path(path)
+        if not path.exists():
+            return cls(case_fold=False, labels=labels)
+        with open(path, 'r') as f:
+            data = yaml.safe_load(f) or {}
+        return cls(data.get('aliases'), data.get('hierarchy'), data.get('case_fold', True), labels)
+
+    def _fold(self, label):
+        label = str(label)
+        return label.strip().casefold() if self.case_fold else label
+
+    def _canonical(self, label):
+        folded = self._fold(label)
+        return self.aliases.get(folded, folded)
+
+    def _ancestors(self, name):
+        seen, stack = set(), list(self.parents.get(name, ()))
+        while stack:
+            parent = stack.pop()
+            if parent not in seen:
+                seen.add(parent)
+                stack.extend(self.parents.get(parent, ()))
+        return seen
+
+    def _add(self, names):
+        """Appends canonical names and recomputes the relation table."""
+        names = [name for name in names if name not in self._ids]
+        if not names:
+            return
+        for name in names:
+            self._ids[name] = len(self.names)
+            self.names.append(name)
+
+        k = len(self.names)
+        relations = np.zeros((k, k), dtype=np.int8)
+        np.fill_diagonal(relations, EQUIVALENT)
+        for name, i in self._ids.items():
+            for ancestor in self._ancestors(name):
+                j = self._ids.get(ancestor)
+                if j is not None:
+                    relations[i, j] = relations[j, i] = COMPATIBLE
+        self.relations = relations
+
+    def label_id(self, label):
+        label_id = self._label_ids.get(label)
+        if label_id is None:
+            canonical = self._canonical(label)
+            self._add([canonical])
+            label_id = self._label_ids[label] = self._ids[canonical]
+        return label_id
+
+    def label_ids(self, labels):
+        """Integer ids of labels, (N,) int64 array."""
+        return np.fromiter((self.label_id(label) for label in labels), dtype=np.int64, count=len(labels))
+
+    def relation(self, det_label, gt_label):
+        det_id, gt_id = self.label_id(det_label), self.label_id(gt_label)
+        return int(self.relations[det_id, gt_id])
+
+    def resolves(self, det_label, gt_label):
+        """True if two different labels are accepted as a match."""
+        return det_label != gt_label and self.relation(det_label, gt_label) != MISMATCH
+
+
+@lru_cache(maxsize=None)
+def get_taxonomy(path=TAXONOMY_FILE):
+    """The taxonomy file compiled with the dataset's class names, loaded on first use."""
+    from validator import get_class_names
+
+    return Taxonomy.load(path, labels=get_class_names())
+
+
+def avoided_audits(class_counts):
+    """Total and per detector label of the confident detections the taxonomy kept out of the audit."""
+    per_label = {label: row.get('audits_avoided', 0) for label, row in class_counts.items()
+                 if row.get('audits_avoided')}
+    return sum(per_label.values()), dict(sorted(per_label.items(), key=lambda item: -item[1]))
@@ -0,0 +1,161 @@
+import argparse
+import json
+import numpy as np
+from data_filter import CONFIDENCE_THRESHOLD, THRESHOLDS_FILE
+
+# Candidate thresholds: VisionWorker rounds confidences to 2 decimals
+THRESHOLD_GRID = np.round(np.arange(0.0, 1.0001, 0.01), 2)
+
+# Above any confidence: every detection of the class goes to the audit
+NEVER_TRUST = 1.01
+
+
+def sweep_class(confidences, correct, grid=THRESHOLD_GRID):
+    """
+    Evaluates every candidate threshold of one class in one vectorized pass.
+
+    A detection at or above the threshold is trusted; it is audited if it is below
+    the threshold, or trusted but fails GT validation (as in sharded_runner.run_image_stages).
+
+    Args:
+        confidences (np.ndarray): Detection confidences.
+        correct (np.ndarray): True where the detection matched its ground truth.
+        grid (np.ndarray): Candidate thresholds, ascending.
+
+    Returns:
+        dict: Arrays over the grid: 'threshold', 'trusted', 'precision' (NaN when nothing
+              is trusted) and 'audits'.
+    """
+    order = np.argsort(-confidences, kind='stable')
+    sorted_conf = confidences[order]
+    correct_cum = np.concatenate([[0], np.cumsum(correct[order])])
+
+    # Detections with confidence >= t are the first `trusted` of the descending order
+    trusted = np.searchsorted(-sorted_conf, -grid, side='right')
+    trusted_correct = correct_cum[trusted]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        precision = np.where(trusted > 0, trusted_correct / trusted, np.nan)
+    audits = (len(confidences) - trusted) + (trusted - trusted_correct)
+    return {'threshold': grid, 'trusted': trusted, 'precision': precision, 'audits': audits}
+
+
+def pick_threshold(sweep, target_precision):
+    """
+    Lowest threshold whose trusted detections reach the target precision, which also
+    means the fewest audits (audits only grow with the threshold). NEVER_TRUST if none does.
+    """
+    ok = np.nonzero(sweep['precision'] >= target_precision)[0]
+    if not len(ok):
+        return NEVER_TRUST
+    return float(sweep['threshold'][ok[0]])
+
+
+def audits_at(confidences, correct, threshold):
+    trusted = confidences >= threshold
+    return int((~trusted).sum() + (trusted & ~correct).sum())
+
+
+def calibrate_thresholds(detections, correct, target_precision=0.95, min_support=20,
+                         default=CONFIDENCE_THRESHOLD):
+    """
+    Picks a confidence threshold per class that needs the fewest VLM audits while the
+    detections it trusts stay at `target_precision` against ground truth.
+
+    Args:
+        detections (list): Detection dicts ('label', 'confidence').
+        correct (list): Per detection, True if it passed GT validation (validator.validate_detections).
+        target_precision (float): Required precision of trusted detections.
+        min_support (int): Classes with fewer detections keep `default`.
+        default (float): Threshold for classes without enough data, and for unseen classes.
+
+    Returns:
+        tuple: (thresholds dict in the data_filter.load_thresholds format,
+                report: one dict per class with support, threshold, precision and audits
+                at the calibrated and at the default threshold)
+    """
+    by_class = {}
+    for detection, ok in zip(detections, correct):
+        if detection.get('label') is None:
+            continue
+        confs, oks = by_class.setdefault(detection['label'], ([], []))
+        confs.append(float(detection.get('confidence') or 0.0))
+        oks.append(bool(ok))
+
+    classes = {}
+    report = []
+    for label, (confs, oks) in sorted(by_class.items()):
+        confidences = np.asarray(confs, dtype=np.float64)
+        is_correct = np.asarray(oks, dtype=bool)
+        if len(confidences) < min_support:
+            threshold = default
+        else:
+            threshold = pick_threshold(sweep_class(confidences, is_correct), target_precision)
+            classes[label] = threshold
+
+        trusted = confidences >= threshold
+        report.append({
+            'label': label,
+            'support': len(confidences),
+            'threshold': threshold,
+            'precision': float(is_correct[trusted].mean()) if trusted.any() else None,
+            'audits': audits_at(confidences, is_correct, threshold),
+            'audits_default': audits_at(confidences, is_correct, default),
+        })
+
+    thresholds = {'default': default, 'classes': classes}
+    return thresholds, report
+
+
+def save_thresholds(thresholds, path=THRESHOLDS_FILE, **metadata):
+    """Writes thresholds (plus calibration metadata) in the format data_filter.load_thresholds reads."""
+    with open(path, 'w') as f:
+        json.dump({**metadata, **thresholds}, f, indent=4)
+
+
+def print_report(report, default=CONFIDENCE_THRESHOLD):
+    print(f"{'class':<22} {'support':>8} {'threshold':>10} {'precision':>10} {'audits':>8} "
+          f"{f'at {default}':>8}")
+    for row in report:
+        precision = f"{row['precision']:.3f}" if row['precision'] is not None else '-'
+        print(f"{row['label']:<22} {row['support']:>8} {row['threshold']:>10.2f} {precision:>10} "
+              f"{row['audits']:>8} {row['audits_default']:>8}")
+    calibrated = sum(row['audits'] for row in report)
+    baseline = sum(row['audits_default'] for row in report)
+    saved = baseline - calibrated
+    print(f"VLM audits: {calibrated} with calibrated thresholds vs {baseline} at the global {default} "
+          f"({saved:+d} saved, {saved / baseline * 100 if baseline else 0:.1f}%)")
+
+
+def calibrate_from_parquet(detections_path, split='train', target_precision=0.95, min_support=20,
+                           output_path=THRESHOLDS_FILE):
+    """
+    Calibrates from a run's detections.parquet (see main.py and detection_table.py)
+    against the split's ground truth and writes the thresholds file.
+    """
+    from detection_table import DetectionTable
+    from gt_index import GroundTruthIndex
+    from dataset_catalog import DatasetCatalog
+    from validator import validate_detections, get_class_names
+
+    detections = [d for d in DetectionTable.read_parquet(detections_path).to_dicts() if d['label'] is not None]
+    gt_index = GroundTruthIndex.for_split(split, class_names=get_class_names(),
+                                          catalog=DatasetCatalog.for_split(split))
+    correct = [result is None for result in validate_detections(detections, gt_index)]
+
+    thresholds, report = calibrate_thresholds(detections, correct, target_precision, min_support)
+    save_thresholds(thresholds, output_path, target_precision=target_precision, min_support=min_support,
+                    split=split, detections=len(detections))
+    print_report(report, thresholds['default'])
+    print(f"Thresholds saved to {output_path}")
+    return thresholds, report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate per-class confidence thresholds for data_filter.")
+    parser.add_argument('detections', nargs='?', default='detections.parquet')
+    parser.add_argument('--split', default='train')
+    parser.add_argument('--target-precision', type=float, default=0.95)
+    parser.add_argument('--min-support', type=int, default=20)
+    parser.add_argument('--output', default=THRESHOLDS_FILE)
+    args = parser.parse_args()
+    calibrate_from_parquet(args.detections, args.split, args.target_precision, args.min_support, args.output)
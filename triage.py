@@ -0,0 +1,506 @@
+import argparse
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import numpy as np
+import metrics
+from vlm_batching import is_batchable
+
+DEFAULT_BACKLOG_PATH = 'audit_backlog.sqlite'
+
+# Reports of earlier runs whose verdicts give the historical disagreement rates
+HISTORY_FILES = ('final_report.jsonl', 'final_verified_report.json')
+
+# Prior probability that the VLM rejects the detector's label, per flag kind
+REASON_PRIORS = {
+    'Low IoU with GT': 0.6,
+    'Class Mismatch': 0.5,
+    'Duplicate Detection': 0.5,
+    'Missing Ground Truth File': 0.4,
+    'No Objects Found': 0.3,
+    'Low Confidence': 0.3,
+}
+DEFAULT_PRIOR = 0.3
+
+# Weight of the prior, in verdicts, when historical rates are shrunk towards it
+PRIOR_STRENGTH = 10
+
+# Bounds of the class rarity weight (1 for a class with the mean GT box count)
+MIN_RARITY = 0.5
+MAX_RARITY = 3.0
+
+# Priority boost per run an item was already deferred, so nothing waits forever
+AGING_BOOST = 0.1
+
+# Gemini bills an image as 258 tokens, per 768x768 tile when a side exceeds 384 pixels
+IMAGE_TOKENS = 258
+IMAGE_TILE_SIDE = 768
+SMALL_IMAGE_SIDE = 384
+
+# Verdicts of earlier reports (final_verified_report.json uses Pass/Fail)
+REJECTED = ('NO', 'FAIL')
+ACCEPTED = ('YES', 'PASS')
+
+# Set on items by triage and the backlog; stripped before the audit so they stay out of the report
+TRIAGE_FIELDS = ('triage_score', 'deferred_runs')
+
+_LOW_IOU = re.compile(r'Low IoU with GT \(([\d.]+)\)')
+
+
+def flag_kind(flag_reason):
+    """Flag reason without its details, e.g. 'Class Mismatch' (as aggregation's flag_kind)."""
+    return (flag_reason or '').split(' (')[0]
+
+
+def item_key(item):
+    """Identifies an audit item across runs by image, label, bbox and flag."""
+    bbox = ','.join(f'{c:.2f}' for c in item.get('bbox') or [])
+    return f"{item.get('image_path')}|{item.get('label')}|{bbox}|{item.get('flag_reason')}"
+
+
+class DisagreementHistory:
+    """
+    How often the VLM rejected the detector's label in earlier reports, per flag
+    kind and per (flag kind, label). Propagated verdicts (see frame_dedup.py) are
+    not counted.
+    """
+
+    def __init__(self):
+        self.counts = {}
+
+    @classmethod
+    def load(cls, paths=HISTORY_FILES):
+        """Reads the verdicts of the reports that exist (JSONL or a JSON list)."""
+        from jsonl_io import iter_records
+
+        history = cls()
+        for path in paths:
+            if Path(path).exists():
+                try:
+                    history.add(iter_records(path))
+                except ValueError as e:
+                    print(f"Error reading audit history {path}: {e}")
+        return history
+
+    def add(self, items):
+        for item in items:
+            verdict = str(item.get('vlm_verification', '')).upper()
+            if verdict not in REJECTED + ACCEPTED or 'vlm_propagated_from' in item:
+                continue
+            kind = flag_kind(item.get('flag_reason'))
+            for key in (kind, (kind, item.get('label'))):
+                row = self.counts.setdefault(key, [0, 0])
+                row[0] += verdict in REJECTED
+                row[1] += 1
+        return self
+
+    def __len__(self):
+        return sum(total for key, (_, total) in self.counts.items() if isinstance(key, str))
+
+    def rate(self, kind, label):
+        """
+        Rejection rate of a label's items of a flag kind: the per-label rate shrunk towards
+        the kind's rate, which is shrunk towards REASON_PRIORS (PRIOR_STRENGTH verdicts each).
+        """
+        rejected, total = self.counts.get(kind, (0, 0))
+        kind_rate = (rejected + PRIOR_STRENGTH * REASON_PRIORS.get(kind, DEFAULT_PRIOR)) / (total + PRIOR_STRENGTH)
+        rejected, total = self.counts.get((kind, label), (0, 0))
+        return (rejected + PRIOR_STRENGTH * kind_rate) / (total + PRIOR_STRENGTH)
+
+
+class AuditTriage:
+    """
+    Scores audit items by the expected value of their VLM call: the chance it corrects
+    a label, weighted by how rare the class is.
+
+    score = rejection rate x IoU weight x confidence margin weight x rarity x aging
+
+    - rejection rate: DisagreementHistory.rate of the item's flag kind and label.
+    - IoU weight: 1.5 - IoU for 'Low IoU with GT (x)' items (a box far from every
+      GT box is likelier wrong), else 1.
+    - confidence margin weight: 0.5 plus the relative margin below the label's confidence
+      threshold (0.5 to 1.5), 1 for items without a confidence.
+    - rarity: sqrt(mean GT boxes per class / GT boxes of the label's class) in
+      [MIN_RARITY, MAX_RARITY]; 1 for labels without a GT class.
+    - aging: 1 + AGING_BOOST per run the item was already deferred.
+
+    Args:
+        history (DisagreementHistory): Verdicts of earlier runs, none by default.
+        class_counts (dict): {GT class name: boxes in the split}.
+        threshold_for (callable): Confidence threshold of a label (see data_filter.threshold_lookup).
+        taxonomy (Taxonomy): Matches detector labels to GT class names (see taxonomy.py).
+    """
+
+    def __init__(self, history=None, class_counts=None, threshold_for=None, taxonomy=None):
+        self.history = history or DisagreementHistory()
+        self.threshold_for = threshold_for
+        self.taxonomy = taxonomy
+        counts = {label: n for label, n in (class_counts or {}).items() if n > 0}
+        mean = sum(counts.values()) / len(counts) if counts else 0
+        self._rarity = {label: min(MAX_RARITY, max(MIN_RARITY, math.sqrt(mean / n))) for label, n in counts.items()}
+        self._id_rarity = {taxonomy.label_id(label): r for label, r in self._rarity.items()} if taxonomy else {}
+
+    @classmethod
+    def for_split(cls, split='train', data_dir='data', catalog=None, history_paths=HISTORY_FILES, thresholds=None,
+                  taxonomy=None):
+        """Triage with the split's GT class counts, the history reports and the filter's thresholds."""
+        from gt_index import GroundTruthIndex
+        from validator import get_class_names
+        from data_filter import threshold_lookup
+
+        if taxonomy is None:
+            from taxonomy import get_taxonomy
+            taxonomy = get_taxonomy()
+        gt_index = GroundTruthIndex.for_split(split, data_dir, class_names=get_class_names(), catalog=catalog)
+        class_counts = {gt_index.class_name(c): int(n) for c, n in enumerate(gt_index.class_counts())}
+        return cls(DisagreementHistory.load(history_paths), class_counts, threshold_lookup(thresholds, taxonomy),
+                   taxonomy or None)
+
+    def rarity(self, label):
+        if label is None:
+            return 1.0
+        rarity = self._rarity.get(label)
+        if rarity is None and self.taxonomy:
+            rarity = self._id_rarity.get(self.taxonomy.label_id(label))
+        return 1.0 if rarity is None else rarity
+
+    def score(self, item):
+        label = item.get('label')
+        kind = flag_kind(item.get('flag_reason'))
+        score = self.history.rate(kind, label) * self.rarity(label)
+
+        low_iou = _LOW_IOU.match(item.get('flag_reason') or '')
+        if low_iou:
+            score *= 1.5 - min(1.0, float(low_iou.group(1)))
+
+        confidence = item.get('confidence')
+        if label is not None and confidence is not None and self.threshold_for is not None:
+            threshold = self.threshold_for(label)
+            margin = (threshold - confidence) / threshold if threshold > 0 else 0.0
+            score *= 0.5 + min(1.0, max(0.0, margin))
+
+        return score * (1 + AGING_BOOST * item.get('deferred_runs', 0))
+
+    def scores(self, items):
+        return np.fromiter((self.score(item) for item in items), dtype=np.float64, count=len(items))
+
+
+class AuditBudget:
+    """
+    Limits of one audit run. None means unlimited.
+
+    Args:
+        max_calls (int): VLM requests.
+        max_tokens (int): Estimated input tokens over all requests (see estimate_tokens).
+    """
+
+    def __init__(self, max_calls=None, max_tokens=None):
+        self.max_calls = max_calls
+        self.max_tokens = max_tokens
+
+    def __bool__(self):
+        return self.max_calls is not None or self.max_tokens is not None
+
+    def __str__(self):
+        limits = [f"{self.max_calls} calls" if self.max_calls is not None else None,
+                  f"{self.max_tokens} tokens" if self.max_tokens is not None else None]
+        return ', '.join(limit for limit in limits if limit) or 'unlimited'
+
+
+def image_tokens(width, height):
+    if width <= SMALL_IMAGE_SIDE and height <= SMALL_IMAGE_SIDE:
+        return IMAGE_TOKENS
+    return IMAGE_TOKENS * math.ceil(width / IMAGE_TILE_SIDE) * math.ceil(height / IMAGE_TILE_SIDE)
+
+
+def estimate_tokens(item, payload_builder=None):
+    """
+    Input tokens of an item's VLM request: the prompt (about 4 characters per token)
+    plus the image, a bbox crop with a PayloadBuilder, else the full frame.
+    """
+    from vlm_auditor import build_prompt
+
+    bbox = item.get('bbox')
+    cropped = payload_builder is not None and bool(bbox)
+    tokens = len(build_prompt(item.get('label', 'object'), cropped)) // 4
+    if cropped:
+        x1, y1, x2, y2 = bbox
+        width = (x2 - x1) * (1 + 2 * payload_builder.margin)
+        height = (y2 - y1) * (1 + 2 * payload_builder.margin)
+        scale = min(1.0, payload_builder.max_side / max(width, height, 1))
+        return tokens + image_tokens(width * scale, height * scale)
+    return tokens + frame_tokens(item.get('image_path'))
+
+
+def frame_tokens(image_path, max_side=None):
+    """Tokens of a whole frame, downscaled to max_side if set; one tile if it cannot be read."""
+    try:
+        from gt_index import read_image_size
+        width, height = read_image_size(image_path)
+    except Exception:
+        return IMAGE_TOKENS
+    scale = min(1.0, max_side / max(width, height, 1)) if max_side else 1.0
+    return image_tokens(width * scale, height * scale)
+
+
+def estimate_batch_tokens(item, first, payload_builder=None):
+    """
+    Input tokens an item adds to its image's batched request (see vlm_batching.py): the
+    first item of an image brings the prompt and the overlay frame, later ones a prompt line.
+    """
+    from vlm_batching import build_batch_prompt
+
+    line = (len(build_batch_prompt([item])) - len(build_batch_prompt([]))) // 4
+    if not first:
+        return line
+    max_side = payload_builder.overlay_max_side if payload_builder is not None else None
+    return len(build_batch_prompt([item])) // 4 + frame_tokens(item.get('image_path'), max_side)
+
+
+def known_verdicts(items, cache=None, manifest=None, model_name=None, payload_builder=None):
+    """
+    Positions of the items the audit answers without a VLM call: a verdict in the
+    VerdictCache for the model and payload settings, or one committed to the RunManifest.
+    """
+    from vlm_auditor import DEFAULT_MODEL, request_tag
+
+    known = set()
+    for position, item in enumerate(items):
+        if cache is not None and item.get('image_path') and Path(item['image_path']).exists():
+            key = cache.make_key(item['image_path'], item.get('label', 'object'),
+                                 request_tag(item.get('bbox'), payload_builder), model_name or DEFAULT_MODEL)
+            if cache.peek(key) is not None:
+                known.add(position)
+                continue
+        if manifest is not None and manifest.get_audit(item) is not None:
+            known.add(position)
+    return known
+
+
+def schedule(items, scores, budget=None, known=(), payload_builder=None, batch=False, clusters=None):
+    """
+    Picks the items to audit now: highest score first while they fit the budget.
+    Items with a known verdict (see known_verdicts) cost nothing and are always scheduled;
+    an item too expensive for the tokens left is skipped for cheaper ones after it.
+
+    Costs are counted per VLM request, as the audit will send them. With batch, the
+    first scheduled item of an image pays the call and later ones only their prompt
+    line (a batch split across audit chunks can need one more call). With clusters
+    (frame dedup, see frame_dedup.py), an item that will take the verdict of an item
+    scheduled before it on a sibling frame costs nothing.
+
+    Returns:
+        tuple: (scheduled, deferred) item lists, each in priority order, with 'triage_score' set.
+    """
+    budget = budget or AuditBudget()
+    calls = tokens = 0
+    scheduled, deferred = [], []
+    batched_images = set()
+    leaders = {}
+    for position in np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable').tolist():
+        item = items[position]
+        item['triage_score'] = round(float(scores[position]), 4)
+        if not budget:
+            scheduled.append(item)
+            continue
+        if clusters is not None and _follows(item, leaders, clusters):
+            scheduled.append(item)
+            continue
+        if position in known:
+            scheduled.append(item)
+            _add_leader(item, leaders, clusters)
+            continue
+        if batch and is_batchable(item):
+            first = item.get('image_path') not in batched_images
+            request_calls = int(first)
+            cost = estimate_batch_tokens(item, first, payload_builder) if budget.max_tokens is not None else 0
+        else:
+            request_calls = 1
+            cost = estimate_tokens(item, payload_builder) if budget.max_tokens is not None else 0
+        if ((budget.max_calls is None or calls + request_calls <= budget.max_calls)
+                and (budget.max_tokens is None or tokens + cost <= budget.max_tokens)):
+            calls += request_calls
+            tokens += cost
+            scheduled.append(item)
+            if batch and is_batchable(item):
+                batched_images.add(item.get('image_path'))
+            _add_leader(item, leaders, clusters)
+        else:
+            deferred.append(item)
+    return scheduled, deferred
+
+
+def _add_leader(item, leaders, clusters):
+    if clusters is None or item.get('label') is None or not item.get('bbox'):
+        return
+    cluster = clusters.cluster(item.get('image_path', ''))
+    if cluster is not None:
+        leaders.setdefault((cluster, item['label']), []).append(item)
+
+
+def _follows(item, leaders, clusters):
+    """Whether frame dedup will answer the item with a scheduled item's verdict (as frame_dedup.dedup_audit_items)."""
+    from frame_dedup import BOX_IOU, iou_matrix
+
+    if item.get('label') is None or not item.get('bbox'):
+        return False
+    cluster = clusters.cluster(item.get('image_path', ''))
+    if cluster is None:
+        return False
+    others = [leader['bbox'] for leader in leaders.get((cluster, item['label']), ())
+              if leader['image_path'] != item['image_path']]
+    return bool(others) and iou_matrix([item['bbox']], others)[0].max() >= BOX_IOU
+
+
+class AuditBacklog:
+    """
+    Persistent SQLite queue of audit items a budget deferred, for later runs.
+
+    Items are keyed by item_key. An item is removed once a run gives it a verdict
+    (settle), or when its image is gone or was processed again without producing it.
+    """
+
+    def __init__(self, path=DEFAULT_BACKLOG_PATH):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS backlog ("
+            "audit_key TEXT PRIMARY KEY, image_path TEXT NOT NULL, item TEXT NOT NULL, score REAL NOT NULL, "
+            "deferred_runs INTEGER NOT NULL, first_deferred REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def items(self):
+        """Backlog items with 'deferred_runs' set, highest score first."""
+        with self._lock:
+            rows = self._conn.execute("SELECT item, deferred_runs FROM backlog ORDER BY score DESC").fetchall()
+        return [{**json.loads(item), 'deferred_runs': runs} for item, runs in rows]
+
+    def merge(self, items, processed_images=()):
+        """
+        Returns this run's audit items followed by the backlog items still pending.
+
+        An item that is also in the backlog keeps its deferred_runs. Backlog items of
+        missing images, or of processed_images that no longer produce them, are dropped.
+        """
+        fresh = {item_key(item): item for item in items}
+        processed = {str(path) for path in processed_images}
+        pending, stale = [], []
+        for item in self.items():
+            key = item_key(item)
+            if key in fresh:
+                fresh[key]['deferred_runs'] = item['deferred_runs']
+            elif str(item.get('image_path')) in processed or not Path(str(item.get('image_path'))).exists():
+                stale.append(key)
+            else:
+                pending.append(item)
+        if stale:
+            with self._lock:
+                self._conn.executemany("DELETE FROM backlog WHERE audit_key = ?", [(key,) for key in stale])
+                self._conn.commit()
+        return list(items) + pending
+
+    def defer(self, items):
+        """Adds or updates deferred items, counting one more deferred run for each."""
+        now = time.time()
+        rows = []
+        for item in items:
+            runs = item.get('deferred_runs', 0) + 1
+            stored = {key: value for key, value in item.items() if key not in TRIAGE_FIELDS}
+            rows.append((item_key(item), str(item.get('image_path')), json.dumps(stored),
+                         item.get('triage_score', 0.0), runs, now, now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO backlog VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT(audit_key) DO UPDATE SET "
+                "item = excluded.item, score = excluded.score, deferred_runs = excluded.deferred_runs, "
+                "updated_at = excluded.updated_at",
+                rows,
+            )
+            self._conn.commit()
+
+    def settle(self, audited):
+        """Removes the items that got a verdict; errors stay for the next run."""
+        keys = [(item_key(item),) for item in audited
+                if 'vlm_verification' in item and not str(item['vlm_verification']).startswith('ERROR')]
+        with self._lock:
+            self._conn.executemany("DELETE FROM backlog WHERE audit_key = ?", keys)
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM backlog").fetchone()[0]
+
+    def summary(self):
+        with self._lock:
+            count, oldest, runs = self._conn.execute(
+                "SELECT COUNT(*), MIN(first_deferred), MAX(deferred_runs) FROM backlog").fetchone()
+        if not count:
+            return f"Audit backlog {self.path}: empty"
+        age = (time.time() - oldest) / 3600
+        return f"Audit backlog {self.path}: {count} items, oldest deferred {age:.1f}h ago, up to {runs} runs"
+
+    def close(self):
+        self._conn.close()
+
+
+def run_triage(items, triage, budget=None, backlog=None, processed_images=(), known=None, payload_builder=None,
+               batch=False, dedup=False):
+    """
+    Triage stage between the confidence filter and the VLM audit.
+
+    Merges the backlog into this run's audit items, schedules them by score under the
+    budget and defers the rest to the backlog. Scheduled items stay in the backlog until
+    AuditBacklog.settle, so an interrupted audit loses none.
+
+    Args:
+        items (list): This run's audit items.
+        triage (AuditTriage): Item scoring.
+        budget (AuditBudget): Limits of this run, None for unlimited.
+        backlog (AuditBacklog): Deferred items of earlier runs, None to keep nothing.
+        processed_images (list): Images processed this run (see AuditBacklog.merge).
+        known (callable): Takes the items, returns the positions with a known verdict (see known_verdicts).
+        payload_builder (PayloadBuilder): Crop settings of the audit, for token estimates.
+        batch (bool): The audit sends one request per image (see schedule).
+        dedup (bool): The audit propagates verdicts between near-duplicate frames (see schedule).
+
+    Returns:
+        tuple: (scheduled, deferred) item lists in priority order; scheduled items without TRIAGE_FIELDS.
+    """
+    if backlog is not None:
+        items = backlog.merge(items, processed_images)
+    known_positions = known(items) if known is not None and budget else set()
+    clusters = None
+    if dedup and budget:
+        from frame_dedup import FrameClusters
+        clusters = FrameClusters.for_images(item['image_path'] for item in items if item.get('image_path'))
+    scheduled, deferred = schedule(items, triage.scores(items), budget, known_positions, payload_builder, batch,
+                                   clusters)
+    if backlog is not None and deferred:
+        backlog.defer(deferred)
+    metrics.count('triage_deferred', len(deferred))
+
+    from_backlog = sum(1 for item in scheduled if item.get('deferred_runs'))
+    for item in scheduled:
+        for field in TRIAGE_FIELDS:
+            item.pop(field, None)
+    print(f"Triage ({budget or 'unlimited'}): {len(scheduled)} items scheduled ({len(known_positions)} with a known "
+          f"verdict, {from_backlog} deferred before), {len(deferred)} deferred")
+    return scheduled, deferred
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shows the audit backlog, highest priority first.")
+    parser.add_argument('--backlog', default=DEFAULT_BACKLOG_PATH)
+    parser.add_argument('--top', type=int, default=20)
+    args = parser.parse_args()
+
+    backlog = AuditBacklog(args.backlog)
+    print(backlog.summary())
+    for item in backlog.items()[:args.top]:
+        print(f"{item['deferred_runs']:3d}  {item.get('label')!s:16} {item.get('flag_reason')!s:40} "
+              f"{item.get('image_path')}")
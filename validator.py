@@ -1,9 +1,10 @@
-from pathlib import Path
-import yaml
-from PIL import Image
+from functools import lru_cache
+from iou_matcher import match_detections
 
 def load_class_names(yaml_path='data/data.yaml'):
     """Loads class names from the data.yaml file."""
+    import yaml
+
     try:
         with open(yaml_path, 'r') as f:
             data = yaml.safe_load(f)
@@ -12,7 +13,16 @@ def load_class_names(yaml_path='data/data.yaml'):
         print(f"Error loading class names: {e}")
         return []
 
-CLASS_NAMES = load_class_names()
+@lru_cache(maxsize=None)
+def get_class_names(yaml_path='data/data.yaml'):
+    """Class names of data.yaml, read on first use instead of at import."""
+    return load_class_names(yaml_path)
+
+def __getattr__(name):
+    # CLASS_NAMES is kept for existing imports but only read when first accessed
+    if name == 'CLASS_NAMES':
+        return get_class_names()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def calculate_iou(box1, box2):
     """
@@ -58,66 +68,96 @@ def yolo_to_xyxy(x_center, y_center, width, height, img_width, img_height):
 
     return [x1, y1, x2, y2]
 
-def compare_to_gt(detection, labels_dir='data/train/labels', iou_threshold=0.5):
+def _resolve_taxonomy(taxonomy):
+    if taxonomy is None:
+        from taxonomy import get_taxonomy
+        return get_taxonomy()
+    return taxonomy or None
+
+def compare_to_gt(detection, gt_index, iou_threshold=0.5, taxonomy=None):
     """
-    Compares a detection dictionary against the ground truth label file.
+    Compares a detection dictionary against the ground truth for its image.
     
     Args:
         detection (dict): Detection dictionary from YOLO.
-        labels_dir (str): Path to the directory containing label files.
+        gt_index (GroundTruthIndex): Preloaded ground truth for the split (see gt_index.py).
         iou_threshold (float): Minimum IoU required to consider a match valid.
+        taxonomy (Taxonomy): Label taxonomy, defaults to taxonomy.TAXONOMY_FILE; False for identical labels only.
 
     Returns:
         dict or None: Returns the detection dict with 'flag_reason' if it fails validation, else None.
+                      A detection matched through the taxonomy gets the GT label as 'resolved_label'.
     """
-    image_path = Path(detection['image_path'])
-    label_file_path = Path(labels_dir) / image_path.with_suffix('.txt').name
-    
-    if not label_file_path.exists():
-        detection['flag_reason'] = 'Missing Ground Truth File'
-        return detection
-
-    # Get image dimensions
     try:
-        with Image.open(image_path) as img:
-            img_width, img_height = img.size
-    except Exception as e:
+        gt = gt_index.get(detection['image_path'])
+    except ValueError as e:
         detection['flag_reason'] = f'Error reading image dimensions: {e}'
         return detection
 
-    # Read GT labels
-    gt_boxes = []
-    with open(label_file_path, 'r') as f:
-        for line in f:
-            parts = line.strip().split()
-            if len(parts) >= 5:
-                cls_id = int(parts[0])
-                bbox = yolo_to_xyxy(float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4]), img_width, img_height)
-                
-                # Get class name from ID
-                cls_name = CLASS_NAMES[cls_id] if 0 <= cls_id < len(CLASS_NAMES) else str(cls_id)
-                
-                gt_boxes.append({'cls_name': cls_name, 'bbox': bbox})
-
-    # Check for match
-    det_bbox = detection['bbox']
-    det_label = detection['label']
-    
-    best_iou = 0
-    matched_gt = None
+    if gt is None:
+        detection['flag_reason'] = 'Missing Ground Truth File'
+        return detection
 
-    for gt in gt_boxes:
-        iou = calculate_iou(det_bbox, gt['bbox'])
-        if iou > best_iou:
-            best_iou = iou
-            matched_gt = gt
+    gt_cls_ids, gt_bboxes = gt
+    gt_labels = [gt_index.class_name(c) for c in gt_cls_ids.tolist()]
 
-    if best_iou < iou_threshold:
-        detection['flag_reason'] = f'Low IoU with GT ({best_iou:.2f})'
+    match = match_detections([detection['bbox']], [detection['label']], gt_bboxes, gt_labels, iou_threshold,
+                             taxonomy=_resolve_taxonomy(taxonomy))
+    flag_reason = match['flag_reason'][0]
+    if flag_reason:
+        detection['flag_reason'] = flag_reason
         return detection
-    
-    if matched_gt and matched_gt['cls_name'] != det_label:
-        detection['flag_reason'] = f"Class Mismatch (Det: {det_label}, GT: {matched_gt['cls_name']})"
-        return detection
-    
+
+    if match['resolved'][0]:
+        detection['resolved_label'] = gt_labels[int(match['gt_index'][0])]
     return None
+
+def validate_detections(detections, gt_index, iou_threshold=0.5, assignment=None, taxonomy=None):
+    """
+    Validates a list of detections, matching all boxes of an image in one batch.
+
+    Args:
+        detections (list): Detection dictionaries from YOLO (any image order).
+        gt_index (GroundTruthIndex): Preloaded ground truth for the split.
+        iou_threshold (float): Minimum IoU required to consider a match valid.
+        assignment (str or None): One-to-one matching mode, see iou_matcher.match_detections.
+        taxonomy (Taxonomy): Label taxonomy, defaults to taxonomy.TAXONOMY_FILE; False for identical labels only.
+
+    Returns:
+        list: One entry per detection, in input order: the detection dict with
+              'flag_reason' if it fails validation, else None. Detections matched
+              through the taxonomy get the GT label as 'resolved_label'.
+    """
+    taxonomy = _resolve_taxonomy(taxonomy)
+    by_image = {}
+    for i, detection in enumerate(detections):
+        by_image.setdefault(detection['image_path'], []).append(i)
+
+    results = [None] * len(detections)
+    for image_path, positions in by_image.items():
+        try:
+            gt = gt_index.get(image_path)
+        except ValueError as e:
+            gt = e
+
+        if gt is None or isinstance(gt, ValueError):
+            reason = 'Missing Ground Truth File' if gt is None else f'Error reading image dimensions: {gt}'
+            for i in positions:
+                detections[i]['flag_reason'] = reason
+                results[i] = detections[i]
+            continue
+
+        gt_cls_ids, gt_bboxes = gt
+        gt_labels = [gt_index.class_name(c) for c in gt_cls_ids.tolist()]
+        match = match_detections([detections[i]['bbox'] for i in positions],
+                                 [detections[i]['label'] for i in positions],
+                                 gt_bboxes, gt_labels, iou_threshold, assignment, taxonomy=taxonomy)
+        for i, flag_reason, resolved, g in zip(positions, match['flag_reason'], match['resolved'],
+                                               match['gt_index'].tolist()):
+            if flag_reason:
+                detections[i]['flag_reason'] = flag_reason
+                results[i] = detections[i]
+            elif resolved:
+                detections[i]['resolved_label'] = gt_labels[g]
+
+    return results
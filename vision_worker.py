@@ -1,24 +1,96 @@
-from ultralytics import YOLO
+import time
+import metrics
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Dict, Any
 
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
+
+def list_images(folder_path, limit=None):
+    """Lists the images in a folder (directory order), optionally only the first `limit`."""
+    folder = Path(folder_path)
+    images = [f for f in folder.iterdir() if f.suffix.lower() in IMAGE_EXTENSIONS and f.is_file()]
+    if limit:
+        images = images[:limit]
+    return images
+
 class VisionWorker:
-    def __init__(self, model_path='yolov8n.pt'):
+    def __init__(self, model_path='yolov8n.pt', imgsz=640):
+        # ultralytics (and torch) load with the first model, not when list_images is imported
+        from ultralytics import YOLO
+
         self.model = YOLO(model_path)
+        self.imgsz = imgsz
+        self.last_stats = {}
+
+    def _load_image(self, image_path):
+        """Decodes and letterboxes one image (runs in a worker thread)."""
+        import cv2
+        from ultralytics.data.augment import LetterBox
+
+        original = cv2.imread(str(image_path))
+        if original is None:
+            return image_path, None, None
+        # Fixed square letterbox so every image in a batch has the same shape
+        letterboxed = LetterBox(new_shape=(self.imgsz, self.imgsz), auto=False)(image=original)
+        return image_path, original.shape[:2], letterboxed
 
-    def process_folder(self, folder_path: str, limit: int = None) -> List[Dict[str, Any]]:
+    def _prefetch(self, images, workers, depth, stats):
+        """Yields (path, original_shape, letterboxed) in order, decoding up to `depth` images ahead."""
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            image_iter = iter(images)
+            for image_path in image_iter:
+                pending.append(pool.submit(self._load_image, image_path))
+                if len(pending) >= depth:
+                    break
+            while pending:
+                start = time.perf_counter()
+                loaded = pending.popleft().result()
+                waited = time.perf_counter() - start
+                stats['decode_wait_s'] += waited
+                metrics.add_stage_time('decode_wait', waited)
+                next_path = next(image_iter, None)
+                if next_path is not None:
+                    pending.append(pool.submit(self._load_image, next_path))
+                yield loaded
+
+    def _batches(self, loaded, batch_size):
+        batch = []
+        for image_path, shape, letterboxed in loaded:
+            if letterboxed is None:
+                print(f"Could not read image {image_path}, skipping.")
+                continue
+            batch.append((image_path, shape, letterboxed))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def process_folder(self, folder_path: str, limit: int = None, batch_size: int = 16,
+                       workers: int = 4) -> List[Dict[str, Any]]:
+        """
+        Runs batched inference over every image in a folder (see process_images).
+
+        Args:
+            folder_path (str): Folder with images.
+            limit (int): Only process the first `limit` images.
+            batch_size (int): Images per inference batch.
+            workers (int): Decode threads.
+
+        Returns:
+            list: Detection dicts with 'image_path', 'label', 'confidence' and 'bbox'.
+        """
         folder = Path(folder_path)
         if not folder.exists():
             print(f"Folder {folder_path} does not exist.")
             return []
 
-        # Define common image extensions
-        image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.webp'}
-        
-        results_data = []
-        
-        # Find all images
-        images = [f for f in folder.iterdir() if f.suffix.lower() in image_extensions and f.is_file()]
+        # Find all images (from the split catalog for data/<split>/images)
+        from dataset_catalog import list_split_images
+        images = list_split_images(folder)
 
         if not images:
             return []
@@ -28,27 +100,71 @@ class VisionWorker:
             images = images[:limit]
             print(f"Limiting processing to first {limit} images.")
 
-        # Run inference on the list of images.
-        # stream=True returns a generator, which is memory efficient for large folders.
-        results = self.model(images, stream=True)
-
-        for result in results:
-            # result.path contains the path to the image file processed
-            current_path = result.path
-            
-            for box in result.boxes:
-                # Extract data
-                cls_id = int(box.cls[0].item())
-                label = result.names[cls_id]
-                confidence = round(box.conf[0].item(), 2)
-                bbox = box.xyxy[0].tolist()  # [x1, y1, x2, y2]
-
-                detection = {
-                    'image_path': current_path,
-                    'label': label,
-                    'confidence': confidence,
-                    'bbox': bbox
-                }
-                results_data.append(detection)
-                    
+        return self.process_images(images, batch_size=batch_size, workers=workers)
+
+    def process_images(self, images, batch_size: int = 16, workers: int = 4) -> List[Dict[str, Any]]:
+        """
+        Runs batched inference over a list of image paths and returns all detections.
+        """
+        results_data = []
+        for _, detections in self.iter_image_detections(images, batch_size=batch_size, workers=workers):
+            results_data.extend(detections)
         return results_data
+
+    def iter_image_detections(self, images, batch_size: int = 16, workers: int = 4):
+        """
+        Yields (image_path, detections) per image as soon as its batch has run.
+
+        Images are decoded and letterboxed in `workers` threads while the model runs
+        on the previous batch. Timings are stored in self.last_stats once the
+        generator is exhausted.
+        """
+        from ultralytics.utils import ops
+
+        stats = {'images': 0, 'decode_wait_s': 0.0, 'inference_s': 0.0, 'postprocess_s': 0.0}
+        run_start = time.perf_counter()
+
+        loaded = self._prefetch(images, workers, depth=batch_size * 2, stats=stats)
+        for batch in self._batches(loaded, batch_size):
+            start = time.perf_counter()
+            with metrics.stage('inference'):
+                results = self.model.predict([item[2] for item in batch], imgsz=self.imgsz, batch=len(batch),
+                                             verbose=False)
+            stats['inference_s'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            batch_detections = []
+            for (image_path, original_shape, letterboxed), result in zip(batch, results):
+                current_path = str(image_path)
+                image_detections = []
+                # Pull whole arrays off the result once instead of one tiny tensor per box
+                boxes = result.boxes
+                if len(boxes) > 0:
+                    xyxy = ops.scale_boxes(letterboxed.shape[:2], boxes.xyxy.cpu().numpy(), original_shape)
+                    confidences = boxes.conf.cpu().numpy()
+                    cls_ids = boxes.cls.cpu().numpy().astype(int)
+
+                    for bbox, confidence, cls_id in zip(xyxy.tolist(), confidences.tolist(), cls_ids.tolist()):
+                        detection = {
+                            'image_path': current_path,
+                            'label': result.names[cls_id],
+                            'confidence': round(confidence, 2),
+                            'bbox': bbox  # [x1, y1, x2, y2]
+                        }
+                        image_detections.append(detection)
+                batch_detections.append((current_path, image_detections))
+            postprocess_s = time.perf_counter() - start
+            stats['postprocess_s'] += postprocess_s
+            stats['images'] += len(batch)
+            metrics.add_stage_time('postprocess', postprocess_s)
+            metrics.count('images', len(batch))
+            metrics.count('detections', sum(len(detections) for _, detections in batch_detections))
+
+            yield from batch_detections
+
+        stats['total_s'] = time.perf_counter() - run_start
+        stats['images_per_s'] = stats['images'] / stats['total_s'] if stats['total_s'] > 0 else 0
+        self.last_stats = stats
+        print(f"Inference: {stats['images']} images in {stats['total_s']:.2f}s ({stats['images_per_s']:.1f} img/s) - "
+              f"decode wait {stats['decode_wait_s']:.2f}s, inference {stats['inference_s']:.2f}s, "
+              f"postprocess {stats['postprocess_s']:.2f}s")
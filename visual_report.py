@@ -1,13 +1,35 @@
-import matplotlib.pyplot as plt
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
 import numpy as np
 
-def generate_report_graph(raw_total, raw_correct, filtered_total, filtered_correct, vlm_total=0, vlm_passed=0, human_total=0):
-    """
-    Generates a bar chart comparing Raw vs Filtered vs VLM Audited vs Human Intervention.
-    """
+# Bump whenever a chart's drawing code changes so unchanged stats are re-rendered anyway
+REPORT_VERSION = 3
+
+# Content hash of every rendered chart, kept next to the PNGs
+HASHES_FILE = '.report_hashes.json'
+
+def _pyplot():
+    """pyplot on the non-interactive Agg backend: reports render without a display."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def _save(plt, fig, path):
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+def plot_accuracy(summary, path):
+    """Bar chart comparing Raw vs Filtered vs VLM Audited vs Human Intervention."""
+    plt = _pyplot()
     labels = ['Raw', 'Filtered', 'VLM Audit', 'Human Review']
-    total_counts = [raw_total, filtered_total, vlm_total, human_total]
-    correct_counts = [raw_correct, filtered_correct, vlm_passed, 0] # Human review doesn't have 'correct' yet
+    total_counts = [summary['raw_total'], summary['filtered_total'], summary['vlm_total'], summary['human_total']]
+    # Human review doesn't have 'correct' yet
+    correct_counts = [summary['raw_correct'], summary['filtered_correct'], summary['vlm_passed'], 0]
 
     x = range(len(labels))
     width = 0.35
@@ -24,37 +46,257 @@ def generate_report_graph(raw_total, raw_correct, filtered_total, filtered_corre
 
     ax.bar_label(rects1, padding=3)
     ax.bar_label(rects2, padding=3)
+    _save(plt, fig, path)
 
-    fig.tight_layout()
-    plt.savefig('accuracy_report.png')
-    print("Graph saved to accuracy_report.png")
-
-def generate_pipeline_story_graph():
+def plot_pipeline_story(rows, path):
     """
-    Generates a comparison chart for pipeline performance showing Precision and Recall.
-    Uses mock data for demonstration.
-    """
-    groups = ['Raw YOLO', 'Filtered (High Conf)', 'Final (VLM Verified)']
-    precision_scores = [0.1, 0.6, 0.95]
-    recall_scores = [0.8, 0.4, 0.9]
+    Precision, recall and mAP@0.5 of each pipeline tier, from the evaluation (see evaluation.py).
 
+    Args:
+        rows (list): One dict per tier with 'name', 'precision', 'recall', 'map50', 'map'.
+    """
+    plt = _pyplot()
+    groups = [row['name'] for row in rows]
     x = np.arange(len(groups))
-    width = 0.35
+    width = 0.27
 
     fig, ax = plt.subplots(figsize=(10, 6))
-    rects1 = ax.bar(x - width/2, precision_scores, width, label='Precision', color='skyblue')
-    rects2 = ax.bar(x + width/2, recall_scores, width, label='Recall', color='lightgreen')
+    bars = [('precision', 'Precision', 'skyblue'), ('recall', 'Recall', 'lightgreen'), ('map50', 'mAP@0.5', 'plum')]
+    for offset, (key, label, color) in zip((-width, 0, width), bars):
+        rects = ax.bar(x + offset, [row[key] or 0 for row in rows], width, label=label, color=color)
+        ax.bar_label(rects, padding=3, fmt='%.2f')
 
     ax.set_ylabel('Score')
     ax.set_title('Pipeline Evolution: From Raw AI to Verified Insights')
     ax.set_xticks(x)
-    ax.set_xticklabels(groups)
+    ax.set_xticklabels([f"{row['name']}\nmAP@[.5:.95] {_fmt(row['map'])}" for row in rows])
     ax.set_ylim(0, 1.1)  # Set y-axis limit slightly above 1 for better visibility
     ax.legend()
+    _save(plt, fig, path)
+
+def plot_pr_curves(data, path):
+    """Class-averaged interpolated precision/recall curves at IoU 0.5, one line per pipeline tier."""
+    plt = _pyplot()
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for name, curve in data.items():
+        ax.plot(np.linspace(0, 1, len(curve)), curve, label=name)
+    ax.set_xlabel('Recall')
+    ax.set_ylabel('Precision')
+    ax.set_title('Precision/Recall at IoU 0.5 (mean over classes)')
+    ax.set_xlim(0, 1)
+    ax.set_ylim(0, 1.05)
+    ax.legend()
+    _save(plt, fig, path)
 
-    ax.bar_label(rects1, padding=3, fmt='%.2f')
-    ax.bar_label(rects2, padding=3, fmt='%.2f')
+def plot_class_precision_recall(rows, path):
+    """Grouped precision/recall bars per class (rows: class_stats entries with 'label')."""
+    plt = _pyplot()
+    labels = [row['label'] for row in rows]
+    x = np.arange(len(labels))
+    width = 0.4
 
-    fig.tight_layout()
-    plt.savefig('pipeline_story.png')
+    fig, ax = plt.subplots(figsize=(max(10, len(labels) * 0.6), 6))
+    ax.bar(x - width/2, [row['precision'] or 0 for row in rows], width, label='Precision', color='skyblue')
+    ax.bar(x + width/2, [row['recall'] or 0 for row in rows], width, label='Recall', color='lightgreen')
+    ax.set_ylabel('Score')
+    ax.set_title('Raw Detection Precision and Recall per Class')
+    ax.set_xticks(x)
+    ax.set_xticklabels(labels, rotation=45, ha='right')
+    ax.set_ylim(0, 1.1)
+    ax.legend()
+    _save(plt, fig, path)
+
+def plot_class_audit_rate(rows, path):
+    """Share of each class's detections sent to the VLM audit, with the VLM YES rate."""
+    plt = _pyplot()
+    labels = [row['label'] for row in rows]
+    x = np.arange(len(labels))
+    width = 0.4
+
+    fig, ax = plt.subplots(figsize=(max(10, len(labels) * 0.6), 6))
+    ax.bar(x - width/2, [row['audit_rate'] or 0 for row in rows], width, label='Audit rate', color='salmon')
+    ax.bar(x + width/2, [row['vlm_yes_rate'] or 0 for row in rows], width, label='VLM YES rate', color='khaki')
+    ax.set_ylabel('Rate')
+    ax.set_title('VLM Audit Rate per Class')
+    ax.set_xticks(x)
+    ax.set_xticklabels(labels, rotation=45, ha='right')
+    ax.set_ylim(0, 1.1)
+    ax.legend()
+    _save(plt, fig, path)
+
+def plot_class_detail(row, path):
+    """Counts of one class through the pipeline."""
+    plt = _pyplot()
+    names = ['GT boxes', 'Detections', 'Correct', 'Via taxonomy', 'Audited', 'VLM YES', 'VLM NO']
+    # Stats written before the taxonomy have no 'resolved' count
+    values = [row['gt'], row['detections'], row['correct'], row.get('resolved', 0), row['audited'], row['vlm_yes'],
+              row['vlm_no']]
+
+    fig, ax = plt.subplots(figsize=(8, 5))
+    rects = ax.bar(names, values, color='steelblue')
+    ax.bar_label(rects, padding=3)
+    ax.set_ylabel('Count')
+    ax.set_title(f"{row['label']}: precision {_fmt(row['precision'])}, recall {_fmt(row['recall'])}")
+    _save(plt, fig, path)
+
+def plot_stage_timings(stages, path):
+    """Horizontal bars of wall and CPU seconds per stage from a run_metrics.json."""
+    plt = _pyplot()
+    names = sorted(stages, key=lambda name: stages[name]['wall_s'])
+    y = np.arange(len(names))
+
+    fig, ax = plt.subplots(figsize=(10, max(4, len(names) * 0.4)))
+    ax.barh(y + 0.2, [stages[name]['wall_s'] for name in names], 0.4, label='Wall', color='slategray')
+    ax.barh(y - 0.2, [stages[name]['cpu_s'] for name in names], 0.4, label='CPU', color='darkorange')
+    ax.set_yticks(y)
+    ax.set_yticklabels(names)
+    ax.set_xlabel('Seconds')
+    ax.set_title('Pipeline Stage Timings')
+    ax.legend()
+    _save(plt, fig, path)
+
+def _fmt(value):
+    return f"{value:.2f}" if value is not None else '-'
+
+PLOTS = {
+    'accuracy': plot_accuracy,
+    'story': plot_pipeline_story,
+    'pr_curves': plot_pr_curves,
+    'class_precision_recall': plot_class_precision_recall,
+    'class_audit_rate': plot_class_audit_rate,
+    'class_detail': plot_class_detail,
+    'stage_timings': plot_stage_timings,
+}
+
+def generate_report_graph(raw_total, raw_correct, filtered_total, filtered_correct, vlm_total=0, vlm_passed=0, human_total=0):
+    """
+    Generates a bar chart comparing Raw vs Filtered vs VLM Audited vs Human Intervention.
+    """
+    plot_accuracy({'raw_total': raw_total, 'raw_correct': raw_correct, 'filtered_total': filtered_total,
+                   'filtered_correct': filtered_correct, 'vlm_total': vlm_total, 'vlm_passed': vlm_passed,
+                   'human_total': human_total}, 'accuracy_report.png')
+    print("Graph saved to accuracy_report.png")
+
+def generate_pipeline_story_graph(evaluation_path='evaluation.json'):
+    """
+    Generates a comparison chart of the pipeline tiers' precision, recall and mAP@0.5
+    from an evaluation written by main.run_pipeline or `main.py evaluate`.
+    """
+    evaluation = _read_json(evaluation_path)
+    if not evaluation:
+        print(f"No evaluation in {evaluation_path}, run the pipeline or `main.py evaluate` first.")
+        return
+    plot_pipeline_story(story_rows(evaluation), 'pipeline_story.png')
     print("Graph saved to pipeline_story.png")
+
+def story_rows(evaluation):
+    """Overall scores per tier of an evaluation, in pipeline order."""
+    from evaluation import TIERS
+
+    return [{'name': TIERS.get(tier, tier), **{key: result[key] for key in ('precision', 'recall', 'map50', 'map')}}
+            for tier, result in evaluation['tiers'].items()]
+
+def mean_curves(evaluation):
+    """{tier name: precision at each recall point, averaged over the classes with GT boxes}."""
+    from evaluation import TIERS
+
+    curves = {}
+    for tier, result in evaluation['tiers'].items():
+        rows = [row['curve'] for row in result['classes'].values() if row['gt']]
+        if rows:
+            curves[TIERS.get(tier, tier)] = np.round(np.mean(rows, axis=0), 4).tolist()
+    return curves
+
+def _slug(label):
+    return re.sub(r'[^A-Za-z0-9]+', '_', label).strip('_').lower() or 'unnamed'
+
+def build_charts(summary=None, class_stats=None, run_metrics=None, per_class=True, evaluation=None):
+    """
+    Lists the charts a run's stats call for.
+
+    Returns:
+        list: (file stem, PLOTS key, data) per chart. The data is all a chart depends on.
+    """
+    charts = []
+    if summary:
+        charts.append(('accuracy_report', 'accuracy', summary))
+    if evaluation and evaluation.get('tiers'):
+        charts.append(('pipeline_story', 'story', story_rows(evaluation)))
+        charts.append(('pr_curves', 'pr_curves', mean_curves(evaluation)))
+    if class_stats:
+        rows = sorted(({'label': label, **row} for label, row in class_stats.items()),
+                      key=lambda row: (-row['detections'], row['label']))
+        charts.append(('class_precision_recall', 'class_precision_recall', rows))
+        charts.append(('class_audit_rate', 'class_audit_rate', rows))
+        if per_class:
+            charts.extend((f"class_{_slug(row['label'])}", 'class_detail', row) for row in rows)
+    if run_metrics and run_metrics.get('stages'):
+        charts.append(('stage_timings', 'stage_timings', run_metrics['stages']))
+    return charts
+
+def chart_hash(kind, data):
+    encoded = json.dumps({'version': REPORT_VERSION, 'kind': kind, 'data': data}, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+def _render(job):
+    kind, data, path = job
+    PLOTS[kind](data, path)
+    return path
+
+def _read_json(path):
+    if not path or not Path(path).exists():
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def render_report(output_dir='reports', summary_path='run_summary.json', class_stats_path='class_stats.json',
+                  metrics_path='run_metrics.json', per_class=True, processes=None, force=False,
+                  evaluation_path='evaluation.json'):
+    """
+    Renders the report charts from the files a run wrote, as its own stage.
+
+    A chart is only re-rendered when the stats it is drawn from changed (content hash
+    in HASHES_FILE) or its PNG is missing. Outstanding charts are drawn in parallel
+    worker processes when there is more than one of them.
+
+    Args:
+        output_dir (str): Folder for the PNGs.
+        summary_path (str): Run counts (main.SUMMARY_FILE).
+        class_stats_path (str): Per-class counts and rates (class_stats.CLASS_STATS_FILE).
+        metrics_path (str): Stage timings (metrics.RunMetrics.export).
+        evaluation_path (str): AP and PR curves per pipeline tier (evaluation.EVALUATION_FILE).
+        per_class (bool): Also draw one chart per class.
+        processes (int): Worker processes, defaults to one per CPU (up to the number of charts).
+        force (bool): Re-render every chart.
+
+    Returns:
+        list: Paths of all charts of the report, rendered now or unchanged.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    charts = build_charts(_read_json(summary_path), _read_json(class_stats_path), _read_json(metrics_path),
+                          per_class, _read_json(evaluation_path))
+
+    hashes_path = output_dir / HASHES_FILE
+    hashes = _read_json(hashes_path) or {}
+    jobs, new_hashes, paths = [], {}, []
+    for stem, kind, data in charts:
+        path = output_dir / f'{stem}.png'
+        paths.append(path)
+        new_hashes[stem] = chart_hash(kind, data)
+        if force or hashes.get(stem) != new_hashes[stem] or not path.exists():
+            jobs.append((kind, data, str(path)))
+
+    processes = processes or min(len(jobs), os.cpu_count() or 1)
+    if processes > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            list(pool.map(_render, jobs))
+    else:
+        for job in jobs:
+            _render(job)
+
+    with open(hashes_path, 'w') as f:
+        json.dump(new_hashes, f, indent=4, sort_keys=True)
+    print(f"Report: {len(jobs)} charts rendered, {len(charts) - len(jobs)} unchanged, in {output_dir}")
+    return paths
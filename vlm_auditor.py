@@ -1,110 +1,511 @@
-import json
 import os
 import time
+import metrics
+from functools import partial
 from pathlib import Path
-from google import genai
-from dotenv import load_dotenv
-from PIL import Image
+from vlm_backends import GeminiBackend
+from vlm_cache import VerdictCache
+from vlm_payload import PayloadBuilder
+from vlm_batching import build_batch_prompt, parse_batch_answer, group_by_image, is_batchable, BATCH_PROMPT_VERSION
+from jsonl_io import iter_records, open_record_writer
 
-# Load environment variables
-load_dotenv()
+# Model of the default backend
+DEFAULT_MODEL = 'gemini-2.0-flash'
 
-# Configure Gemini API using GOOGLE_API_KEY
-API_KEY = os.getenv("GOOGLE_API_KEY")
-if not API_KEY:
-    print("Warning: GOOGLE_API_KEY not found in .env file.")
-    client = None
-else:
-    client = genai.Client(api_key=API_KEY)
+# Default audit queue and report (written by main.py)
+AUDIT_FILE = 'to_audit.jsonl'
+REPORT_FILE = 'final_report.jsonl'
 
-def get_vlm_opinion(image_path, detected_label):
+# Their names before they moved to JSONL, used by `python vlm_auditor.py` when only the old queue exists
+LEGACY_AUDIT_FILE = 'to_audit.json'
+LEGACY_REPORT_FILE = 'final_report.json'
+
+# Gemini client, created on first use by get_client (False: no API key configured)
+_client = None
+
+def get_client():
     """
-    Sends an image to Gemini 2.0 Flash to check for the detected label.
+    Returns the Gemini client configured from GOOGLE_API_KEY (read from .env), or None.
+    The google-genai import and the client are only paid for by the first audit.
     """
+    global _client
+    if _client is None:
+        from dotenv import load_dotenv
+
+        # Load environment variables
+        load_dotenv()
+        api_key = os.getenv("GOOGLE_API_KEY")
+        if not api_key:
+            print("Warning: GOOGLE_API_KEY not found in .env file.")
+            _client = False
+        else:
+            from google import genai
+            _client = genai.Client(api_key=api_key)
+    return _client or None
+
+def get_default_backend():
+    """Returns the Gemini backend built from GOOGLE_API_KEY, or None if it is not configured."""
+    client = get_client()
     if not client:
+        return None
+    return GeminiBackend(client, model_name=DEFAULT_MODEL)
+
+# Bump whenever build_prompt changes so cached verdicts are not reused
+PROMPT_VERSION = 1
+
+def build_prompt(detected_label, cropped=False):
+    if cropped:
+        return (f"You are a Quality Control expert. A YOLO model detected a {detected_label}. "
+                f"The image is a crop of the region of interest around that detection. "
+                f"Is there actually a {detected_label} in this region? Answer only YES or NO.")
+    return (f"You are a Quality Control expert. A YOLO model detected a {detected_label}. "
+            f"Is there actually a {detected_label} in this image? Answer only YES or NO.")
+
+def request_tag(bbox=None, payload_builder=None):
+    """Prompt/payload version used in verdict cache keys."""
+    if payload_builder is None:
+        return str(PROMPT_VERSION)
+    return f"{PROMPT_VERSION}-{payload_builder.cache_tag(bbox)}"
+
+def batch_request_tag(bbox=None, payload_builder=None):
+    """
+    Batch prompt/overlay version used in the cache keys of verdicts from batched requests,
+    so they are never served to single-crop audits (a different prompt and payload).
+    """
+    payload_builder = payload_builder or PayloadBuilder()
+    return f"batch{BATCH_PROMPT_VERSION}-{payload_builder.overlay_cache_tag(bbox)}"
+
+def load_vlm_image(image_path, bbox=None, payload_builder=None):
+    """Returns the image to send: a cropped ImagePayload with a builder, else the full PIL image."""
+    with metrics.stage('vlm_payload'):
+        if payload_builder is not None:
+            return payload_builder.build(image_path, bbox)
+        from PIL import Image
+
+        with Image.open(image_path) as img:
+            img.load()
+            return img
+
+def timed_call(call, *args):
+    """
+    Runs one VLM request (e.g. backend.generate), counted in vlm_calls/vlm_errors
+    and timed into the vlm_call_seconds histogram of the active metrics run.
+    """
+    start = time.perf_counter()
+    try:
+        return call(*args)
+    except Exception:
+        metrics.count('vlm_errors')
+        raise
+    finally:
+        metrics.count('vlm_calls')
+        metrics.observe('vlm_call_seconds', time.perf_counter() - start)
+
+async def timed_acall(call, *args):
+    """timed_call for coroutine functions such as backend.agenerate."""
+    start = time.perf_counter()
+    try:
+        return await call(*args)
+    except Exception:
+        metrics.count('vlm_errors')
+        raise
+    finally:
+        metrics.count('vlm_calls')
+        metrics.observe('vlm_call_seconds', time.perf_counter() - start)
+
+def _rate_limit_pause():
+    # Respect rate limits (simple pause)
+    with metrics.stage('rate_limit_sleep'):
+        time.sleep(1)
+
+def parse_vlm_answer(text):
+    """Normalizes a raw VLM answer to YES, NO or UNCERTAIN (...)."""
+    # Clean up response text
+    answer = text.strip().upper()
+    
+    # Basic validation of the answer
+    if "YES" in answer:
+        return "YES"
+    elif "NO" in answer:
+        return "NO"
+    else:
+        return f"UNCERTAIN ({answer})"
+
+def apply_verdict(item, vlm_result):
+    """Stores the VLM result and the suggested action on an audit item."""
+    item['vlm_verification'] = vlm_result
+    
+    if vlm_result == "NO":
+        item['vlm_suggested_action'] = "REJECT"
+    elif vlm_result == "YES":
+        item['vlm_suggested_action'] = "APPROVE"
+    else:
+         item['vlm_suggested_action'] = "MANUAL_REVIEW"
+    return item
+
+def get_vlm_opinion(image_path, detected_label, backend=None, cache=None, bbox=None, payload_builder=None):
+    """
+    Sends an image to the VLM backend (Gemini 2.0 Flash by default) to check for the detected label.
+    If a VerdictCache is given, it is checked first and updated with YES/NO answers.
+    With a PayloadBuilder, only the bbox region (plus margin) is sent, downscaled.
+    """
+    backend = backend or get_default_backend()
+    if not backend:
         return "ERROR: API KEY NOT CONFIGURED"
         
     try:
-        img = Image.open(image_path)
-        
-        prompt = (f"You are a Quality Control expert. A YOLO model detected a {detected_label}. "
-                  f"Is there actually a {detected_label} in this image? Answer only YES or NO.")
-        
-        response = client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=[prompt, img]
-        )
+        cache_key = None
+        if cache is not None:
+            cache_key = cache.make_key(image_path, detected_label, request_tag(bbox, payload_builder),
+                                       backend.model_name)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        img = load_vlm_image(image_path, bbox, payload_builder)
         
-        # Clean up response text
-        answer = response.text.strip().upper()
+        prompt = build_prompt(detected_label, cropped=payload_builder is not None and bool(bbox))
         
-        # Basic validation of the answer
-        if "YES" in answer:
-            return "YES"
-        elif "NO" in answer:
-            return "NO"
-        else:
-            return f"UNCERTAIN ({answer})"
+        vlm_result = parse_vlm_answer(timed_call(backend.generate, prompt, img))
+        if cache_key is not None:
+            cache.put(cache_key, vlm_result)
+        return vlm_result
             
     except Exception as e:
         print(f"Error processing {image_path}: {e}")
         return "ERROR"
 
-def run_vlm_audit(audit_file_path="to_audit.json", output_file_path="final_report.json"):
+def prepare_batch_request(image_path, items, payload_builder=None):
+    """Returns (prompt, overlay payload) asking about every box in `items` at once."""
+    payload_builder = payload_builder or PayloadBuilder()
+    image = payload_builder.build_overlay(image_path, [item['bbox'] for item in items])
+    return build_batch_prompt(items), image
+
+def get_vlm_batch_opinion(image_path, items, backend=None, payload_builder=None):
+    """
+    Asks about all flagged boxes of one image in a single request.
+
+    Returns:
+        list or None: One YES/NO verdict per item, or None if the call failed or the
+                      answer could not be parsed (callers fall back to single-item calls).
+    """
+    backend = backend or get_default_backend()
+    if not backend:
+        return None
+
+    try:
+        prompt, image = prepare_batch_request(image_path, items, payload_builder)
+        return parse_batch_answer(timed_call(backend.generate, prompt, image), len(items))
+    except Exception as e:
+        print(f"Error processing batch for {image_path}: {e}")
+        return None
+
+def cached_verdicts(items, backend, cache, payload_builder=None):
+    """
+    Looks up cached verdicts for items of one image before a batched request: the
+    single-item verdict, else one from an earlier batched request.
+
+    Returns:
+        tuple: ({position_in_items: verdict} for hits, {position_in_items: batch cache_key} for
+               misses, the key new batch verdicts are stored under)
+    """
+    hits, keys = {}, {}
+    if cache is None or backend is None:
+        return hits, keys
+    for i, item in enumerate(items):
+        label, bbox = item.get('label', 'object'), item.get('bbox')
+        single_key = cache.make_key(item['image_path'], label, request_tag(bbox, payload_builder),
+                                    backend.model_name)
+        batch_key = cache.make_key(item['image_path'], label, batch_request_tag(bbox, payload_builder),
+                                   backend.model_name)
+        # Peeked first so an item counts one cache hit or miss, not two
+        verdict = cache.get(single_key if cache.peek(single_key) is not None else batch_key)
+        if verdict is not None:
+            hits[i] = verdict
+        else:
+            keys[i] = batch_key
+    return hits, keys
+
+AUDIT_CHUNK_SIZE = 256
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def iter_vlm_audit(audit_items, backend, concurrency=1, rpm=None, cache=None, payload_builder=None, batch=False,
+                   manifest=None, chunk_size=AUDIT_CHUNK_SIZE, stats=None):
+    """
+    Audits items pulled lazily from any iterable (e.g. jsonl_io.iter_records on a
+    JSONL audit queue) and yields them in queue order with their vlm_* fields set.
+
+    Items are read `chunk_size` at a time; batching groups boxes of an image within
+    a chunk. With concurrency above 1, every chunk goes through one AuditStream, so
+    one event loop and one rate limiter (with its backoff) serve the whole queue, and
+    the next chunk is queued while the previous one is yielded: at most two chunks
+    are held. Arguments are as in run_vlm_audit. Async engine counters are added to
+    `stats` (calls, retries, batched_items, elapsed).
+    """
+    if not (concurrency > 1 and backend):
+        yield from _iter_sequential_audit(audit_items, backend, cache, payload_builder, batch, manifest,
+                                          chunk_size, stats)
+        return
+
+    from collections import deque
+    from audit_engine import AuditStream
+
+    on_result = (lambda position, item: _commit_audit(manifest, item)) if manifest is not None else None
+    stream = AuditStream(backend, concurrency=concurrency, rpm=rpm, cache=cache, payload_builder=payload_builder,
+                         batch=batch, on_result=on_result)
+    # Per queued item: its resumed result, or its position in the stream
+    queued = deque()
+    try:
+        for chunk in _chunks(audit_items, chunk_size):
+            resumed = _resumed_audits(chunk, manifest, stats)
+            pending = [position for position in range(len(chunk)) if position not in resumed]
+            units = (group_by_image([chunk[p] for p in pending]).values() if batch else [range(len(pending))])
+            stream_positions = {}
+            for unit in units:
+                for i, position in zip(unit, stream.submit([chunk[pending[i]] for i in unit])):
+                    stream_positions[pending[i]] = position
+            for position in range(len(chunk)):
+                queued.append((resumed.get(position), stream_positions.get(position)))
+            while len(queued) > chunk_size:
+                yield _next_queued(queued, stream)
+        while queued:
+            yield _next_queued(queued, stream)
+    finally:
+        stream.close()
+        if stats is not None:
+            for key in ('calls', 'retries', 'batched_items', 'elapsed'):
+                stats[key] = stats.get(key, 0) + stream.stats[key]
+
+def _next_queued(queued, stream):
+    done, position = queued.popleft()
+    return done if position is None else stream.take(position)
+
+def _resumed_audits(chunk, manifest, stats):
+    """{position in chunk: audited item} for the items the manifest already has a verdict for."""
+    resumed = {}
+    if manifest is not None:
+        for position, item in enumerate(chunk):
+            done = manifest.get_audit(item)
+            if done is not None:
+                resumed[position] = done
+        if stats is not None:
+            stats['resumed'] = stats.get('resumed', 0) + len(resumed)
+    return resumed
+
+def _iter_sequential_audit(audit_items, backend, cache, payload_builder, batch, manifest, chunk_size, stats):
+    on_result = partial(_commit_audit, manifest) if manifest is not None else None
+    for chunk in _chunks(audit_items, chunk_size):
+        resumed = _resumed_audits(chunk, manifest, stats)
+        pending = [item for position, item in enumerate(chunk) if position not in resumed]
+        pending_results = _run_sequential_audit(pending, backend, cache, payload_builder, batch, on_result)
+        pending_iter = iter(pending_results)
+        for position in range(len(chunk)):
+            yield resumed[position] if position in resumed else next(pending_iter)
+
+def _read_queue(audit_file):
+    """Items of the audit queue file; stops with a message at the first record that cannot be decoded."""
+    try:
+        yield from iter_records(audit_file)
+    except ValueError as e:
+        print(f"Error: Failed to decode {audit_file}: {e}")
+
+def run_vlm_audit(audit_file_path=AUDIT_FILE, output_file_path=REPORT_FILE,
+                  backend=None, concurrency=1, rpm=None, cache=None, use_cache=True, crop=True, batch=False,
+                  manifest=None, dedup=False):
+    """
+    Audits every item in the audit file and saves the verified report.
+
+    The audit queue is read lazily (see iter_vlm_audit) and every verified item is
+    written to the report as soon as it is known, one flushed line per item for
+    JSONL outputs (see jsonl_io.py). Nothing is kept in memory: read the items
+    back from the report (e.g. jsonl_io.RecordFile).
+
+    Args:
+        audit_file_path (str): Flagged detections, as JSONL (.jsonl, .jsonl.gz, .jsonl.zst) or a JSON list.
+        output_file_path (str): Where to save the verified results, JSONL or a JSON list by suffix.
+        backend (VLMBackend): Model to query, defaults to Gemini.
+        concurrency (int): Requests in flight. 1 keeps the original sequential loop,
+                           higher values use the async engine in audit_engine.py.
+        rpm (float): Requests-per-minute limit for the async engine.
+        cache (VerdictCache): Verdict cache, defaults to vlm_cache.sqlite when use_cache is set.
+        use_cache (bool): Set False to always ask the VLM.
+        crop (bool): Send the bbox region (see vlm_payload.PayloadBuilder) instead of the full frame.
+        batch (bool): Ask about all flagged boxes of an image in one request (see vlm_batching.py).
+        manifest (RunManifest): Items already audited in an earlier (possibly crashed) run are
+                                taken from it, and every new verdict is committed to it.
+        dedup (bool): Items on near-duplicate frames (see frame_dedup.py) whose box closely matches
+                      an item already audited on a sibling frame take its verdict instead of a call.
+                      The audit queue is then read up front.
+
+    Returns:
+        dict: Number of report items per vlm_verification value, e.g. {'YES': 12, 'NO': 3}.
+    """
     audit_file = Path(audit_file_path)
     output_file = Path(output_file_path)
 
     if not audit_file.exists():
         print(f"Error: {audit_file} not found.")
-        return []
+        return {}
 
-    try:
-        with open(audit_file, 'r') as f:
-            audit_data = json.load(f)
-    except json.JSONDecodeError:
-        print(f"Error: Failed to decode {audit_file}.")
-        return []
+    print(f"Streaming VLM audit items from {audit_file} using Gemini 1.5 Flash.")
 
-    print(f"Loaded {len(audit_data)} items for VLM audit using Gemini 1.5 Flash.")
+    backend = backend or get_default_backend()
+    if cache is None and use_cache:
+        cache = VerdictCache()
+    payload_builder = PayloadBuilder() if crop else None
 
-    verified_results = []
+    stats = {}
+    counts = {}
+    with open_record_writer(output_file) as writer:
+        items, followers = _read_queue(audit_file), {}
+        if dedup:
+            from frame_dedup import FrameClusters, dedup_audit_items
+            items = list(items)
+            with metrics.stage('frame_dedup'):
+                clusters = FrameClusters.for_images(item['image_path'] for item in items
+                                                    if item.get('image_path'))
+                followers = dedup_audit_items(items, clusters)
+            print(f"{clusters.summary()}; {len(followers)} audit items can take a sibling frame's verdict.")
 
-    for item in audit_data:
-        image_path = item.get('image_path')
-        detected_label = item.get('label', 'object')
-        
-        if not image_path or not Path(image_path).exists():
-            print(f"Skipping missing image: {image_path}")
-            item['vlm_verification'] = "IMAGE_NOT_FOUND"
-            verified_results.append(item)
-            continue
+        audited = iter_vlm_audit((item for position, item in enumerate(items) if position not in followers),
+                                 backend, concurrency=concurrency, rpm=rpm, cache=cache,
+                                 payload_builder=payload_builder, batch=batch, manifest=manifest, stats=stats)
+        if followers:
+            from frame_dedup import iter_with_followers
 
-        print(f"Auditing {image_path} for {detected_label}...")
-        
-        # Call Gemini
-        vlm_result = get_vlm_opinion(image_path, detected_label)
-        
-        # Update the item with VLM result
-        item['vlm_verification'] = vlm_result
-        
-        if vlm_result == "NO":
-            item['vlm_suggested_action'] = "REJECT"
-        elif vlm_result == "YES":
-            item['vlm_suggested_action'] = "APPROVE"
-        else:
-             item['vlm_suggested_action'] = "MANUAL_REVIEW"
-        
-        verified_results.append(item)
-        
-        # Respect rate limits (simple pause)
-        time.sleep(1)
+            def audit_one(item):
+                return _run_sequential_audit([item], backend, cache, payload_builder)[0]
+
+            audited = iter_with_followers(items, followers, audited, audit_one, stats)
+        for item in audited:
+            writer.write(item)
+            verdict = item.get('vlm_verification')
+            counts[verdict] = counts.get(verdict, 0) + 1
+    total = sum(counts.values())
+
+    if manifest is not None:
+        print(f"Manifest: {stats.get('resumed', 0)} of {total} items already audited, resumed.")
+    if 'calls' in stats:
+        print(f"Async audit: {stats['calls']} calls, {stats['retries']} retries, "
+              f"{stats['batched_items']} items answered in batches in {stats['elapsed']:.1f}s")
+    if dedup:
+        print(f"Frame dedup: {stats.get('propagated', 0)} VLM calls saved by propagating sibling frame verdicts")
+    if cache is not None:
+        print(cache.summary())
+    if payload_builder is not None:
+        print(payload_builder.summary())
+
+    print(f"Audit complete. {total} items, final report saved to {output_file}")
+    return counts
+
+def open_audit_stream(backend=None, concurrency=8, rpm=None, cache=None, use_cache=True, crop=True, batch=False,
+                      on_result=None, keep_results=None):
+    """
+    Starts an audit_engine.AuditStream with the same defaults as run_vlm_audit,
+    for pipelines that submit audit items while inference is still running.
+    """
+    from audit_engine import AuditStream
+
+    backend = backend or get_default_backend()
+    if cache is None and use_cache:
+        cache = VerdictCache()
+    payload_builder = PayloadBuilder() if crop else None
+    return AuditStream(backend, concurrency=concurrency, rpm=rpm, cache=cache, payload_builder=payload_builder,
+                       batch=batch, on_result=on_result, keep_results=keep_results)
+
+def _audit_single(item, backend, cache=None, payload_builder=None):
+    """Audits one item. Returns (item, whether a VLM call was made)."""
+    image_path = item.get('image_path')
+    detected_label = item.get('label', 'object')
+    
+    if not image_path or not Path(image_path).exists():
+        print(f"Skipping missing image: {image_path}")
+        item['vlm_verification'] = "IMAGE_NOT_FOUND"
+        return item, False
+
+    print(f"Auditing {image_path} for {detected_label}...")
+    
+    # Call Gemini
+    hits_before = cache.hits if cache is not None else 0
+    vlm_result = get_vlm_opinion(image_path, detected_label, backend, cache,
+                                 bbox=item.get('bbox'), payload_builder=payload_builder)
+    
+    # Update the item with VLM result
+    return apply_verdict(item, vlm_result), cache is None or cache.hits == hits_before
+
+def _audit_batch(items, backend, cache=None, payload_builder=None):
+    """
+    Audits the batchable items of one image with a single request.
+
+    Returns:
+        tuple: (set of positions in items that were settled, whether a VLM call was made)
+    """
+    image_path = items[0].get('image_path')
+    if not image_path or not Path(image_path).exists():
+        return set(), False
+
+    hits, keys = cached_verdicts(items, backend, cache, payload_builder)
+    for i, verdict in hits.items():
+        apply_verdict(items[i], verdict)
+
+    pending = [i for i in range(len(items)) if i not in hits and is_batchable(items[i])]
+    if len(pending) < 2:
+        return set(hits), False
+
+    print(f"Auditing {image_path} for {len(pending)} boxes in one request...")
+    verdicts = get_vlm_batch_opinion(image_path, [items[i] for i in pending], backend, payload_builder)
+    if verdicts is None:
+        return set(hits), True
+
+    for i, verdict in zip(pending, verdicts):
+        apply_verdict(items[i], verdict)
+    if keys:
+        cache.put_many([(keys[i], verdict) for i, verdict in zip(pending, verdicts) if i in keys])
+    return set(hits) | set(pending), True
+
+def _commit_audit(manifest, item):
+    # Errors are not committed so the next run retries them
+    verdict = str(item.get('vlm_verification', ''))
+    if verdict.startswith('ERROR') or verdict == 'IMAGE_NOT_FOUND':
+        return
+    manifest.put_audit(item)
+
+def _run_sequential_audit(audit_data, backend, cache=None, payload_builder=None, batch=False, on_result=None):
+    verified_results = [None] * len(audit_data)
+    groups = group_by_image(audit_data).values() if batch else [[i] for i in range(len(audit_data))]
+
+    for positions in groups:
+        settled = set()
+        if len(positions) > 1:
+            settled, called = _audit_batch([audit_data[p] for p in positions], backend, cache, payload_builder)
+            if called:
+                _rate_limit_pause()
 
-    # Save final report
-    with open(output_file, 'w') as f:
-        json.dump(verified_results, f, indent=4)
+        for i, position in enumerate(positions):
+            if i in settled:
+                verified_results[position] = audit_data[position]
+            else:
+                verified_results[position], called = _audit_single(audit_data[position], backend, cache,
+                                                                   payload_builder)
+                # Cached verdicts made no call
+                if called:
+                    _rate_limit_pause()
+            if on_result:
+                on_result(verified_results[position])
 
-    print(f"Audit complete. Final report saved to {output_file}")
     return verified_results
 
 if __name__ == "__main__":
-    run_vlm_audit()
+    if not Path(AUDIT_FILE).exists() and Path(LEGACY_AUDIT_FILE).exists():
+        run_vlm_audit(LEGACY_AUDIT_FILE, LEGACY_REPORT_FILE)
+    else:
+        run_vlm_audit()
@@ -0,0 +1,157 @@
+import asyncio
+import random
+import re
+import time
+
+
+class VLMError(Exception):
+    """
+    Error raised by a VLM backend. status_code follows HTTP (429 rate limit, 5xx server);
+    retry_after is the server's requested wait in seconds (Retry-After), None if it gave none.
+    """
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status_code == 429 or (self.status_code is not None and self.status_code >= 500)
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After value (delta seconds or an HTTP date), None if absent or invalid."""
+    if value is None or value == '':
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        return max(0.0, parsedate_to_datetime(str(value)).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class VLMBackend:
+    """
+    Interface for a vision-language model used by the auditor.
+
+    Subclasses implement generate(); agenerate() defaults to running it in a thread.
+    """
+    model_name = 'unknown'
+
+    def generate(self, prompt, image):
+        """Returns the raw text answer for a prompt and an image (PIL image or encoded bytes)."""
+        raise NotImplementedError
+
+    async def agenerate(self, prompt, image):
+        return await asyncio.to_thread(self.generate, prompt, image)
+
+
+class GeminiBackend(VLMBackend):
+    """Google Gemini through the google-genai client."""
+
+    def __init__(self, client, model_name='gemini-2.0-flash'):
+        self.client = client
+        self.model_name = model_name
+
+    @staticmethod
+    def _to_part(image):
+        # Encoded payloads (vlm_payload.ImagePayload) are sent as raw bytes, PIL images as-is
+        if hasattr(image, 'mime_type'):
+            from google.genai import types
+            return types.Part.from_bytes(data=image.data, mime_type=image.mime_type)
+        return image
+
+    @staticmethod
+    def _retry_after(e):
+        """Seconds from a Retry-After header or the RetryInfo detail of a Google API error, or None."""
+        headers = getattr(getattr(e, 'response', None), 'headers', None) or {}
+        value = headers.get('retry-after') if hasattr(headers, 'get') else None
+        details = getattr(e, 'details', None)
+        if value is None and isinstance(details, dict):
+            for detail in details.get('error', {}).get('details', []):
+                if str(detail.get('@type', '')).endswith('RetryInfo'):
+                    value = str(detail.get('retryDelay', '')).rstrip('s')
+        return parse_retry_after(value)
+
+    @staticmethod
+    def _wrap_error(e):
+        from google.genai import errors
+        if isinstance(e, errors.APIError):
+            return VLMError(str(e), status_code=e.code, retry_after=GeminiBackend._retry_after(e))
+        return e
+
+    def generate(self, prompt, image):
+        try:
+            response = self.client.models.generate_content(model=self.model_name,
+                                                           contents=[prompt, self._to_part(image)])
+        except Exception as e:
+            raise self._wrap_error(e) from e
+        return response.text
+
+    async def agenerate(self, prompt, image):
+        try:
+            response = await self.client.aio.models.generate_content(model=self.model_name,
+                                                                     contents=[prompt, self._to_part(image)])
+        except Exception as e:
+            raise self._wrap_error(e) from e
+        return response.text
+
+
+class FakeVLMBackend(VLMBackend):
+    """
+    Local stand-in for offline tests and benchmarks.
+
+    Args:
+        latency (float): Mean seconds per call.
+        jitter (float): Uniform +/- seconds added to the latency.
+        error_rate (float): Fraction of calls failing with a retryable error.
+        error_status (int): Status code of the injected errors (429 or 5xx).
+        answer (callable): Maps the prompt to an answer text. Defaults to "YES", or one
+                           "<n>: YES" line per box for batched prompts.
+        seed (int): Seed for latency and error sampling.
+    """
+    model_name = 'fake-vlm'
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=429, answer=None, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.answer = answer or self._default_answer
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+
+    @staticmethod
+    def _default_answer(prompt):
+        numbers = re.findall(r'^(\d+): ', prompt, re.MULTILINE)
+        if numbers:
+            return "\n".join(f"{number}: YES" for number in numbers)
+        return "YES"
+
+    def _sample(self):
+        self.calls += 1
+        delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+        fail = self.rng.random() < self.error_rate
+        if fail:
+            self.errors += 1
+        return delay, fail
+
+    def generate(self, prompt, image):
+        delay, fail = self._sample()
+        time.sleep(delay)
+        if fail:
+            raise VLMError("Injected fake error", status_code=self.error_status)
+        return self.answer(prompt)
+
+    async def agenerate(self, prompt, image):
+        delay, fail = self._sample()
+        await asyncio.sleep(delay)
+        if fail:
+            raise VLMError("Injected fake error", status_code=self.error_status)
+        return self.answer(prompt)
@@ -0,0 +1,64 @@
+import re
+from collections import OrderedDict
+
+# Bump whenever build_batch_prompt changes
+BATCH_PROMPT_VERSION = 1
+
+ANSWER_LINE = re.compile(r'^\W*(?:BOX\s*)?(\d+)\s*[:.)\-=]\s*\W*(YES|NO)\b', re.IGNORECASE)
+
+
+def group_by_image(audit_data):
+    """
+    Groups audit item positions by image_path, keeping first-seen order.
+
+    Returns:
+        OrderedDict: image_path -> list of positions in audit_data.
+    """
+    groups = OrderedDict()
+    for position, item in enumerate(audit_data):
+        groups.setdefault(item.get('image_path'), []).append(position)
+    return groups
+
+
+def build_batch_prompt(items):
+    """
+    Builds one prompt asking about every flagged box of an image.
+
+    Boxes are numbered from 1 in the order of `items`, matching the numbers drawn on the image.
+    """
+    lines = [
+        "You are a Quality Control expert. A YOLO model made the numbered detections below. "
+        "Each box is drawn in red on the image with its number. "
+        "For every box, is the detected object actually inside it?",
+    ]
+    for number, item in enumerate(items, start=1):
+        x1, y1, x2, y2 = (round(c) for c in item['bbox'])
+        lines.append(f"{number}: {item.get('label', 'object')} at [{x1}, {y1}, {x2}, {y2}]")
+    lines.append("Answer with one line per box in the form '<number>: YES' or '<number>: NO' and nothing else.")
+    return "\n".join(lines)
+
+
+def parse_batch_answer(text, count):
+    """
+    Parses a structured per-box answer.
+
+    Returns:
+        list or None: `count` verdicts ("YES"/"NO") in box order, or None if any box is missing
+                      or answered twice with different verdicts.
+    """
+    verdicts = {}
+    for line in text.strip().splitlines():
+        match = ANSWER_LINE.match(line.strip())
+        if not match:
+            continue
+        number, verdict = int(match.group(1)), match.group(2).upper()
+        if verdicts.get(number, verdict) != verdict:
+            return None
+        verdicts[number] = verdict
+    if sorted(verdicts) != list(range(1, count + 1)):
+        return None
+    return [verdicts[number] for number in range(1, count + 1)]
+
+
+def is_batchable(item):
+    return bool(item.get('bbox')) and item.get('label') is not None
@@ -0,0 +1,130 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import metrics
+from pathlib import Path
+
+DEFAULT_CACHE_PATH = 'vlm_cache.sqlite'
+
+# Only definite answers are cached; UNCERTAIN (...) replies and errors are asked again next time
+CACHEABLE_VERDICTS = ('YES', 'NO')
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class VerdictCache:
+    """
+    Persistent SQLite cache of VLM verdicts.
+
+    Entries are keyed by image content hash, detected label, prompt template
+    version and model name, so a changed image, prompt or model is a miss.
+
+    Args:
+        path (str): SQLite file.
+        ttl_seconds (float): Entries older than this are ignored and removed. None keeps them forever.
+        max_entries (int): Least recently used entries are evicted above this size. None is unbounded.
+        catalog (DatasetCatalog): Image hashes are taken from it where it has the image (see dataset_catalog.py).
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_seconds=None, max_entries=None, catalog=None):
+        self.path = str(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.catalog = catalog
+        self.hits = 0
+        self.misses = 0
+        self._hashes = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS verdicts ("
+            "key TEXT PRIMARY KEY, verdict TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS verdicts_last_used ON verdicts (last_used)")
+        self._conn.commit()
+
+    def image_hash(self, image_path):
+        """Content hash of an image from the catalog, else memoized by path, size and mtime."""
+        if self.catalog is not None:
+            content_hash = self.catalog.content_hash(image_path)
+            if content_hash is not None:
+                return content_hash
+        stat = Path(image_path).stat()
+        memo_key = (str(image_path), stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._hashes:
+            self._hashes[memo_key] = hash_file(image_path)
+        return self._hashes[memo_key]
+
+    def make_key(self, image_path, label, prompt_version, model_name):
+        return f"{self.image_hash(image_path)}|{label}|{prompt_version}|{model_name}"
+
+    def get(self, key):
+        """Returns the cached verdict or None, counting a hit or a miss."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT verdict, created_at FROM verdicts WHERE key = ?", (key,)).fetchone()
+            # Entries past their TTL, and uncertain answers cached by older versions, are misses
+            if row and ((self.ttl_seconds is not None and now - row[1] > self.ttl_seconds)
+                        or row[0] not in CACHEABLE_VERDICTS):
+                self._conn.execute("DELETE FROM verdicts WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                metrics.count('cache_misses')
+                return None
+            self._conn.execute("UPDATE verdicts SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            metrics.count('cache_hits')
+            return row[0]
+
+    def peek(self, key):
+        """Returns the cached verdict or None without counting a lookup or refreshing last_used."""
+        with self._lock:
+            row = self._conn.execute("SELECT verdict, created_at FROM verdicts WHERE key = ?", (key,)).fetchone()
+        if (row is None or row[0] not in CACHEABLE_VERDICTS
+                or (self.ttl_seconds is not None and time.time() - row[1] > self.ttl_seconds)):
+            return None
+        return row[0]
+
+    def put(self, key, verdict):
+        """Stores a YES/NO verdict; anything else is not cached (see CACHEABLE_VERDICTS)."""
+        self.put_many([(key, verdict)])
+
+    def put_many(self, verdicts):
+        """Stores (key, verdict) pairs in one transaction."""
+        now = time.time()
+        rows = [(key, verdict, now, now) for key, verdict in verdicts if verdict in CACHEABLE_VERDICTS]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO verdicts (key, verdict, created_at, last_used) VALUES (?, ?, ?, ?)", rows)
+            if self.max_entries is not None:
+                self._conn.execute(
+                    "DELETE FROM verdicts WHERE key IN ("
+                    "SELECT key FROM verdicts ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0]
+
+    def summary(self):
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0
+        return f"VLM cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate), {len(self)} entries"
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,126 @@
+import io
+import threading
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+from PIL import Image, ImageDraw
+
+# Encoded image bytes ready to send to a VLM backend
+ImagePayload = namedtuple('ImagePayload', ['data', 'mime_type'])
+
+MIME_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+
+
+class PayloadBuilder:
+    """
+    Builds compact VLM image payloads: crop to the detection bbox plus a context
+    margin, downscale to max_side and encode once in memory.
+
+    Decoded images are kept in a small LRU so audit items sharing an image_path
+    decode it only once.
+
+    Args:
+        margin (float): Context added on each side, as a fraction of the bbox width/height.
+        max_side (int): Longest side of the encoded payload in pixels.
+        image_format (str): 'JPEG' or 'WEBP'.
+        quality (int): Encoder quality.
+        max_cached_images (int): Decoded images kept in memory.
+        overlay_max_side (int): Longest side of full-frame overlay payloads (batched prompts).
+    """
+
+    def __init__(self, margin=0.25, max_side=512, image_format='JPEG', quality=85, max_cached_images=8,
+                 overlay_max_side=1024):
+        self.margin = margin
+        self.max_side = max_side
+        self.overlay_max_side = overlay_max_side
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.max_cached_images = max_cached_images
+        # Running totals for summary(); one builder can serve a whole service run
+        self.payloads = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cache_tag(self, bbox):
+        """Identifies the payload content for the verdict cache (crop settings and bbox)."""
+        box = 'full' if not bbox else ','.join(f'{c:.0f}' for c in bbox)
+        return f'crop-{self.margin}-{self.max_side}-{self.image_format}-{box}'
+
+    def overlay_cache_tag(self, bbox):
+        """Identifies a box's share of a numbered full-frame overlay payload (see build_overlay)."""
+        box = ','.join(f'{c:.0f}' for c in bbox) if bbox else 'none'
+        return f'overlay-{self.overlay_max_side}-{self.image_format}-{box}'
+
+    def _get_image(self, image_path):
+        key = str(image_path)
+        with self._lock:
+            if key in self._images:
+                self._images.move_to_end(key)
+                return self._images[key]
+        with Image.open(image_path) as img:
+            img = img.convert('RGB')
+        with self._lock:
+            self._images[key] = img
+            while len(self._images) > self.max_cached_images:
+                self._images.popitem(last=False)
+        return img
+
+    def crop_box(self, bbox, img_width, img_height):
+        """Expands an xyxy bbox by the margin and clamps it to the image."""
+        x1, y1, x2, y2 = bbox
+        pad_x = (x2 - x1) * self.margin
+        pad_y = (y2 - y1) * self.margin
+        left = max(0, int(x1 - pad_x))
+        top = max(0, int(y1 - pad_y))
+        right = min(img_width, int(round(x2 + pad_x)))
+        bottom = min(img_height, int(round(y2 + pad_y)))
+        if right <= left or bottom <= top:
+            return 0, 0, img_width, img_height
+        return left, top, right, bottom
+
+    def build(self, image_path, bbox=None):
+        """
+        Returns an ImagePayload for the bbox region of the image (whole image if bbox is None).
+        """
+        img = self._get_image(image_path)
+        if bbox:
+            img = img.crop(self.crop_box(bbox, *img.size))
+        return self._encode(img, image_path, self.max_side)
+
+    def build_overlay(self, image_path, bboxes):
+        """
+        Returns an ImagePayload of the whole frame with each bbox drawn and numbered from 1.
+        """
+        img = self._get_image(image_path).copy()
+        draw = ImageDraw.Draw(img)
+        width = max(2, round(max(img.size) / 300))
+        for number, (x1, y1, x2, y2) in enumerate(bboxes, start=1):
+            x1, x2 = sorted((x1, x2))
+            y1, y2 = sorted((y1, y2))
+            draw.rectangle([x1, y1, x2, y2], outline=(255, 0, 0), width=width)
+            draw.text((x1 + width, max(0, y1 - 12)), str(number), fill=(255, 0, 0))
+        return self._encode(img, image_path, self.overlay_max_side)
+
+    def _encode(self, img, image_path, max_side):
+        if max(img.size) > max_side:
+            img = img.copy()
+            img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        buffer = io.BytesIO()
+        img.save(buffer, format=self.image_format, quality=self.quality)
+        data = buffer.getvalue()
+
+        source_size = Path(image_path).stat().st_size
+        with self._lock:
+            self.payloads += 1
+            self.bytes_before += source_size
+            self.bytes_after += len(data)
+        return ImagePayload(data, MIME_TYPES.get(self.image_format, 'application/octet-stream'))
+
+    def summary(self):
+        if not self.payloads:
+            return "VLM payloads: none built"
+        before, after, n = self.bytes_before, self.bytes_after, self.payloads
+        return (f"VLM payloads: {n} payloads, avg {before / n / 1024:.1f} KiB source file -> "
+                f"{after / n / 1024:.1f} KiB sent ({(1 - after / before) * 100:.1f}% smaller)")